@@ -0,0 +1,20 @@
+"""
+Celery application for alx_travel_app.
+
+Start a worker for all queues with:
+    celery -A alx_travel_app worker -l info
+See Procfile for the per-queue worker profiles used in production.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_travel_app.settings')
+
+app = Celery('alx_travel_app')
+
+# All CELERY_* settings in settings.py configure the app
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Discover tasks.py in every installed app
+app.autodiscover_tasks()
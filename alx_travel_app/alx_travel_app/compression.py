@@ -0,0 +1,66 @@
+"""
+Response compression with brotli/gzip negotiation.
+
+Like Django's GZipMiddleware, but prefers brotli when the client accepts it and the
+`brotli` package is installed, and only compresses bodies of at least
+COMPRESSION_MIN_SIZE bytes (small JSON responses are not worth the CPU).
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+_accepts_br = _lazy_re_compile(r'\bbr\b')
+_accepts_gzip = _lazy_re_compile(r'\bgzip\b')
+_strong_etag = re.compile(r'^"')
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'application/xml')
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.gzip_level = getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.compress(request, response)
+
+    def compress(self, request, response):
+        if (response.streaming or response.has_header('Content-Encoding')
+                or len(response.content) < self.min_size):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        # The body depends on Accept-Encoding from here on
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and _accepts_br.search(accept_encoding):
+            compressed, encoding = brotli.compress(response.content, quality=self.brotli_quality), 'br'
+        elif _accepts_gzip.search(accept_encoding):
+            compressed, encoding = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0), 'gzip'
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The compressed body is no longer byte-identical to what the strong ETag described
+        etag = response.get('ETag')
+        if etag and _strong_etag.match(etag):
+            response['ETag'] = 'W/' + etag
+        return response
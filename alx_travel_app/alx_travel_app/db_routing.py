@@ -0,0 +1,159 @@
+"""
+Read-replica routing.
+
+Reads go to the primary unless a view explicitly opts in (ReplicaReadMixin or the
+replica_reads() context manager). Even then, the primary is used when:
+  * the current request has already written, or the client wrote within the last
+    REPLICA_PIN_SECONDS (read-your-writes, tracked with a cookie), or
+  * every replica is lagging more than REPLICA_MAX_LAG_SECONDS behind.
+A request (or replica_reads() block) picks its replica once, on its first replica
+read, so all its reads see the same replica state.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+PIN_COOKIE = 'pin_primary'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_pinned = ContextVar('pinned_to_primary', default=False)
+# alias chosen for this request's replica reads (PRIMARY when none was healthy)
+_chosen = ContextVar('chosen_replica', default=None)
+
+# alias -> (checked_at, lag_seconds)
+_lag_cache = {}
+
+
+def replica_aliases():
+    return [alias for alias in connections if alias != PRIMARY]
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary, cached for REPLICA_LAG_CHECK_INTERVAL.
+    A replica that has replayed everything it received is 0 behind, however long ago
+    the primary last wrote. Backends without a lag query (e.g. SQLite) report 0.
+    """
+    now = time.monotonic()
+    cached = _lag_cache.get(alias)
+    if cached and now - cached[0] < getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5):
+        return cached[1]
+
+    connection = connections[alias]
+    lag = 0.0
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # an idle primary sends nothing to replay, so the age of the last
+                # replayed transaction only counts while received WAL is still pending
+                cursor.execute(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+                    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )
+                lag = float(cursor.fetchone()[0])
+    except Exception:
+        # An unreachable replica is treated as infinitely behind
+        lag = float('inf')
+
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def choose_replica():
+    """Pick a random replica within the lag budget, or None"""
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 2)
+    healthy = [alias for alias in replica_aliases() if replica_lag(alias) <= max_lag]
+    return random.choice(healthy) if healthy else None
+
+
+@contextmanager
+def replica_reads():
+    """Allow reads in this block to be served by a replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    """
+    Fresh routing state for one unit of work: a request (ReplicaPinMiddleware) or
+    a background job, so a write or replica choice never carries over to the next
+    """
+    tokens = (_pinned.set(pinned), _replica_reads.set(False), _chosen.set(None))
+    try:
+        yield
+    finally:
+        for var, token in zip((_pinned, _replica_reads, _chosen), tokens):
+            var.reset(token)
+
+
+def pin_primary():
+    """Send every remaining read of this request to the primary"""
+    _pinned.set(True)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or _pinned.get():
+            return PRIMARY
+        alias = _chosen.get()
+        if alias is None:
+            alias = choose_replica() or PRIMARY
+            _chosen.set(alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any alias may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaPinMiddleware:
+    """
+    Resets routing state for every request, pins clients that wrote recently to
+    the primary, and sets the pin cookie after a write.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routing_scope(pinned=PIN_COOKIE in request.COOKIES):
+            response = self.get_response(request)
+            wrote = _pinned.get() and PIN_COOKIE not in request.COOKIES
+
+        if wrote or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10), httponly=True)
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    DRF view mixin: actions listed in `replica_actions` may read from a replica
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        if getattr(self, 'action', None) in self.replica_actions:
+            self._replica_token = _replica_reads.set(True)
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
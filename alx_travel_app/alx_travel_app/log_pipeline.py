@@ -0,0 +1,217 @@
+"""
+Non-blocking structured logging for the chapa_payment logger.
+
+Request threads pay for the sampling decision, a snapshot of the record and a
+put_nowait() onto a bounded queue. The snapshot formats the message and any
+traceback, and replaces the extras with redacted, capped copies (once per
+record, whatever the number of outputs), so nothing the writer sees can still be
+changed by the caller. A background writer thread then renders each record as one
+JSON line and writes it. When the queue is full records are dropped and counted
+rather than blocking the request.
+
+Wired up in settings.LOGGING; see BackgroundQueueHandler.
+"""
+import atexit
+import json
+import uuid
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from functools import cache
+from logging.handlers import QueueHandler, WatchedFileHandler
+
+# LogRecord attributes that are not `extra=` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Keys whose values never reach the log output (matched case-insensitively as substrings)
+REDACTED_KEYS = ('authorization', 'secret', 'password', 'token', 'api_key', 'cookie')
+REDACTED = '***'
+
+# Extras of these types are kept as they are; anything else mutable is copied or stringified
+_IMMUTABLE = (str, int, float, bool, type(None), Decimal, date, datetime, time, timedelta, uuid.UUID)
+
+
+def _is_sensitive(key):
+    key = str(key).lower()
+    return any(marker in key for marker in REDACTED_KEYS)
+
+
+def redact(value):
+    """
+    Copy of `value` with sensitive dict keys masked, at any depth. Containers are
+    copied and other mutable objects become their str(), which is how they would
+    be written anyway.
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if _is_sensitive(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [redact(item) for item in value]
+    if isinstance(value, _IMMUTABLE):
+        return value
+    return str(value)
+
+
+@cache
+def _orjson():
+    # imported by the writer thread on first use, not when LOGGING is configured at boot
+    try:
+        import orjson
+    except ImportError:  # pragma: no cover - orjson is optional
+        return None
+    return orjson
+
+
+def _dumps(value):
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, default=str)
+
+
+def cap(value, limit):
+    """Strings and containers larger than `limit` characters become a truncated string"""
+    if isinstance(value, str):
+        text = value
+    elif isinstance(value, (dict, list, tuple)):
+        text = _dumps(value)
+        if len(text) <= limit:
+            return value
+    else:
+        return value
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}...[truncated {len(text) - limit} chars]'
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep every record at or above `level`; keep records below it (debug
+    payload dumps) with probability `rate`.
+    """
+    def __init__(self, rate=1.0, level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+
+    def filter(self, record):
+        return record.levelno >= self.level or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extras and traceback"""
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return _dumps(entry)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Queue in front of a stream or file written by a background thread.
+
+    The writer thread is started on first use and again in a forked child
+    (gunicorn/celery prefork workers), since threads do not survive fork().
+    """
+    def __init__(self, stream=None, filename=None, queue_size=10000, max_field_chars=2000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        self.max_field_chars = max_field_chars
+        self.dropped = 0
+        if filename:
+            self.target = WatchedFileHandler(filename, delay=True)
+        else:
+            self.target = logging.StreamHandler(stream or sys.stderr)
+        self._pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.flush_and_stop)
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # forked: the parent's queue contents and writer thread belong to the parent
+                self.queue = queue.Queue(maxsize=self.queue_size)
+            self.target.setFormatter(self.formatter or JSONFormatter())
+            self._thread = threading.Thread(target=self._write_loop, name='log-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Runs on the calling thread, so that the writer only sees values the caller can no
+        # longer change: the message is formatted, the traceback rendered and the extras
+        # replaced by redacted copies. Unlike QueueHandler the record itself is not copied;
+        # this handler is the only consumer of the chapa_payment records.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or JSONFormatter()).formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in list(vars(record).items()):
+            if key in _RECORD_ATTRS or key.startswith('_'):
+                continue
+            if _is_sensitive(key):
+                setattr(record, key, REDACTED)
+            else:
+                setattr(record, key, cap(redact(value), self.max_field_chars))
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_writer()
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _write_loop(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+            finally:
+                self.queue.task_done()
+
+    def flush_and_stop(self, timeout=5.0):
+        """Drain the queue and stop the writer (called at exit)"""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self.target.flush()
+
+    def close(self):
+        self.flush_and_stop()
+        self.target.close()
+        super().close()
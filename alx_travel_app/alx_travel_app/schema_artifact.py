@@ -0,0 +1,44 @@
+"""
+Serves the prebuilt OpenAPI schema (see `manage.py generate_schema`).
+
+The artifact is read once per process and re-read only when the file changes on
+disk. Responses carry a strong ETag so clients revalidate with a 304.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition, require_GET
+
+_artifact = {'mtime': None, 'body': None, 'etag': None}
+
+
+def load_artifact():
+    """Return (body, etag) for the schema artifact, or (None, None) if it has not been built"""
+    path = settings.OPENAPI_SCHEMA_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+
+    if mtime != _artifact['mtime']:
+        with open(path, 'rb') as f:
+            body = f.read()
+        _artifact.update(mtime=mtime, body=body, etag=f'"{hashlib.sha256(body).hexdigest()}"')
+    return _artifact['body'], _artifact['etag']
+
+
+def _etag(request):
+    return load_artifact()[1]
+
+
+@require_GET
+@condition(etag_func=_etag)
+def schema_artifact_view(request):
+    body, etag = load_artifact()
+    if body is None:
+        raise Http404('OpenAPI schema has not been generated; run `manage.py generate_schema`.')
+    response = HttpResponse(body, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=300'
+    return response
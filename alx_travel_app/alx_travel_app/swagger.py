@@ -3,15 +3,17 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+api_info = openapi.Info(
+    title="ALX Travel API",
+    default_version="v1",
+    description="API documentation for ALX Travel App",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="support@alxtravel.com"),
+    license=openapi.License(name="BSD License"),
+)
+
 schema_view = get_schema_view(
-    openapi.Info(
-        title="ALX Travel API",
-        default_version="v1",
-        description="API documentation for ALX Travel App",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="support@alxtravel.com"),
-        license=openapi.License(name="BSD License"),
-    ),
+    api_info,
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
@@ -14,12 +14,39 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
-from .swagger import schema_view
+from django.urls import include, path
+
+_docs_views = {}
+
+
+def lazy_docs_view(renderer):
+    """
+    Swagger/Redoc views that only import drf_yasg (and build the schema view)
+    the first time the route is hit, keeping it out of worker boot
+    """
+    def view(request, *args, **kwargs):
+        if renderer not in _docs_views:
+            from .swagger import schema_view
+            _docs_views[renderer] = schema_view.with_ui(renderer, cache_timeout=0)
+        return _docs_views[renderer](request, *args, **kwargs)
+    return view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
\ No newline at end of file
+    path('api/', include('listings.urls')),
+]
+
+if settings.OPENAPI_SCHEMA_STATIC:
+    from .schema_artifact import schema_artifact_view
+    urlpatterns += [
+        path('openapi.json', schema_artifact_view, name='schema-artifact'),
+    ]
+
+if settings.API_DOCS_ENABLED:
+    urlpatterns += [
+        path('swagger/', lazy_docs_view('swagger'), name='schema-swagger-ui'),
+        path('redoc/', lazy_docs_view('redoc'), name='schema-redoc'),
+    ]
\ No newline at end of file
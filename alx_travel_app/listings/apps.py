@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        from .authentication import connect_signals as connect_auth_signals
+        from .signals import connect_signals
+        connect_auth_signals()
+        connect_signals()
@@ -0,0 +1,73 @@
+# Moving finished booking history out of the hot tables
+# A booking is archivable once it is completed or cancelled, ended before the cutoff
+# and has no payment still in flight (confirmed stays are completed by the
+# complete_ended_bookings task once they end). archive_batch() moves one batch (bookings, their
+# payments and payment events) in its own short transaction: rows locked by a concurrent
+# request are skipped (on PostgreSQL) rather than waited for, and a crash between
+# batches leaves every row in exactly one place, so the command can simply be re-run.
+import time
+
+from django.db import transaction
+
+from .models import (
+    ArchivedBooking, ArchivedPayment, ArchivedPaymentEvent, Booking, Payment, PaymentEvent,
+)
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def archivable(cutoff):
+    """Bookings that may be archived: finished, ended before `cutoff`, payment settled"""
+    return (
+        Booking.objects.filter(status__in=ARCHIVABLE_STATUSES, end_date__lt=cutoff)
+        .exclude(payment__status='pending')
+    )
+
+
+def archive_batch(cutoff, batch_size=500):
+    """Archive up to `batch_size` of the oldest archivable bookings. Returns the count moved."""
+    with transaction.atomic():
+        booking_ids = list(
+            archivable(cutoff)
+            .order_by('end_date', 'id')
+            .select_for_update(skip_locked=True, of=('self',))
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not booking_ids:
+            return 0
+
+        bookings = Booking.objects.filter(id__in=booking_ids).values(*_columns(Booking))
+        ArchivedBooking.objects.bulk_create([ArchivedBooking(**row) for row in bookings])
+
+        payments = list(Payment.objects.filter(booking_id__in=booking_ids).values(*_columns(Payment)))
+        ArchivedPayment.objects.bulk_create([ArchivedPayment(**row) for row in payments])
+
+        payment_ids = [row['transaction_id'] for row in payments]
+        events = PaymentEvent.objects.filter(payment_id__in=payment_ids).values(*_columns(PaymentEvent))
+        ArchivedPaymentEvent.objects.bulk_create([ArchivedPaymentEvent(**row) for row in events], batch_size=1000)
+
+        # children first, so the cascades find nothing left to collect
+        PaymentEvent.objects.filter(payment_id__in=payment_ids).delete()
+        Payment.objects.filter(transaction_id__in=payment_ids).delete()
+        Booking.objects.filter(id__in=booking_ids).delete()
+        return len(booking_ids)
+
+
+def archive(cutoff, batch_size=500, pause=0.0, max_batches=None):
+    """
+    Archive in batches until nothing archivable is left (or `max_batches` ran),
+    sleeping `pause` seconds between batches. Yields the count of each batch.
+    """
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            return
+        batches += 1
+        yield moved
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,239 @@
+# Cached authentication for the API
+# Token and session authentication both end in a User fetch (plus a token lookup
+# for TokenAuthentication) on every request. These classes put a small in-process
+# LRU in front of the shared Django cache so that a warm request does no auth queries.
+#
+# Only the user's field values are cached, never the password hash, and every hit
+# builds a fresh User, so per-instance state (permission caches, attributes set by a
+# view) never leaks from one request to the next. Saves and deletes drop the user
+# from the cache; a queryset update() of users, which sends no post_save, bumps a
+# version that is part of every shared key. Writes that bypass the ORM (raw SQL,
+# another service) are only picked up when the entries expire after AUTH_CACHE_TTL.
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+LOCAL_USER_KEY = 'auth:user:{}'
+USER_KEY = 'auth:user:{}:{}'
+TOKEN_KEY = 'auth:token:{}'
+VERSION_KEY = 'auth:version'
+
+# Stands in for the password in a cached entry: the HMAC that session authentication
+# compares against, so a cached user can be checked without loading the password
+SESSION_HASH = '_session_auth_hash'
+
+
+class LocalLRUCache:
+    """
+    Thread-safe, size-bounded in-process cache with a per-entry TTL
+    """
+    def __init__(self, max_size=1024, ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class AuthCache:
+    """
+    Two-tier cache of authenticated users and token -> user id mappings.
+
+    The local tier only lives for AUTH_CACHE_LOCAL_TTL seconds, which bounds how
+    long another worker process can keep serving an invalidated user. The
+    shared tier is invalidated immediately.
+    """
+    def __init__(self):
+        self.local = LocalLRUCache(
+            max_size=getattr(settings, 'AUTH_CACHE_LOCAL_MAX_SIZE', 1024),
+            ttl=getattr(settings, 'AUTH_CACHE_LOCAL_TTL', 5),
+        )
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, 'AUTH_CACHE_ALIAS', 'default')]
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_CACHE_TTL', 60)
+
+    def _get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def _set(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(key, value, self.ttl)
+
+    def _delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def _user_key(self, user_id):
+        return USER_KEY.format(self.shared.get_or_set(VERSION_KEY, 1, None), user_id)
+
+    def get_user(self, user_id):
+        # the version is only read on a local miss; the local tier is keyed without it
+        local_key = LOCAL_USER_KEY.format(user_id)
+        fields = self.local.get(local_key)
+        if fields is None:
+            fields = self.shared.get(self._user_key(user_id))
+            if fields is None:
+                return None
+            self.local.set(local_key, fields)
+        return self._build_user(fields)
+
+    def set_user(self, user):
+        fields = {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields if field.attname != 'password'
+        }
+        fields[SESSION_HASH] = user.get_session_auth_hash()
+        self.local.set(LOCAL_USER_KEY.format(user.pk), fields)
+        self.shared.set(self._user_key(user.pk), fields, self.ttl)
+
+    @staticmethod
+    def _build_user(fields):
+        fields = dict(fields)
+        session_hash = fields.pop(SESSION_HASH)
+        # the password is left deferred and is only loaded if something reads it
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+        user.get_session_auth_hash = lambda: session_hash
+        return user
+
+    def invalidate_user(self, user_id):
+        self.local.delete(LOCAL_USER_KEY.format(user_id))
+        self.shared.delete(self._user_key(user_id))
+
+    def invalidate_users(self):
+        """Drop every cached user, by moving the shared tier to a new version"""
+        try:
+            self.shared.incr(VERSION_KEY)
+        except ValueError:
+            self.shared.set(VERSION_KEY, 2, None)
+        self.local.clear()
+
+    def get_token_user_id(self, key):
+        return self._get(TOKEN_KEY.format(key))
+
+    def set_token(self, key, user_id):
+        self._set(TOKEN_KEY.format(key), user_id)
+
+    def invalidate_token(self, key):
+        self._delete(TOKEN_KEY.format(key))
+
+
+auth_cache = AuthCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that resolves the token and its user from auth_cache
+    """
+    def authenticate_credentials(self, key):
+        user_id = auth_cache.get_token_user_id(key)
+        user = auth_cache.get_user(user_id) if user_id is not None else None
+
+        if user is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = token.user
+            auth_cache.set_token(key, user.pk)
+            auth_cache.set_user(user)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user (used for every session-authenticated request)
+    is served from auth_cache
+    """
+    def get_user(self, user_id):
+        user = auth_cache.get_user(user_id)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            auth_cache.set_user(user)
+        return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Drop a user from the cache whenever the row changes (password, is_active, ...)"""
+    auth_cache.invalidate_user(instance.pk)
+
+
+def invalidate_user_cache_on_update(sender, **kwargs):
+    """Drop every cached user after a queryset update(), once it commits"""
+    transaction.on_commit(auth_cache.invalidate_users)
+
+
+def invalidate_token_cache(sender, instance, **kwargs):
+    """Drop a token mapping when the token is deleted (logout) or rotated"""
+    auth_cache.invalidate_token(instance.key)
+
+
+def invalidate_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        auth_cache.invalidate_user(user.pk)
+
+
+def connect_signals():
+    from django.contrib.auth.signals import user_logged_out
+    from django.db.models.signals import post_save, post_delete
+    from rest_framework.authtoken.models import Token
+
+    from .models import users_updated
+
+    User = get_user_model()
+    post_save.connect(invalidate_user_cache, sender=User, dispatch_uid='auth_cache_user_save')
+    post_delete.connect(invalidate_user_cache, sender=User, dispatch_uid='auth_cache_user_delete')
+    users_updated.connect(invalidate_user_cache_on_update, sender=User, dispatch_uid='auth_cache_user_update')
+    post_save.connect(invalidate_token_cache, sender=Token, dispatch_uid='auth_cache_token_save')
+    post_delete.connect(invalidate_token_cache, sender=Token, dispatch_uid='auth_cache_token_delete')
+    user_logged_out.connect(invalidate_on_logout, dispatch_uid='auth_cache_logout')
@@ -0,0 +1,347 @@
+# In-memory prefix index for search-box autocomplete over listing titles and addresses
+# Every word of a listing's title and address is a term. Terms live in one sorted list,
+# so the terms starting with a prefix are a contiguous range found with bisect; each term
+# has a posting list of listings ordered by popularity (bookings in the hot table), and
+# the ranges are merged lazily until enough suggestions are found. One- and two-letter
+# prefixes cover so many terms that their top suggestions are kept precomputed.
+#
+# Each process holds its own index. It is built on first use, patched from listing
+# saves/deletes made in this process (signals), caught up with rows changed elsewhere
+# every AUTOCOMPLETE_REFRESH_SECONDS (Listing.updated_at) and rebuilt in the background
+# every AUTOCOMPLETE_REBUILD_SECONDS, which also refreshes popularity.
+import heapq
+import logging
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Booking, Listing
+
+logger = logging.getLogger('chapa_payment')
+
+SHORT_PREFIX = 2          # prefixes up to this length have precomputed top suggestions
+CACHED_PER_PREFIX = 50    # suggestions kept per precomputed prefix
+MAX_TERMS = 16            # words indexed per listing
+MAX_TERM_LENGTH = 24
+MAX_SCAN = 2000           # candidates checked for multi-word queries
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase and strip accents, so 'Café' matches 'cafe'"""
+    text = text or ''
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def terms_of(*texts):
+    terms = []
+    for text in texts:
+        for word in _WORD.findall(normalize(text)):
+            # interned: the same word of many listings is stored once
+            word = sys.intern(word[:MAX_TERM_LENGTH])
+            if word not in terms:
+                terms.append(word)
+    return tuple(terms[:MAX_TERMS])
+
+
+class AutocompleteIndex:
+    """
+    Prefix index over (title, address) of up to `max_listings` listings.
+    Thread-safe: updates and lookups take the same lock.
+    """
+    def __init__(self, max_listings=200_000):
+        self.max_listings = max_listings
+        self._lock = threading.Lock()
+        self._slot_of = {}      # listing id -> slot
+        self._free = []         # slots of removed listings, reused
+        self._ids, self._titles, self._addresses, self._popularity, self._terms_of = [], [], [], [], []
+        self._terms = []        # sorted distinct terms
+        self._postings = {}     # term -> slots, best first
+        self._top = {}          # short prefix -> slots, best first
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, listing_id):
+        return listing_id in self._slot_of
+
+    def _rank(self, slot):
+        return (-self._popularity[slot], self._titles[slot], slot)
+
+    # Building and updating
+
+    def build(self, rows):
+        """Index (listing_id, title, address, popularity) rows, most popular kept when over the cap"""
+        if len(rows) > self.max_listings:
+            rows = heapq.nlargest(self.max_listings, rows, key=lambda row: row[3])
+        with self._lock:
+            for listing_id, title, address, popularity in rows:
+                slot = len(self._ids)
+                self._slot_of[listing_id] = slot
+                self._ids.append(listing_id)
+                self._titles.append(title)
+                self._addresses.append(address)
+                self._popularity.append(popularity)
+                terms = terms_of(title, address)
+                self._terms_of.append(terms)
+                for term in terms:
+                    self._postings.setdefault(term, []).append(slot)
+            for postings in self._postings.values():
+                postings.sort(key=self._rank)
+            self._terms = sorted(self._postings)
+            for prefix in {term[:length] for term in self._terms for length in range(1, SHORT_PREFIX + 1)}:
+                self._top[prefix] = list(islice(self._merged(prefix), CACHED_PER_PREFIX))
+        return self
+
+    def upsert(self, listing_id, title, address, popularity):
+        with self._lock:
+            slot = self._slot_of.get(listing_id)
+            if slot is not None:
+                if (self._titles[slot], self._addresses[slot], self._popularity[slot]) == (title, address, popularity):
+                    return
+                self._unlink(slot)
+            elif len(self._slot_of) >= self.max_listings:
+                # full: picked up by the next rebuild if it is popular enough
+                return
+            elif self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._ids)
+                self._ids.append(None)
+                self._titles.append(None)
+                self._addresses.append(None)
+                self._popularity.append(0)
+                self._terms_of.append(())
+            self._slot_of[listing_id] = slot
+            self._ids[slot], self._titles[slot], self._addresses[slot] = listing_id, title, address
+            self._popularity[slot] = popularity
+            self._link(slot, terms_of(title, address))
+
+    def remove(self, listing_id):
+        with self._lock:
+            slot = self._slot_of.pop(listing_id, None)
+            if slot is None:
+                return
+            self._unlink(slot)
+            self._ids[slot] = self._titles[slot] = self._addresses[slot] = None
+            self._free.append(slot)
+
+    def _link(self, slot, terms):
+        self._terms_of[slot] = terms
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                self._postings[term] = [slot]
+                self._terms.insert(bisect_left(self._terms, term), term)
+            else:
+                insort(postings, slot, key=self._rank)
+        for prefix in self._short_prefixes(terms):
+            top = self._top.setdefault(prefix, [])
+            insort(top, slot, key=self._rank)
+            del top[CACHED_PER_PREFIX:]
+
+    def _unlink(self, slot):
+        # must run before the slot's title/popularity change: the lists are ordered by them
+        terms = self._terms_of[slot]
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(self._position(postings, slot))
+            if not postings:
+                del self._postings[term]
+                self._terms.pop(bisect_left(self._terms, term))
+        for prefix in self._short_prefixes(terms):
+            top = self._top[prefix]
+            if slot in top:
+                top.remove(slot)
+                if len(top) == CACHED_PER_PREFIX - 1:
+                    # something from beyond the cached window moves up
+                    self._top[prefix] = list(islice(self._merged(prefix), CACHED_PER_PREFIX))
+        self._terms_of[slot] = ()
+
+    def _position(self, slots, slot):
+        index = bisect_left(slots, self._rank(slot), key=self._rank)
+        while slots[index] != slot:
+            index += 1
+        return index
+
+    @staticmethod
+    def _short_prefixes(terms):
+        return {term[:length] for term in terms for length in range(1, min(SHORT_PREFIX, len(term)) + 1)}
+
+    # Lookups
+
+    def _merged(self, prefix):
+        """Slots with a term starting with `prefix`, best first, each once"""
+        low = bisect_left(self._terms, prefix)
+        high = bisect_left(self._terms, prefix + '\U0010ffff', low)
+        if high - low == 1:
+            yield from self._postings[self._terms[low]]
+            return
+        seen = set()
+        for slot in heapq.merge(*(self._postings[term] for term in self._terms[low:high]), key=self._rank):
+            if slot not in seen:
+                seen.add(slot)
+                yield slot
+
+    def _candidates(self, prefix):
+        if len(prefix) <= SHORT_PREFIX:
+            top = self._top.get(prefix, [])
+            yield from top
+            if len(top) < CACHED_PER_PREFIX:
+                return
+            # beyond the cached window
+            yield from islice(self._merged(prefix), CACHED_PER_PREFIX, None)
+            return
+        yield from self._merged(prefix)
+
+    def suggest(self, query, limit=10):
+        """
+        Up to `limit` (id, title, address) whose words start with every word of
+        `query`, most popular first
+        """
+        words = _WORD.findall(normalize(query))
+        if not words or limit <= 0:
+            return []
+        words = [word[:MAX_TERM_LENGTH] for word in words]
+        # drive the search with the longest (usually most selective) word, check the rest per candidate
+        driver = max(words, key=len)
+        others = [word for word in words if word != driver]
+        results = []
+        with self._lock:
+            candidates = self._candidates(driver)
+            if others:
+                candidates = islice(candidates, MAX_SCAN)
+            for slot in candidates:
+                terms = self._terms_of[slot]
+                if all(any(term.startswith(word) for term in terms) for word in others):
+                    results.append((self._ids[slot], self._titles[slot], self._addresses[slot]))
+                    if len(results) == limit:
+                        break
+        return results
+
+
+# Process-wide index
+
+_index = None
+_state = {'built_at': 0.0, 'checked_at': 0.0, 'mark': None, 'rows': 0}
+_build_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _popularity(listing_ids=None):
+    bookings = Booking.objects.order_by()
+    if listing_ids is not None:
+        bookings = bookings.filter(listing_id__in=listing_ids)
+    return dict(bookings.values_list('listing_id').annotate(count=Count('id')))
+
+
+def _listing_rows(listings):
+    return listings.order_by().values_list('id', 'title', 'address', 'updated_at')
+
+
+def build_index():
+    """A fresh index of every listing, with the bookkeeping for later catch-ups"""
+    started = time.monotonic()
+    popularity = _popularity()
+    mark = None
+    rows = []
+    for listing_id, title, address, updated_at in _listing_rows(Listing.objects.all()).iterator(chunk_size=5000):
+        rows.append((listing_id, title, address, popularity.get(listing_id, 0)))
+        if mark is None or updated_at > mark:
+            mark = updated_at
+    index = AutocompleteIndex(settings.AUTOCOMPLETE_MAX_LISTINGS).build(rows)
+    logger.info("Built autocomplete index", extra={
+        'listings': len(index),
+        'seconds': round(time.monotonic() - started, 2),
+        'action': 'autocomplete_built'
+    })
+    return index, {'built_at': time.monotonic(), 'checked_at': time.monotonic(), 'mark': mark, 'rows': len(rows)}
+
+
+def _swap(index, state):
+    global _index
+    _index = index
+    _state.update(state)
+
+
+def _rebuild_in_background():
+    def run():
+        try:
+            _swap(*build_index())
+        finally:
+            _refresh_lock.release()
+    threading.Thread(target=run, name='autocomplete-rebuild', daemon=True).start()
+
+
+def _catch_up():
+    """
+    Apply listings changed (in any process) since the last check. Returns True when
+    fewer listings exist than expected, i.e. another process deleted some.
+    """
+    listings = Listing.objects.all()
+    if _state['mark'] is not None:
+        listings = listings.filter(updated_at__gt=_state['mark'])
+    changed = list(_listing_rows(listings))
+    added = 0
+    if changed:
+        popularity = _popularity([row[0] for row in changed])
+        for listing_id, title, address, updated_at in changed:
+            added += listing_id not in _index
+            _index.upsert(listing_id, title, address, popularity.get(listing_id, 0))
+            _state['mark'] = updated_at if _state['mark'] is None else max(_state['mark'], updated_at)
+    _state['checked_at'] = time.monotonic()
+    rows = Listing.objects.count()
+    deleted_elsewhere = rows < _state['rows'] + added
+    _state['rows'] = rows
+    return deleted_elsewhere
+
+
+def get_index():
+    """This process's index: built on first use, caught up and rebuilt as configured"""
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _swap(*build_index())
+        return _index
+
+    now = time.monotonic()
+    if now - _state['checked_at'] >= settings.AUTOCOMPLETE_REFRESH_SECONDS and _refresh_lock.acquire(blocking=False):
+        # one request per process does the upkeep; the others keep reading the current index
+        rebuild = now - _state['built_at'] >= settings.AUTOCOMPLETE_REBUILD_SECONDS
+        try:
+            rebuild = _catch_up() or rebuild
+        except Exception:
+            logger.exception("Autocomplete catch-up failed", extra={'action': 'autocomplete_refresh_failed'})
+        if rebuild:
+            _rebuild_in_background()  # releases the lock when done
+        else:
+            _refresh_lock.release()
+    return _index
+
+
+def listing_saved(listing_id):
+    # signal handlers only patch an index this process has already built
+    if _index is None:
+        return
+    row = _listing_rows(Listing.objects.filter(pk=listing_id)).first()
+    if row is None:
+        return
+    _state['rows'] += listing_id not in _index
+    _index.upsert(row[0], row[1], row[2], _popularity([listing_id]).get(listing_id, 0))
+
+
+def listing_deleted(listing_id):
+    if _index is not None:
+        _state['rows'] -= 1
+        _index.remove(listing_id)
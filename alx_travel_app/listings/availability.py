@@ -0,0 +1,56 @@
+# Date availability of listings
+# A listing's dates are taken by its active (pending/confirmed) bookings and by the
+# blocks imported from external calendars. Every availability check goes through here
+# so both are always honoured.
+from .models import Booking, CalendarBlock, Listing
+
+
+def exclude_unavailable(listings, start_date, end_date):
+    """Drop listings that are booked or blocked for any night in [start_date, end_date)"""
+    return (
+        listings
+        .exclude(id__in=Booking.objects.overlapping(start_date, end_date).values('listing_id'))
+        .exclude(id__in=CalendarBlock.objects.overlapping(start_date, end_date).values('listing_id'))
+    )
+
+
+def is_available(listing_id, start_date, end_date, exclude_booking_ids=()):
+    """
+    No active booking (other than `exclude_booking_ids`) or calendar block of the
+    listing overlaps [start_date, end_date)
+    """
+    return not (
+        Booking.objects.overlapping(start_date, end_date).filter(listing_id=listing_id)
+        .exclude(id__in=exclude_booking_ids).exists()
+        or CalendarBlock.objects.overlapping(start_date, end_date).filter(listing_id=listing_id).exists()
+    )
+
+
+def lock_listings(listing_ids):
+    """
+    Lock the listings' rows until the current transaction ends. Every path that checks
+    availability and then writes bookings takes it before the check, so two requests
+    cannot both find the same dates free. Must be called inside transaction.atomic().
+    """
+    return {
+        listing.id: listing
+        for listing in Listing.objects.select_for_update().filter(id__in=listing_ids).order_by('id')
+    }
+
+
+def busy_ranges(listing_ids, start_date, end_date, exclude_booking_ids=()):
+    """
+    (listing_id, start_date, end_date) of every booking and block of `listing_ids`
+    that overlaps [start_date, end_date); one query for each source.
+    """
+    yield from (
+        Booking.objects.overlapping(start_date, end_date)
+        .filter(listing_id__in=listing_ids)
+        .exclude(id__in=exclude_booking_ids)
+        .values_list('listing_id', 'start_date', 'end_date')
+    )
+    yield from (
+        CalendarBlock.objects.overlapping(start_date, end_date)
+        .filter(listing_id__in=listing_ids)
+        .values_list('listing_id', 'start_date', 'end_date')
+    )
@@ -0,0 +1,206 @@
+# Bulk booking creation and rescheduling for agency partners
+# A batch of N items costs a fixed number of queries: users and listings (or the
+# bookings being moved) are resolved with one IN query each, the active bookings and
+# calendar blocks that could collide are read with one range query each, overlaps are
+# checked in memory, and the accepted rows are written with bulk_create/bulk_update in
+# one transaction.
+# Items are independent: an invalid item is reported and the others still go through.
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .availability import busy_ranges, lock_listings
+from .models import Booking, OutboxEvent, User
+from .serializers import BulkBookingItemSerializer, BulkRescheduleItemSerializer
+
+
+def can_act_for_others(user):
+    """Staff and agency partners may book and reschedule for any user"""
+    return user.is_staff or user.role == 'agency'
+
+
+class _Calendar:
+    """
+    Busy date ranges of one listing, merged into disjoint [start, end) intervals
+    sorted by start, so a free-slot check is a single bisect.
+    """
+    def __init__(self, intervals=()):
+        self.starts, self.ends = [], []
+        for start, end in sorted(intervals):
+            if self.ends and start < self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def is_free(self, start, end):
+        # the last interval starting before `end` has the latest end of all of them
+        index = bisect_left(self.starts, end)
+        return index == 0 or self.ends[index - 1] <= start
+
+    def add(self, start, end):
+        # only called for free ranges, so the intervals stay disjoint
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+
+
+def _load_calendars(listing_ids, items, exclude_ids=()):
+    """Active bookings and calendar blocks of `listing_ids` inside the batch's date window"""
+    if not items:
+        return {}
+    window_start = min(item['start_date'] for item in items)
+    window_end = max(item['end_date'] for item in items)
+    busy = defaultdict(list)
+    for listing_id, start, end in busy_ranges(listing_ids, window_start, window_end, exclude_booking_ids=exclude_ids):
+        busy[listing_id].append((start, end))
+    return {listing_id: _Calendar(busy[listing_id]) for listing_id in listing_ids}
+
+
+def _validate_items(serializer_class, items):
+    """Return ({index: validated_data}, {index: errors}) for the raw request items"""
+    valid, errors = {}, {}
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+    return valid, errors
+
+
+def _results(count, outcomes, errors):
+    return [
+        {'index': index, 'status': 'error', 'errors': errors[index]} if index in errors
+        else {'index': index, **outcomes[index]}
+        for index in range(count)
+    ]
+
+
+def _price(listing, start_date, end_date):
+    return listing.price_per_night * (end_date - start_date).days
+
+
+def bulk_create_bookings(items, acting_user):
+    """
+    Create pending bookings for `items` (dicts with user_id, listing_id,
+    start_date, end_date). Returns one result per item, in request order.
+    """
+    valid, errors = _validate_items(BulkBookingItemSerializer, items)
+    if not can_act_for_others(acting_user):
+        for index, data in list(valid.items()):
+            if data['user_id'] != acting_user.id:
+                errors[index] = {'user_id': ['You can only create bookings for yourself.']}
+                del valid[index]
+
+    outcomes = {}
+    with transaction.atomic():
+        user_ids = {data['user_id'] for data in valid.values()}
+        listing_ids = {data['listing_id'] for data in valid.values()}
+        users = User.objects.in_bulk(user_ids)
+        # Locking the listings serialises concurrent requests for the same listings
+        listings = lock_listings(listing_ids)
+        calendars = _load_calendars(listings.keys(), list(valid.values()))
+
+        bookings = []
+        for index, data in valid.items():
+            listing = listings.get(data['listing_id'])
+            if data['user_id'] not in users:
+                errors[index] = {'user_id': ['User not found.']}
+            elif listing is None:
+                errors[index] = {'listing_id': ['Listing not found.']}
+            elif not calendars[listing.id].is_free(data['start_date'], data['end_date']):
+                errors[index] = {'non_field_errors': ['The listing is not available for these dates.']}
+            else:
+                calendars[listing.id].add(data['start_date'], data['end_date'])
+                booking = Booking(
+                    listing=listing, user=users[data['user_id']],
+                    start_date=data['start_date'], end_date=data['end_date'],
+                    total_price=_price(listing, data['start_date'], data['end_date']),
+                )
+                bookings.append(booking)
+                outcomes[index] = {'status': 'created', 'booking_id': str(booking.id)}
+
+        Booking.objects.bulk_create(bookings)
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(aggregate_type='booking', aggregate_id=str(booking.id), event_type='booking.created',
+                        payload={'booking_id': str(booking.id)})
+            for booking in bookings
+        ])
+    return _results(len(items), outcomes, errors)
+
+
+def bulk_reschedule_bookings(items, acting_user):
+    """
+    Move active bookings to new dates (dicts with booking_id, start_date,
+    end_date) and re-price them. Returns one result per item, in request order.
+
+    A booking's own current dates never block its move, but the current dates
+    of the other bookings in the batch do, so bookings cannot swap dates in
+    a single request.
+    """
+    valid, errors = _validate_items(BulkRescheduleItemSerializer, items)
+
+    outcomes = {}
+    with transaction.atomic():
+        bookings = (
+            Booking.objects.select_for_update()
+            .select_related('listing')
+            .in_bulk({data['booking_id'] for data in valid.values()})
+        )
+        movable = {}
+        seen = set()
+        for index, data in valid.items():
+            booking = bookings.get(data['booking_id'])
+            if booking is None or (booking.user_id != acting_user.id and not can_act_for_others(acting_user)):
+                errors[index] = {'booking_id': ['Booking not found.']}
+            elif not booking.is_active:
+                errors[index] = {'booking_id': [f'Cannot reschedule a {booking.status} booking.']}
+            elif booking.id in seen:
+                errors[index] = {'booking_id': ['Booking appears more than once in the batch.']}
+            else:
+                seen.add(booking.id)
+                movable[index] = (booking, data)
+
+        listing_ids = {booking.listing_id for booking, _ in movable.values()}
+        lock_listings(listing_ids)
+        calendars = _load_calendars(listing_ids, [data for _, data in movable.values()], exclude_ids=seen)
+        # current dates of the batch's bookings, captured before any of them moves, as sorted
+        # starts and ends per listing: the ranges overlapping [start, end) are those starting
+        # before `end` minus those ending by `start`
+        held = defaultdict(lambda: ([], []))
+        for booking, _ in movable.values():
+            starts, ends = held[booking.listing_id]
+            starts.append(booking.start_date)
+            ends.append(booking.end_date)
+        for starts, ends in held.values():
+            starts.sort()
+            ends.sort()
+
+        now = timezone.now()
+        moved = []
+        for index, (booking, data) in movable.items():
+            start, end = data['start_date'], data['end_date']
+            starts, ends = held[booking.listing_id]
+            overlapping = bisect_left(starts, end) - bisect_right(ends, start)
+            blocked_by_batch = overlapping > (booking.start_date < end and booking.end_date > start)
+            if blocked_by_batch or not calendars[booking.listing_id].is_free(start, end):
+                errors[index] = {'non_field_errors': ['The listing is not available for these dates.']}
+                continue
+            calendars[booking.listing_id].add(start, end)
+            booking.start_date, booking.end_date = start, end
+            booking.total_price = _price(booking.listing, start, end)
+            booking.updated_at = now
+            moved.append(booking)
+            outcomes[index] = {'status': 'rescheduled', 'booking_id': str(booking.id)}
+
+        Booking.objects.bulk_update(moved, ['start_date', 'end_date', 'total_price', 'updated_at'])
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(aggregate_type='booking', aggregate_id=str(booking.id), event_type='booking.rescheduled',
+                        payload={'booking_id': str(booking.id), 'start_date': booking.start_date.isoformat(),
+                                 'end_date': booking.end_date.isoformat()})
+            for booking in moved
+        ])
+    return _results(len(items), outcomes, errors)
@@ -0,0 +1,199 @@
+# Client-side concurrency control for calls to Chapa
+# Every Chapa request takes a slot from the process-wide ChapaLimiter. At most
+# CHAPA_MAX_IN_FLIGHT requests run at once; the rest wait in a priority queue
+# (fresh checkouts before verifications before retries, FIFO within a priority)
+# until a slot frees up or their deadline passes. When Chapa answers 429 the
+# limiter stops dispatching for the Retry-After period instead of letting every
+# queued request hit the same wall.
+#
+# Slots are counted per process, and queueing only happens between the threads of
+# one process (gunicorn runs gthread workers, see the Procfile). Chapa therefore
+# sees at most CHAPA_MAX_IN_FLIGHT * web worker processes from the web tier, plus
+# one call per Celery process on the payments queue (prefork children run a task at
+# a time). A 429 pause is shared: it is also written to the shared cache, and every
+# process folds it in before queueing, so one worker's 429 holds back the others.
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import caches
+
+logger = logging.getLogger('chapa_payment')
+
+PRIORITY_CHECKOUT = 0
+PRIORITY_VERIFY = 1
+PRIORITY_RETRY = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CHECKOUT: 'checkout',
+    PRIORITY_VERIFY: 'verify',
+    PRIORITY_RETRY: 'retry',
+}
+
+# waits longer than this are logged
+SLOW_WAIT_SECONDS = 1.0
+
+# shared-cache key holding the wall-clock time until which Chapa asked us to back off
+PAUSE_KEY = 'chapa:paused_until'
+
+
+class ChapaBusy(Exception):
+    """
+    No slot could be obtained before the deadline (or the queue is full).
+    `retry_after` is a hint in seconds for the client.
+    """
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LimiterMetrics:
+    """Counters kept by ChapaLimiter; read them with ChapaLimiter.snapshot()"""
+    def __init__(self):
+        self.acquired = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queue_depth_max = 0
+        self.acquired_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+
+
+class ChapaLimiter:
+    def __init__(self, max_in_flight, max_queue, queue_timeout, throttle_backoff=1.0, cache_alias=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.throttle_backoff = throttle_backoff
+        # shared cache for 429 pauses; None keeps them local to this limiter
+        self.cache_alias = cache_alias
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self.metrics = LimiterMetrics()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_CHECKOUT, timeout=None):
+        """Hold one in-flight slot for the duration of the block"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority=PRIORITY_CHECKOUT, timeout=None):
+        """
+        Wait for a slot, highest priority (lowest number) first. Raises
+        ChapaBusy when the queue is full or `timeout` seconds pass.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        enqueued_at = time.monotonic()
+        deadline = enqueued_at + timeout
+        # lists compare by (priority, sequence); the sequence is unique so entries never tie
+        entry = [priority, next(self._sequence)]
+        shared_pause = self._shared_pause()
+
+        with self._cond:
+            if shared_pause > 0:
+                self._paused_until = max(self._paused_until, enqueued_at + shared_pause)
+            if len(self._waiting) >= self.max_queue:
+                self.metrics.rejected += 1
+                raise ChapaBusy('Too many payment requests are queued.', retry_after=self._retry_hint())
+            heapq.heappush(self._waiting, entry)
+            self.metrics.queue_depth_max = max(self.metrics.queue_depth_max, len(self._waiting))
+
+            while True:
+                now = time.monotonic()
+                if (self._waiting[0] is entry and self._in_flight < self.max_in_flight
+                        and now >= self._paused_until):
+                    heapq.heappop(self._waiting)
+                    self._in_flight += 1
+                    # the next waiter may be able to go as well
+                    self._cond.notify_all()
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.metrics.timed_out += 1
+                    self._cond.notify_all()
+                    raise ChapaBusy('Timed out waiting for the payment provider.', retry_after=self._retry_hint())
+                if now < self._paused_until:
+                    remaining = min(remaining, self._paused_until - now)
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - enqueued_at
+            self.metrics.acquired += 1
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            self.metrics.acquired_by_priority[name] = self.metrics.acquired_by_priority.get(name, 0) + 1
+            self.metrics.wait_total += waited
+            self.metrics.wait_max = max(self.metrics.wait_max, waited)
+
+        if waited >= SLOW_WAIT_SECONDS:
+            logger.warning("Slow wait for a Chapa slot", extra={
+                'priority': PRIORITY_NAMES.get(priority, priority),
+                'waited_ms': round(waited * 1000),
+                'action': 'chapa_limiter_slow_wait'
+            })
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def throttled(self, retry_after=None):
+        """Chapa answered 429: hold back all dispatching for `retry_after` seconds"""
+        pause = retry_after if retry_after is not None else self.throttle_backoff
+        with self._cond:
+            self.metrics.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        if self.cache_alias is not None and pause > 0:
+            try:
+                cache = caches[self.cache_alias]
+                cache.set(PAUSE_KEY, max(time.time() + pause, cache.get(PAUSE_KEY) or 0), max(1, round(pause)))
+            except Exception:
+                # the shared cache is down: the pause still holds for this process
+                pass
+        logger.warning("Chapa throttled us, pausing requests", extra={
+            'pause_seconds': pause,
+            'action': 'chapa_limiter_throttled'
+        })
+
+    def _shared_pause(self):
+        """Seconds left of a pause another process recorded in the shared cache"""
+        if self.cache_alias is None:
+            return 0
+        try:
+            paused_until = caches[self.cache_alias].get(PAUSE_KEY)
+        except Exception:
+            return 0
+        return paused_until - time.time() if paused_until else 0
+
+    def _retry_hint(self):
+        # called with the lock held
+        return max(1, round(self._paused_until - time.monotonic()))
+
+    def snapshot(self):
+        """Current queue depth and in-flight count plus the cumulative counters"""
+        with self._cond:
+            metrics = self.metrics
+            return {
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._waiting),
+                'queue_depth_max': metrics.queue_depth_max,
+                'acquired': metrics.acquired,
+                'acquired_by_priority': dict(metrics.acquired_by_priority),
+                'rejected': metrics.rejected,
+                'timed_out': metrics.timed_out,
+                'throttled': metrics.throttled,
+                'wait_avg_ms': round(metrics.wait_total / metrics.acquired * 1000, 1) if metrics.acquired else 0.0,
+                'wait_max_ms': round(metrics.wait_max * 1000, 1),
+            }
@@ -1,11 +1,29 @@
 import requests
 import json
 import logging
+import threading
 from django.conf import settings
 from django.urls import reverse
+from .chapa_limiter import ChapaBusy, ChapaLimiter, PRIORITY_CHECKOUT, PRIORITY_VERIFY
 
 logger = logging.getLogger('chapa_payment')
 
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_chapa_service():
+    """
+    Process-wide ChapaService, built on first use rather than at import/boot time
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ChapaService()
+    return _service
+
+
 class ChapaService:
     def __init__(self):
         self.secret_key = settings.CHAPA_SECRET_KEY
@@ -22,11 +40,56 @@ class ChapaService:
             'secret_key_masked': masked_key,
             'action': 'chapa_service_init'
         })
+        self._session = None
+        # Caps concurrent calls to Chapa for this process and queues the overflow; 429
+        # pauses go through the shared cache so every process backs off together
+        self.limiter = ChapaLimiter(
+            max_in_flight=settings.CHAPA_MAX_IN_FLIGHT,
+            max_queue=settings.CHAPA_MAX_QUEUE,
+            queue_timeout=settings.CHAPA_QUEUE_TIMEOUT,
+            throttle_backoff=settings.CHAPA_THROTTLE_BACKOFF,
+            cache_alias=getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default'),
+        )
+        self.timeout = (settings.CHAPA_CONNECT_TIMEOUT, settings.CHAPA_READ_TIMEOUT)
+
+    @property
+    def session(self):
+        # HTTP session (and its connection pool) is only created on the first call to Chapa
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.headers.update(self.headers)
+        return self._session
+
+    def _send(self, method, url, priority, **kwargs):
+        """
+        Send a request through the limiter. Raises ChapaBusy when no slot frees
+        up in time or Chapa answers 429 (which also pauses the limiter).
+        """
+        with self.limiter.slot(priority):
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            self.limiter.throttled(retry_after)
+            raise ChapaBusy('Payment provider is rate limiting requests.', retry_after=retry_after or 1)
+        return response
+
+    @staticmethod
+    def _busy_result(error, message):
+        return {
+            'success': False,
+            'busy': True,
+            'retry_after': error.retry_after,
+            'error': str(error),
+            'message': message,
+        }
     
     def initiate_payment(self, amount, email, first_name, last_name, tx_ref, 
-                       return_url, currency='ETB', custom_title=None, custom_description=None):
+                       return_url, currency='ETB', custom_title=None, custom_description=None,
+                       priority=PRIORITY_CHECKOUT):
         """
         Initiate payment with Chapa API - Enhanced debugging
+        `priority` orders this call in the limiter queue (see chapa_limiter)
         """
         url = f"{self.base_url}/transaction/initialize"
         
@@ -57,22 +120,25 @@ class ChapaService:
             'action': 'payment_initiation_start'
         })
         
-        logger.debug("Chapa API Request Payload:", extra={
-            'payload': payload,
-            'headers': {k: '***' if 'Authorization' in k else v for k, v in self.headers.items()},
-            'action': 'chapa_request_details'
-        })
+        # Debug dumps are only built when enabled; secrets are masked by the logging pipeline
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Chapa API Request Payload:", extra={
+                'payload': payload,
+                'headers': self.headers,
+                'action': 'chapa_request_details'
+            })
         
         try:
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
+            response = self._send('POST', url, priority, json=payload)
             
             # Log the raw response for debugging
-            logger.debug("Chapa API Raw Response:", extra={
-                'status_code': response.status_code,
-                'headers': dict(response.headers),
-                'response_text': response.text,
-                'action': 'chapa_raw_response'
-            })
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Chapa API Raw Response:", extra={
+                    'status_code': response.status_code,
+                    'headers': dict(response.headers),
+                    'response_text': response.text,
+                    'action': 'chapa_raw_response'
+                })
             
             response.raise_for_status()
             
@@ -93,6 +159,15 @@ class ChapaService:
                 'transaction_id': data['data']['tx_ref'],
                 'response_data': data
             }
+
+        except ChapaBusy as e:
+            logger.warning("Chapa payment initiation deferred, provider busy", extra={
+                'transaction_id': tx_ref,
+                'error_message': str(e),
+                'retry_after': e.retry_after,
+                'action': 'payment_initiation_busy'
+            })
+            return self._busy_result(e, 'Payment provider is busy, please try again shortly')
             
         except requests.exceptions.RequestException as e:
             # Enhanced error logging
@@ -130,4 +205,57 @@ class ChapaService:
                 'success': False,
                 'error': str(e),
                 'message': 'Unexpected error during payment initiation'
-            }
\ No newline at end of file
+            }
+
+    def verify_payment(self, tx_ref, priority=PRIORITY_VERIFY):
+        """
+        Verify a transaction with Chapa API
+        """
+        url = f"{self.base_url}/transaction/verify/{tx_ref}"
+
+        logger.info("🔍 Verifying Chapa payment", extra={
+            'transaction_id': tx_ref,
+            'chapa_url': url,
+            'action': 'payment_verification_start'
+        })
+
+        try:
+            response = self._send('GET', url, priority)
+            response.raise_for_status()
+
+            data = response.json()
+
+            logger.info("✅ Chapa payment verified", extra={
+                'transaction_id': tx_ref,
+                'status': data.get('data', {}).get('status'),
+                'action': 'payment_verification_success'
+            })
+
+            return {
+                'success': True,
+                'status': data.get('data', {}).get('status'),
+                'response_data': data
+            }
+
+        except ChapaBusy as e:
+            logger.warning("Chapa payment verification deferred, provider busy", extra={
+                'transaction_id': tx_ref,
+                'error_message': str(e),
+                'retry_after': e.retry_after,
+                'action': 'payment_verification_busy'
+            })
+            return self._busy_result(e, 'Payment provider is busy')
+
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ Chapa payment verification failed", extra={
+                'transaction_id': tx_ref,
+                'error_type': type(e).__name__,
+                'error_message': str(e),
+                'action': 'payment_verification_failed'
+            })
+
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to verify payment with Chapa'
+            }
@@ -0,0 +1,72 @@
+# Conditional GET support (ETag / Last-Modified) for DRF viewsets
+# Versions are read with a single narrow query before anything is serialized:
+# retrieve() looks up the row's `version_fields`, list() aggregates their maxima
+# (plus a row count, so deletions change the tag) over the filtered queryset.
+# Lists carry an ETag only; Last-Modified is sent for single rows.
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    Adds strong ETags to list/retrieve (and Last-Modified to retrieve) and answers
+    304 when If-None-Match / If-Modified-Since match, before serialization runs.
+
+    `version_fields` are timestamp fields (may span relations) that change
+    whenever the serialized representation does.
+    """
+    version_fields = ('updated_at',)
+
+    def _make_etag(self, request, version):
+        # The same rows render differently per path/query (filters, pages) and media type
+        accepted = getattr(request, 'accepted_media_type', '')
+        raw = f'{request.get_full_path()}|{accepted}|{version}'
+        return quote_etag(hashlib.sha256(raw.encode()).hexdigest())
+
+    def _conditional(self, request, version, last_modified, build_response):
+        etag = self._make_etag(request, version)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+
+        response = build_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+            .order_by()
+            .values_list(*self.version_fields)
+            .first()
+        )
+        if row is None:
+            # Let the regular path raise the 404
+            return super().retrieve(request, *args, **kwargs)
+
+        timestamps = [value for value in row if value is not None]
+        last_modified = max(timestamps) if timestamps else None
+        return self._conditional(
+            request, row, last_modified,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
+
+    def list(self, request, *args, **kwargs):
+        aggregates = {f'max_{index}': Max(field) for index, field in enumerate(self.version_fields)}
+        version = self.filter_queryset(self.get_queryset()).order_by().aggregate(rows=Count('pk'), **aggregates)
+
+        # ETag only: deleting a row leaves max(updated_at) where it was, so a Last-Modified
+        # validator would answer 304 for a list that has lost rows
+        return self._conditional(
+            request, sorted(version.items()), None,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
@@ -0,0 +1,120 @@
+# Local stand-in for the Chapa API, for load tests of the payment path
+# Serves /transaction/initialize and /transaction/verify/<tx_ref> with configurable
+# latency. Like the real API under load it answers 429 (with Retry-After) once more
+# than `capacity` requests are in progress, and additionally at `throttle_rate`.
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeChapa:
+    """
+    Run with `with FakeChapa(...) as chapa:` and point CHAPA_BASE_URL at chapa.base_url
+    """
+    def __init__(self, latency=0.05, jitter=0.02, capacity=10, throttle_rate=0.0, retry_after=1, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.served = 0
+        self.throttled = 0
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'served': self.served, 'throttled': self.throttled, 'peak_active': self.peak_active}
+
+    def _enter(self):
+        """Count the request in; returns False when it should be throttled"""
+        with self._lock:
+            if self.active >= self.capacity or random.random() < self.throttle_rate:
+                self.throttled += 1
+                return False
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self.active -= 1
+            self.served += 1
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _serve(self, build):
+                if not fake._enter():
+                    self._reply(429, {'message': 'Too many requests', 'status': 'failed'},
+                                {'Retry-After': str(fake.retry_after)})
+                    return
+                try:
+                    time.sleep(max(0.0, fake.latency + random.uniform(-fake.jitter, fake.jitter)))
+                    self._reply(200, build())
+                finally:
+                    fake._leave()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.endswith('/transaction/initialize'):
+                    self._reply(404, {'message': 'Not found'})
+                    return
+                tx_ref = body.get('tx_ref', '')
+                self._serve(lambda: {
+                    'message': 'Hosted Link',
+                    'status': 'success',
+                    'data': {'checkout_url': f'https://checkout.example.test/{tx_ref}', 'tx_ref': tx_ref},
+                })
+
+            def do_GET(self):
+                if '/transaction/verify/' not in self.path:
+                    self._reply(404, {'message': 'Not found'})
+                    return
+                tx_ref = self.path.rsplit('/', 1)[-1]
+                self._serve(lambda: {
+                    'message': 'Payment details',
+                    'status': 'success',
+                    'data': {'tx_ref': tx_ref, 'status': 'success'},
+                })
+
+        return Handler
@@ -0,0 +1,209 @@
+# Sparse fieldsets: ?fields=...&expand=... for API serializers
+#
+#   ?fields=id,start_date,listing            -> listing rendered as its id
+#   ?fields=id,start_date,listing&expand=listing
+#                                            -> listing rendered as the full nested object
+#   ?fields=id,listing.title,listing.host.username
+#                                            -> nested objects limited to the listed fields
+#
+# Without `fields` every serializer renders exactly as before. The same spec is
+# used to trim the queryset: unrequested relations are neither joined nor
+# prefetched and the selected columns are pushed down into only().
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+def parse_fieldset(request):
+    """
+    Return (fields_tree, expand) from the query string, or (None, set()) when
+    no `fields` parameter was given. fields_tree maps names to sub-trees.
+    """
+    if request is None or request.method != 'GET':
+        return None, set()
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None, set()
+
+    tree = {}
+    for path in filter(None, (item.strip() for item in raw.split(','))):
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    expand = {item.strip() for item in request.query_params.get('expand', '').split(',') if item.strip()}
+    return tree, expand
+
+
+def _serializer_path(serializer):
+    path = []
+    node = serializer
+    while node.parent is not None:
+        if node.field_name:
+            path.append(node.field_name)
+        node = node.parent
+    return list(reversed(path))
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin that drops fields not named in ?fields= and renders
+    unexpanded nested relations as primary keys.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        tree, expand = parse_fieldset(self.context.get('request'))
+        if tree is None:
+            return fields
+
+        path = _serializer_path(self)
+        for name in path:
+            tree = tree.get(name)
+            if tree is None:
+                return fields
+        if not tree and '.'.join(path) in expand:
+            # an expanded relation with no sub-fields listed renders in full
+            return fields
+
+        pruned = {}
+        for name, subtree in tree.items():
+            if name not in fields:
+                continue
+            field = fields[name]
+            dotted = '.'.join(path + [name])
+            if _nested_serializer(field) is not None and not subtree and dotted not in expand:
+                many = isinstance(field, serializers.ListSerializer)
+                field = serializers.PrimaryKeyRelatedField(read_only=True, many=many, source=field.source)
+            pruned[name] = field
+        return pruned
+
+
+def _relation_kind(model, path):
+    """Walk an ORM path and return 'select', 'prefetch' or None for plain columns"""
+    kind = None
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if not field.is_relation:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return 'prefetch'
+        kind = 'select'
+        model = field.related_model
+    return kind
+
+
+def _is_forward_relation(model, path):
+    *parents, last = path.split('__')
+    for name in parents:
+        model = model._meta.get_field(name).related_model
+    return model._meta.get_field(last).concrete
+
+
+def _collect(serializer, model, prefix, plan, strict=True):
+    """
+    Fill plan (only/select/prefetch sets) for the fields `serializer` will render.
+    Returns False when a field's data needs can't be determined; with strict=False
+    such fields are skipped, their prefix is added to plan['partial'] and the rest
+    still collected.
+    """
+    dependencies = getattr(getattr(serializer, 'Meta', None), 'field_dependencies', {})
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        try:
+            known = _collect_field(name, field, model, prefix, plan, dependencies, strict)
+        except FieldDoesNotExist:
+            known = False
+        if not known:
+            if strict:
+                return False
+            plan['partial'].add(prefix)
+    return True
+
+
+def _collect_field(name, field, model, prefix, plan, dependencies, strict):
+    if isinstance(field, serializers.SerializerMethodField):
+        if name not in dependencies:
+            return False
+        sources = dependencies[name]
+    elif field.source == '*':
+        return False
+    else:
+        sources = [field.source.replace('.', '__')]
+
+    nested = _nested_serializer(field)
+    for source in sources:
+        path = prefix + source
+        parents = path.split('__')[:-1]
+        for index in range(1, len(parents) + 1):
+            parent = '__'.join(parents[:index])
+            if _relation_kind(model, parent) == 'prefetch':
+                plan['prefetch'].add(parent)
+                break
+            plan['select'].add(parent)
+        else:
+            kind = _relation_kind(model, path)
+            if nested is not None and kind == 'select':
+                plan['select'].add(path)
+                if not _collect(nested, model, path + '__', plan, strict):
+                    return False
+            elif kind == 'prefetch' or isinstance(field, ManyRelatedField):
+                plan['prefetch'].add(path)
+            elif isinstance(field, RelatedField) or kind is None:
+                plan['only'].add(path)
+            else:
+                plan['select'].add(path)
+    return True
+
+
+def relation_plan(serializer, model):
+    """
+    Relations `serializer` will read, as {'select': single-valued paths, 'prefetch':
+    many-valued paths, 'only': column paths}; fields whose data needs are unknown are
+    left out, and the prefixes of the serializers they belong to are in 'partial'
+    """
+    plan = {'only': set(), 'select': set(), 'prefetch': set(), 'partial': set()}
+    _collect(serializer, model, '', plan, strict=False)
+    return plan
+
+
+def project_queryset(queryset, serializer):
+    """
+    Restrict joins, prefetches and selected columns to what `serializer`
+    (already built with the request in its context) will render.
+    """
+    tree, _ = parse_fieldset(serializer.context.get('request'))
+    if tree is None:
+        return queryset
+
+    plan = {'only': set(), 'select': set(), 'prefetch': set()}
+    if not _collect(serializer, queryset.model, '', plan):
+        # Some field's data needs are unknown: keep the view's own joins and columns
+        return queryset
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if plan['select']:
+        queryset = queryset.select_related(*sorted(plan['select']))
+    if plan['prefetch']:
+        queryset = queryset.prefetch_related(*sorted(plan['prefetch']))
+    # a forward relation that is followed with select_related must not be deferred
+    columns = plan['only'] | {path for path in plan['select'] if _is_forward_relation(queryset.model, path)}
+    return queryset.only(*sorted(columns) or ['pk'])
+
+
+class SparseFieldsetViewMixin:
+    """
+    Viewset mixin applying project_queryset() to list/retrieve querysets
+    """
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method == 'GET' and self.action in ('list', 'retrieve'):
+            queryset = project_queryset(queryset, self.get_serializer())
+        return queryset
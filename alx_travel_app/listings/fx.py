@@ -0,0 +1,213 @@
+# Currency conversion for listing prices
+# Prices are stored in each listing's own currency. The FX table (units of each currency
+# per one unit of FX_BASE_CURRENCY) comes from FX_RATES_FILE when set, otherwise from the
+# FxRate table, and each process keeps it for FX_REFRESH_SECONDS.
+#
+# Conversion factors are derived once per target currency, so a page of results is
+# converted in one pass (convert_prices) and a price range in the caller's currency
+# becomes one pair of bounds per source currency (price_range), compared by the database
+# directly against price_per_night (listing_currency_price_idx), with no per-row
+# conversion in Python or SQL.
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import ROUND_CEILING, ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Q, Value, When
+
+from .models import FxRate
+
+logger = logging.getLogger('chapa_payment')
+
+CENT = Decimal('0.01')
+HALF_CENT = Decimal('0.005')
+# precision of the factors used in SQL ordering expressions
+FACTOR_PLACES = Decimal('1e-12')
+
+
+class UnknownCurrency(ValueError):
+    pass
+
+
+class RateTable:
+    """A loaded FX table. `rates` maps currency -> units per one base unit (base -> 1)."""
+    def __init__(self, base, rates, version, updated_at=None):
+        self.base = base
+        self.rates = rates
+        self.version = version
+        self.updated_at = updated_at
+        self._factors = {}
+
+    def __contains__(self, currency):
+        return currency in self.rates
+
+    def factors(self, target):
+        """currency -> multiplier converting an amount in that currency into `target`"""
+        factors = self._factors.get(target)
+        if factors is None:
+            if target not in self.rates:
+                raise UnknownCurrency(target)
+            units = self.rates[target]
+            factors = {currency: units / rate for currency, rate in self.rates.items()}
+            self._factors[target] = factors
+        return factors
+
+
+# Loading
+
+def _parse_rate(currency, value):
+    code = str(currency).strip().upper()
+    try:
+        rate = Decimal(str(value).strip())
+    except InvalidOperation:
+        rate = None
+    if len(code) != 3 or not code.isalpha() or rate is None or not rate.is_finite() or rate <= 0:
+        raise ValueError(f"Invalid exchange rate {currency!r}: {value!r}")
+    return code, rate
+
+
+def rebase(base, rates, target_base):
+    """`rates` (per one `base`) expressed per one `target_base`"""
+    rates = dict(rates)
+    rates.setdefault(base, Decimal(1))
+    if target_base not in rates:
+        raise ValueError(f"The rates have no {target_base} to rebase on")
+    units = rates[target_base]
+    return {currency: rate / units for currency, rate in rates.items()}
+
+
+def parse_rates_file(path):
+    """
+    Rates per one FX_BASE_CURRENCY from a JSON file ({"base": "USD", "rates": {"ETB": "57.1"}},
+    base defaulting to FX_BASE_CURRENCY) or a CSV file of currency,rate rows
+    """
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.endswith('.json'):
+            data = json.load(handle)
+            base = str(data.get('base') or settings.FX_BASE_CURRENCY).upper()
+            rows = data.get('rates', {}).items()
+        else:
+            base = settings.FX_BASE_CURRENCY
+            rows = [row for row in csv.reader(handle) if row and not row[0].startswith('#')]
+            if rows and rows[0][0].strip().lower() == 'currency':
+                rows = rows[1:]
+            rows = [row[:2] for row in rows]
+    rates = dict(_parse_rate(currency, value) for currency, value in rows)
+    return rebase(base, rates, settings.FX_BASE_CURRENCY)
+
+
+def load_rates():
+    """A fresh RateTable from FX_RATES_FILE or the FxRate table"""
+    base = settings.FX_BASE_CURRENCY
+    path = settings.FX_RATES_FILE
+    if path:
+        modified = os.stat(path).st_mtime
+        rates = parse_rates_file(path)
+        return RateTable(base, rates, f'file:{modified}',
+                         datetime.fromtimestamp(modified, tz=dt_timezone.utc))
+
+    rates, updated_at = {}, None
+    for currency, rate, row_updated_at in FxRate.objects.values_list('currency', 'rate', 'updated_at'):
+        rates[currency] = rate
+        updated_at = row_updated_at if updated_at is None else max(updated_at, row_updated_at)
+    rates.setdefault(base, Decimal(1))
+    version = f'db:{len(rates)}:{updated_at.isoformat() if updated_at else ""}'
+    return RateTable(base, rates, version, updated_at)
+
+
+# Process-wide table
+
+_table = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_rates():
+    """This process's FX table: loaded on first use, reloaded every FX_REFRESH_SECONDS"""
+    global _table, _loaded_at
+    if _table is not None and time.monotonic() - _loaded_at < settings.FX_REFRESH_SECONDS:
+        return _table
+    # one thread reloads; the others keep the current table (or wait for the first one)
+    if not _lock.acquire(blocking=_table is None):
+        return _table
+    try:
+        if _table is None or time.monotonic() - _loaded_at >= settings.FX_REFRESH_SECONDS:
+            try:
+                _table = load_rates()
+            except Exception:
+                if _table is None:
+                    raise
+                logger.exception("Reloading exchange rates failed", extra={'action': 'fx_reload_failed'})
+            _loaded_at = time.monotonic()
+        return _table
+    finally:
+        _lock.release()
+
+
+def invalidate():
+    """Reload the table on next use (after rates were changed in this process)"""
+    global _loaded_at
+    _loaded_at = 0.0
+
+
+def requested_currency(request):
+    """The currency prices are shown in: ?currency= or FX_BASE_CURRENCY"""
+    requested = request.query_params.get('currency') if request is not None else None
+    currency = (requested or settings.FX_BASE_CURRENCY).strip().upper()
+    if currency not in get_rates():
+        raise UnknownCurrency(currency)
+    return currency
+
+
+# Conversion
+
+def convert_prices(prices, currencies, target, rates=None):
+    """
+    `prices` (in the parallel `currencies`) converted into `target` and rounded to cents,
+    in one pass with one factor per currency; None where a currency has no rate
+    """
+    factors = (rates or get_rates()).factors(target)
+    converted = []
+    for price, currency in zip(prices, currencies):
+        factor = factors.get(currency)
+        if factor is None or price is None:
+            converted.append(None)
+        elif factor == 1:
+            converted.append(price.quantize(CENT, ROUND_HALF_UP))
+        else:
+            converted.append((price * factor).quantize(CENT, ROUND_HALF_UP))
+    return converted
+
+
+def price_range(low, high, target, rates=None, field='price_per_night', currency_field='currency'):
+    """
+    Q for rows whose price converted into `target` (and rounded to cents, as displayed)
+    lies in [low, high]; either bound may be None. Rows in currencies without a rate never match.
+    """
+    conditions = []
+    for currency, factor in (rates or get_rates()).factors(target).items():
+        bounds = {currency_field: currency}
+        # a 2-decimal column: price >= x  <=>  price >= x rounded up to the cent (same for <)
+        if low is not None:
+            bounds[f'{field}__gte'] = ((low - HALF_CENT) / factor).quantize(CENT, ROUND_CEILING)
+        if high is not None:
+            bounds[f'{field}__lt'] = ((high + HALF_CENT) / factor).quantize(CENT, ROUND_CEILING)
+        conditions.append(Q(**bounds))
+    return reduce(or_, conditions)
+
+
+def converted_price(target, rates=None, field='price_per_night', currency_field='currency'):
+    """SQL expression of `field` converted into `target` (NULL without a rate), for ordering"""
+    factor_field = DecimalField(max_digits=28, decimal_places=12)
+    return Case(
+        *(When(**{currency_field: currency}, then=F(field) * Value(factor.quantize(FACTOR_PLACES), factor_field))
+          for currency, factor in (rates or get_rates()).factors(target).items()),
+        output_field=DecimalField(max_digits=28, decimal_places=12),
+    )
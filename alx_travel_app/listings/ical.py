@@ -0,0 +1,256 @@
+# iCalendar (RFC 5545) export and import of listing availability
+#
+# Export: render_feed() turns a listing's current and future active bookings into an
+# all-day VEVENT each. cached_feed() keeps the rendered body in the cache under the
+# feed's version, so repeated polls cost one aggregate query (and a 304 costs nothing
+# more). Imported blocks are not exported, so two platforms never echo each other.
+#
+# Import: parse_events() reads an .ics stream line by line and yields one event at a
+# time; sync_calendar() diffs those against the calendar's stored blocks by UID and
+# only writes what changed. fetch_and_sync() sends the last ETag/Last-Modified back,
+# so a feed that has not changed costs a 304 and no parsing at all.
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import date, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Booking, CalendarBlock
+
+logger = logging.getLogger('chapa_payment')
+
+PRODID = '-//ALX Travel//Listing Calendar//EN'
+
+
+class CalendarImportError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ExternalEvent:
+    uid: str
+    start_date: date
+    end_date: date
+    summary: str = ''
+
+
+# Export
+
+def _format_date(value):
+    return value.strftime('%Y%m%d')
+
+
+def render_feed(listing_id, bookings):
+    """iCalendar body for `bookings`, an iterable of (id, start_date, end_date, updated_at)"""
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+    ]
+    for booking_id, start_date, end_date, updated_at in bookings:
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:{booking_id}@{listing_id}.alx-travel',
+            f'DTSTAMP:{updated_at.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")}',
+            f'DTSTART;VALUE=DATE:{_format_date(start_date)}',
+            f'DTEND;VALUE=DATE:{_format_date(end_date)}',
+            'SUMMARY:Reserved',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(lines) + '\r\n').encode()
+
+
+def feed_version(listing_id):
+    """
+    Everything the feed depends on, from one aggregate over the listing's bookings:
+    any booking change bumps its updated_at, a deletion changes the count, and the
+    date matters because past bookings drop out of the feed.
+    """
+    version = Booking.objects.filter(listing_id=listing_id).order_by().aggregate(
+        rows=Count('pk'), changed=Max('updated_at')
+    )
+    return (timezone.localdate().isoformat(), version['rows'], version['changed'])
+
+
+def cached_feed(listing_id, version):
+    key = 'ical:{}:{}'.format(listing_id, hashlib.sha256(repr(version).encode()).hexdigest()[:32])
+
+    def build():
+        bookings = (
+            Booking.objects.active()
+            .filter(listing_id=listing_id, end_date__gte=timezone.localdate())
+            .order_by('start_date')
+            .values_list('id', 'start_date', 'end_date', 'updated_at')
+        )
+        return render_feed(listing_id, bookings)
+
+    return cache.get_or_set(key, build, settings.ICAL_CACHE_SECONDS)
+
+
+# Import
+
+def _unfold(lines):
+    """Join RFC 5545 folded lines (continuations start with a space or tab)"""
+    current = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _parse_date(value):
+    # DATE (20250101) or DATE-TIME (20250101T140000[Z]); only the day matters for nights
+    value = value.strip()
+    try:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    except (ValueError, IndexError):
+        raise CalendarImportError(f'Invalid date value: {value!r}')
+
+
+def parse_events(lines):
+    """
+    Yield an ExternalEvent per blocking VEVENT in an iterable of .ics lines.
+    Cancelled and transparent (free) events are skipped.
+    """
+    event = None
+    for line in _unfold(lines):
+        name, _, value = line.partition(':')
+        name = name.split(';', 1)[0].upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {}
+        elif name == 'END' and value.upper() == 'VEVENT':
+            if event is None:
+                continue
+            if 'DTSTART' not in event:
+                raise CalendarImportError('VEVENT without DTSTART')
+            start_date = _parse_date(event['DTSTART'])
+            end_date = _parse_date(event['DTEND']) if 'DTEND' in event else start_date + timedelta(days=1)
+            end_date = max(end_date, start_date + timedelta(days=1))
+            cancelled = event.get('STATUS', '').upper() == 'CANCELLED'
+            free = event.get('TRANSP', '').upper() == 'TRANSPARENT'
+            if not (cancelled or free):
+                uid = event.get('UID') or f'{start_date.isoformat()}/{end_date.isoformat()}'
+                yield ExternalEvent(uid[:255], start_date, end_date, event.get('SUMMARY', '')[:200])
+            event = None
+        elif event is not None and name in ('UID', 'DTSTART', 'DTEND', 'SUMMARY', 'STATUS', 'TRANSP'):
+            event[name] = value
+
+
+def sync_calendar(calendar, lines):
+    """
+    Bring `calendar`'s blocks in line with the events in `lines`: new UIDs are
+    created, moved events updated, vanished or past ones deleted and unchanged ones
+    left alone. Returns counts per outcome.
+    """
+    today = timezone.localdate()
+    stored = {
+        uid: (block_id, start_date, end_date)
+        for block_id, uid, start_date, end_date in
+        CalendarBlock.objects.filter(calendar=calendar).values_list('id', 'uid', 'start_date', 'end_date')
+    }
+
+    seen, to_create, to_update = set(), [], []
+    for event in parse_events(lines):
+        if event.end_date <= today or event.uid in seen:
+            continue
+        seen.add(event.uid)
+        if len(seen) > settings.ICAL_MAX_EVENTS:
+            raise CalendarImportError(f'More than {settings.ICAL_MAX_EVENTS} events in calendar')
+        current = stored.get(event.uid)
+        if current is None:
+            to_create.append(CalendarBlock(
+                calendar=calendar, listing_id=calendar.listing_id, uid=event.uid,
+                start_date=event.start_date, end_date=event.end_date, summary=event.summary,
+            ))
+        elif current[1:] != (event.start_date, event.end_date):
+            to_update.append(CalendarBlock(
+                id=current[0], start_date=event.start_date, end_date=event.end_date,
+                summary=event.summary, updated_at=timezone.now(),
+            ))
+    removed = [block_id for uid, (block_id, _, _) in stored.items() if uid not in seen]
+
+    with transaction.atomic():
+        CalendarBlock.objects.bulk_create(to_create, batch_size=500)
+        CalendarBlock.objects.bulk_update(to_update, ['start_date', 'end_date', 'summary', 'updated_at'], batch_size=500)
+        CalendarBlock.objects.filter(id__in=removed).delete()
+        calendar.last_synced_at = timezone.now()
+        calendar.last_error = ''
+        calendar.save(update_fields=['etag', 'last_modified', 'last_synced_at', 'last_error'])
+
+    changed = to_create + to_update
+    conflicts = _count_conflicts(calendar.listing_id, changed)
+    if conflicts:
+        logger.warning("Imported calendar blocks overlap active bookings", extra={
+            'calendar_id': str(calendar.id),
+            'listing_id': str(calendar.listing_id),
+            'conflicts': conflicts,
+            'action': 'ical_block_conflict'
+        })
+    return {'created': len(to_create), 'updated': len(to_update), 'deleted': len(removed),
+            'unchanged': len(seen) - len(changed), 'conflicts': conflicts}
+
+
+def _count_conflicts(listing_id, blocks):
+    """Blocks that overlap one of our own active bookings (double bookings to resolve by hand)"""
+    if not blocks:
+        return 0
+    bookings = list(
+        Booking.objects.overlapping(min(b.start_date for b in blocks), max(b.end_date for b in blocks))
+        .filter(listing_id=listing_id)
+        .values_list('start_date', 'end_date')
+    )
+    return sum(
+        1 for block in blocks
+        if any(start < block.end_date and end > block.start_date for start, end in bookings)
+    )
+
+
+def fetch_and_sync(calendar):
+    """
+    Download `calendar.url` (conditionally) and sync it. Returns the sync counts,
+    or None when the feed was unchanged.
+    """
+    import requests
+
+    headers = {}
+    if calendar.etag:
+        headers['If-None-Match'] = calendar.etag
+    if calendar.last_modified:
+        headers['If-Modified-Since'] = calendar.last_modified
+    try:
+        with requests.get(calendar.url, headers=headers, stream=True, timeout=settings.ICAL_FETCH_TIMEOUT) as response:
+            if response.status_code == 304:
+                calendar.last_synced_at = timezone.now()
+                calendar.save(update_fields=['last_synced_at'])
+                return None
+            response.raise_for_status()
+            if 'charset' not in response.headers.get('Content-Type', ''):
+                response.encoding = 'utf-8'
+            calendar.etag = response.headers.get('ETag', '')[:200]
+            calendar.last_modified = response.headers.get('Last-Modified', '')[:100]
+            return sync_calendar(calendar, response.iter_lines(decode_unicode=True))
+    except (requests.RequestException, CalendarImportError) as e:
+        calendar.last_error = str(e)[:1000]
+        calendar.save(update_fields=['last_error'])
+        logger.error("External calendar sync failed", extra={
+            'calendar_id': str(calendar.id),
+            'error': str(e),
+            'action': 'ical_sync_failed'
+        })
+        raise
@@ -0,0 +1,190 @@
+# Host payout ledger and batch settlement
+# credit_booking() appends a host's earning once a booking is confirmed and paid for,
+# in the transaction that completes the payment or confirms the booking, and bumps the
+# host's running balance. Cancelling a paid booking appends the matching negative
+# adjustment (reverse_booking) in the cancellation's transaction. Entries are never changed.
+#
+# settle() pays every host what it is owed in one pass over the ledger:
+#   * a settlement covers the entries after the previous settlement's last entry, up to
+#     the newest entry older than SETTLEMENT_LAG_SECONDS (so in-flight transactions that
+#     took an id just below it have committed);
+#   * earnings and adjustments are streamed in id order and summed per (host, currency)
+#     as Decimals, on top of any negative balance carried from the previous settlement
+#     (earlier payouts are already netted out by that), so the result is exact on every
+#     database (SQLite sums decimals as floats);
+#   * a payout of each positive sum is written, together with the matching negative
+#     ledger entries, in one transaction that also marks the settlement completed.
+# Progress is checkpointed, so an interrupted run resumes where it stopped, and a
+# completed settlement is never paid twice: running settle() again only covers new entries.
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import HostBalance, HostLedgerEntry, HostPayout, Payment, PayoutSettlement
+
+
+def record_earning(payment, host_id):
+    """
+    Append the earning for a completed `payment` (once; repeated calls are no-ops).
+    Call inside the transaction that completes the payment.
+    """
+    with transaction.atomic():
+        entry, created = HostLedgerEntry.objects.get_or_create(
+            payment_id=payment.transaction_id, entry_type='earning',
+            defaults={'host_id': host_id, 'amount': payment.amount, 'currency': payment.currency,
+                      'booking_id': payment.booking_id},
+        )
+        if created:
+            HostBalance.apply(host_id, entry.currency, entry.amount)
+        return entry if created else None
+
+
+def credit_booking(booking):
+    """
+    Credit the host for `booking` if it is confirmed and its payment has completed
+    (once; repeated calls are no-ops). Returns the new entry or None.
+    """
+    if booking.status != 'confirmed':
+        return None
+    payment = Payment.objects.filter(booking_id=booking.pk, status='completed').first()
+    if payment is None:
+        return None
+    return record_earning(payment, booking.listing.host_id)
+
+
+def reverse_booking(booking):
+    """
+    Append a negative adjustment for each earning of a cancelled `booking` (once per
+    payment), so the next settlement nets it out. Call inside the cancelling transaction.
+    Returns the new adjustments.
+    """
+    adjustments = []
+    with transaction.atomic():
+        for earning in HostLedgerEntry.objects.filter(booking_id=booking.pk, entry_type='earning'):
+            entry, created = HostLedgerEntry.objects.get_or_create(
+                payment_id=earning.payment_id, entry_type='adjustment',
+                defaults={'host_id': earning.host_id, 'amount': -earning.amount, 'currency': earning.currency,
+                          'booking_id': earning.booking_id},
+            )
+            if created:
+                HostBalance.apply(entry.host_id, entry.currency, entry.amount)
+                adjustments.append(entry)
+    return adjustments
+
+
+def _dump(sums):
+    return {f'{host_id}:{currency}': str(amount) for (host_id, currency), amount in sums.items()}
+
+
+def _load(saved):
+    sums = defaultdict(Decimal)
+    for key, amount in saved.items():
+        host_id, currency = key.rsplit(':', 1)
+        sums[(uuid.UUID(host_id), currency)] = Decimal(amount)
+    return sums
+
+
+def _start_settlement():
+    """The interrupted settlement to resume, or a new one over the unsettled entries (or None)"""
+    running = PayoutSettlement.objects.filter(status='running').first()
+    if running is not None:
+        return running
+
+    previous = PayoutSettlement.objects.filter(status='completed').order_by('-to_entry_id').first()
+    from_entry_id = previous.to_entry_id if previous else 0
+    settled_before = timezone.now() - timedelta(seconds=settings.SETTLEMENT_LAG_SECONDS)
+    to_entry_id = (
+        HostLedgerEntry.objects.filter(id__gt=from_entry_id, created_at__lt=settled_before)
+        .exclude(entry_type='payout')
+        .order_by('-id').values_list('id', flat=True).first()
+    )
+    if to_entry_id is None:
+        return None
+    carried = previous.carried if previous else {}
+    try:
+        with transaction.atomic():
+            return PayoutSettlement.objects.create(
+                from_entry_id=from_entry_id, to_entry_id=to_entry_id, progress_entry_id=from_entry_id,
+                partial_sums=carried,
+            )
+    except IntegrityError:
+        # another run started one in the meantime (settlement_single_running)
+        return PayoutSettlement.objects.filter(status='running').first()
+
+
+def settle(chunk_size=10_000, checkpoint_every=200_000):
+    """
+    Run (or resume) a settlement. Returns the completed PayoutSettlement, or None
+    when there was nothing to settle or another run completed it first.
+    """
+    settlement = _start_settlement()
+    if settlement is None:
+        return None
+
+    sums = _load(settlement.partial_sums)
+    entries = (
+        HostLedgerEntry.objects
+        .filter(id__gt=settlement.progress_entry_id, id__lte=settlement.to_entry_id)
+        .exclude(entry_type='payout')
+        .order_by('id')
+        .values_list('id', 'host_id', 'currency', 'amount')
+        .iterator(chunk_size=chunk_size)
+    )
+    since_checkpoint = 0
+    for entry_id, host_id, currency, amount in entries:
+        sums[(host_id, currency)] += amount
+        since_checkpoint += 1
+        if since_checkpoint == checkpoint_every:
+            _checkpoint(settlement, entry_id, sums)
+            since_checkpoint = 0
+
+    return _complete(settlement, sums)
+
+
+def _checkpoint(settlement, entry_id, sums):
+    PayoutSettlement.objects.filter(pk=settlement.pk, status='running').update(
+        progress_entry_id=entry_id, partial_sums=_dump(sums),
+    )
+
+
+def _complete(settlement, sums):
+    payouts, entries = [], []
+    for (host_id, currency), owed in sums.items():
+        if owed > 0:
+            payouts.append(HostPayout(settlement=settlement, host_id=host_id, currency=currency, amount=owed))
+            entries.append(HostLedgerEntry(host_id=host_id, entry_type='payout', amount=-owed, currency=currency,
+                                           settlement=settlement))
+    carried = _dump({key: owed for key, owed in sums.items() if owed < 0})
+
+    with transaction.atomic():
+        # claims the settlement: a concurrent run that gets here second writes nothing
+        claimed = PayoutSettlement.objects.filter(pk=settlement.pk, status='running').update(
+            status='completed', completed_at=timezone.now(), progress_entry_id=settlement.to_entry_id,
+            partial_sums={}, carried=carried, payout_count=len(payouts),
+        )
+        if not claimed:
+            return None
+        HostPayout.objects.bulk_create(payouts, batch_size=1000)
+        HostLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+        _debit_balances(settlement, payouts)
+    settlement.refresh_from_db()
+    return settlement
+
+
+def _debit_balances(settlement, payouts):
+    # One set-based UPDATE subtracts each host's payout (looked up per row through
+    # payout_unique_host_currency) instead of an UPDATE per host
+    HostBalance.objects.bulk_create(
+        [HostBalance(host_id=payout.host_id, currency=payout.currency) for payout in payouts],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    paid = HostPayout.objects.filter(settlement=settlement, host_id=OuterRef('host_id'), currency=OuterRef('currency'))
+    HostBalance.objects.filter(Exists(paid)).update(
+        balance=F('balance') - Subquery(paid.values('amount')[:1]), updated_at=timezone.now(),
+    )
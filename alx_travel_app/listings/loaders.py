@@ -0,0 +1,188 @@
+# Request-scoped batch loading of the relations serializers render
+# Before a page is rendered, every single-valued relation the serializer (and its nested
+# serializers and dotted sources such as 'booking.listing.title') will read is loaded for
+# all rows at once: one IN query per relation level, through an identity map, so a User
+# or Listing reached from several rows or paths is fetched once per request. Many-valued
+# relations are handed to prefetch_related_objects. Relations the view already joined or
+# prefetched are reused, so select_related/prefetch_related stay an optimisation rather
+# than the only thing between a list endpoint and N+1 queries.
+#
+# The paths come from the same field walk as ?fields= projection (fieldsets.relation_plan);
+# SerializerMethodFields are covered through Meta.field_dependencies. The same walk gives
+# the columns each level renders, so related rows are loaded with only() those; a level
+# with a field whose needs are unknown is loaded in full.
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers
+
+from .fieldsets import relation_plan
+
+
+class Loader:
+    """Identity map of model instances, filled in batches"""
+    def __init__(self):
+        self._objects = defaultdict(dict)   # concrete model -> pk -> instance
+
+    def _known(self, model):
+        return self._objects[model._meta.concrete_model]
+
+    def canonical(self, instance):
+        """The instance already mapped for this row, or `instance` (now mapped)"""
+        return self._known(type(instance)).setdefault(instance.pk, instance)
+
+    def get_many(self, model, pks, fields=None):
+        """
+        pk -> instance for `pks`, querying (once) only those not seen yet or seen without
+        some of `fields` (column names; None for every column)
+        """
+        known = self._known(model)
+        fields = _concrete(model, fields)
+        needed = None if fields is None else {model._meta.get_field(name).attname for name in fields}
+
+        def incomplete(instance):
+            deferred = instance.get_deferred_fields()
+            return bool(deferred) and (needed is None or bool(deferred & needed))
+
+        missing = [pk for pk in pks if pk not in known or incomplete(known[pk])]
+        if missing:
+            queryset = _only(model._base_manager.all(), fields)
+            for instance in queryset.filter(pk__in=missing):
+                # a row seen before with fewer columns is replaced; its owners keep the old one
+                known[instance.pk] = instance
+        return {pk: known[pk] for pk in pks if pk in known}
+
+    def load(self, serializer, instances):
+        """Load the relations `serializer` renders for `instances` (rows of Meta.model)"""
+        instances = [instance for instance in instances if instance is not None]
+        if not instances:
+            return
+        plan = relation_plan(serializer, type(instances[0]))
+        levels = {'': instances}
+        for path in sorted(plan['select'], key=lambda path: path.count('__')):
+            parent, _, name = path.rpartition('__')
+            owners = levels.get(parent)
+            levels[path] = self._load_single(owners, name, _columns(plan, path)) if owners else []
+        for path in sorted(plan['prefetch']):
+            parent, _, name = path.rpartition('__')
+            if levels.get(parent):
+                prefetch_related_objects(levels[parent], name)
+
+    def _load_single(self, owners, name, columns=None):
+        """Fill the `name` relation cache of every owner; returns the distinct related objects"""
+        field = type(owners[0])._meta.get_field(name)
+        if field.concrete:
+            self._load_forward(owners, field, columns)
+        elif field.one_to_one:
+            self._load_reverse_one(owners, field, columns)
+        else:
+            prefetch_related_objects(owners, name)
+
+        related = {}
+        for owner in owners:
+            value = field.get_cached_value(owner, default=None)
+            if value is not None:
+                related[id(value)] = value
+        return list(related.values())
+
+    def _load_forward(self, owners, field, columns=None):
+        # foreign key / one-to-one on the owner: look the targets up by primary key
+        if not field.target_field.primary_key:
+            prefetch_related_objects(owners, field.name)
+            return
+        pending = []
+        for owner in owners:
+            if field.is_cached(owner):
+                value = field.get_cached_value(owner)
+                if value is not None:
+                    self.canonical(value)
+            elif getattr(owner, field.attname) is not None:
+                pending.append(owner)
+        if pending:
+            found = self.get_many(field.related_model, {getattr(owner, field.attname) for owner in pending}, columns)
+            for owner in pending:
+                field.set_cached_value(owner, found.get(getattr(owner, field.attname)))
+
+    def _load_reverse_one(self, owners, rel, columns=None):
+        # one-to-one pointing at the owner (booking.payment): look it up by the owners' keys
+        remote = rel.field
+        pending = [owner for owner in owners if not rel.is_cached(owner)]
+        if not pending:
+            return
+        found = {}
+        queryset = _only(rel.related_model._base_manager.all(), None if columns is None else columns | {remote.name})
+        for instance in queryset.filter(**{f'{remote.name}__in': pending}):
+            found[getattr(instance, remote.attname)] = self.canonical(instance)
+        for owner in pending:
+            value = found.get(owner.pk)
+            # None renders like the missing row it stands for (RelatedObjectDoesNotExist)
+            rel.set_cached_value(owner, value)
+            if value is not None:
+                remote.set_cached_value(value, owner)
+
+
+def _columns(plan, path):
+    """Names of the fields rendered from the objects at `path`, or None when not all are known"""
+    prefix = path + '__'
+    if prefix in plan['partial']:
+        return None
+    return {
+        column[len(prefix):].split('__')[0]
+        for column in plan['only'] | plan['select'] | plan['prefetch'] if column.startswith(prefix)
+    }
+
+
+def _concrete(model, names):
+    """
+    The column names among `names`; reverse relations (reviews, payment) are loaded
+    separately and take none. None (every column) for None or a name that isn't a field.
+    """
+    if names is None:
+        return None
+    try:
+        return [name for name in names if model._meta.get_field(name).concrete]
+    except FieldDoesNotExist:
+        return None
+
+
+def _only(queryset, fields):
+    fields = _concrete(queryset.model, fields)
+    if fields is None:
+        return queryset
+    return queryset.only(*fields or ['pk'])
+
+
+def request_loader(context):
+    """The loader of the serializer's request (one per request), or a fresh one without a request"""
+    request = context.get('request')
+    if request is None:
+        return Loader()
+    # the Django request, shared by every DRF Request wrapping it
+    request = getattr(request, '_request', request)
+    loader = getattr(request, '_listings_loader', None)
+    if loader is None:
+        loader = request._listings_loader = Loader()
+    return loader
+
+
+class BatchListSerializer(serializers.ListSerializer):
+    """List serializer loading the page's relations in batches before rendering its rows"""
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if self.parent is None:
+            # nested lists are covered by the root serializer's plan
+            request_loader(self.context).load(self.child, instances)
+        return super().to_representation(instances)
+
+
+class BatchLoadMixin:
+    """
+    Serializer mixin doing the same for a single object. Pair it with
+    Meta.list_serializer_class = BatchListSerializer (or a subclass) for pages.
+    """
+    def to_representation(self, instance):
+        if self.parent is None:
+            request_loader(self.context).load(self, [instance])
+        return super().to_representation(instance)
@@ -0,0 +1,32 @@
+# Move finished booking history into the archive tables
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from listings.archive import archivable, archive
+import time
+
+
+class Command(BaseCommand):
+    help = 'Archive completed/cancelled bookings (with payments and payment events) in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.BOOKING_ARCHIVE_AFTER_DAYS,
+                            help='archive bookings that ended more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=settings.BOOKING_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.1, help='seconds to sleep between batches')
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='only count what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=options['older_than_days'])
+        if options['dry_run']:
+            self.stdout.write(f'{archivable(cutoff).count()} bookings ended before {cutoff} can be archived')
+            return
+
+        started = time.perf_counter()
+        total = 0
+        for moved in archive(cutoff, options['batch_size'], options['pause'], options['max_batches']):
+            total += moved
+            self.stdout.write(f'archived {moved} bookings ({total} so far)')
+        self.stdout.write(f'Archived {total} bookings ended before {cutoff} in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,55 @@
+# Benchmark per-request authentication overhead
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from listings.authentication import CachedTokenAuthentication, auth_cache
+from listings.models import User
+import time
+
+
+class _PingView(APIView):
+    def get(self, request):
+        return Response({'user': str(request.user.pk)})
+
+
+class Command(BaseCommand):
+    help = 'Measure authentication cost per request with and without the auth cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        factory = APIRequestFactory()
+
+        # Everything runs in a transaction that is rolled back, so no data is left behind
+        with transaction.atomic():
+            user = User.objects.create(username='bench_auth_user', email='bench_auth@example.com')
+            token = Token.objects.create(user=user)
+            request_kwargs = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+            for label, auth_class in (('TokenAuthentication', TokenAuthentication),
+                                      ('CachedTokenAuthentication', CachedTokenAuthentication)):
+                view = _PingView.as_view(authentication_classes=[auth_class])
+                auth_cache.local.clear()
+                auth_cache.invalidate_token(token.key)
+                auth_cache.invalidate_user(user.pk)
+
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    for _ in range(count):
+                        response = view(factory.get('/bench/', **request_kwargs))
+                        assert response.status_code == 200
+                    elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f'{label:<28} {elapsed / count * 1e6:8.1f} us/request  '
+                    f'{len(ctx.captured_queries) / count:.3f} queries/request'
+                )
+
+            transaction.set_rollback(True)
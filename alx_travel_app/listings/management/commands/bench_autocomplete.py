@@ -0,0 +1,94 @@
+# Benchmark the autocomplete prefix index: build time, memory, lookup latency and updates
+from django.core.management.base import BaseCommand
+from listings.autocomplete import AutocompleteIndex
+import random
+import time
+import tracemalloc
+import uuid
+
+ADJECTIVES = ['cozy', 'sunny', 'modern', 'rustic', 'quiet', 'central', 'spacious', 'charming', 'luxury',
+              'bright', 'historic', 'garden', 'lakeside', 'hillside', 'family', 'budget', 'stylish', 'private']
+KINDS = ['apartment', 'house', 'villa', 'cabin', 'studio', 'loft', 'cottage', 'suite', 'bungalow', 'penthouse']
+CITIES = ['Addis Ababa', 'Nairobi', 'Lagos', 'Accra', 'Kigali', 'Kampala', 'Dakar', 'Cairo', 'Casablanca',
+          'Johannesburg', 'Cape Town', 'Dar es Salaam', 'Lusaka', 'Harare', 'Mombasa', 'Zanzibar']
+STREETS = ['Bole', 'Kazanchis', 'Piassa', 'Westlands', 'Kilimani', 'Lekki', 'Ikoyi', 'Osu', 'Kacyiru',
+           'Kololo', 'Almadies', 'Zamalek', 'Maarif', 'Sandton', 'Camps Bay', 'Masaki']
+
+
+def synthetic_rows(count, rng):
+    # A pool of made-up place names gives the term list a realistic long tail
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    names = [''.join(rng.choice(letters) for _ in range(rng.randint(4, 9))).title() for _ in range(count // 5)]
+    rows = []
+    for _ in range(count):
+        title = f'{rng.choice(ADJECTIVES).title()} {rng.choice(KINDS)} near {rng.choice(names)}'
+        address = f'{rng.randint(1, 999)} {rng.choice(STREETS)} Road, {rng.choice(CITIES)}'
+        rows.append((uuid.uuid4(), title, address, int(rng.paretovariate(1.2)) - 1))
+    return rows, names
+
+
+class Command(BaseCommand):
+    help = 'Build the autocomplete index over synthetic listings and time prefix lookups and updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=20_000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--memory', action='store_true', help='also measure the index size')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        rows, names = synthetic_rows(options['listings'], rng)
+
+        started = time.perf_counter()
+        index = AutocompleteIndex(max_listings=len(rows)).build(rows)
+        self.stdout.write(f'{len(index)} listings: build {time.perf_counter() - started:.2f}s')
+        if options['memory']:
+            # a second build under tracemalloc (which slows it down several times)
+            # (title/address strings are shared with the loaded rows and not counted)
+            tracemalloc.start()
+            measured = AutocompleteIndex(max_listings=len(rows)).build(rows)
+            self.stdout.write(f'  index size {tracemalloc.get_traced_memory()[0] / 2**20:.1f} MiB')
+            tracemalloc.stop()
+            del measured
+
+        # what a user types: 1..6 letters of a word, sometimes a second word
+        words = [word.lower() for word in ADJECTIVES + KINDS + CITIES + STREETS] + [name.lower() for name in names]
+        queries = []
+        for _ in range(options['queries']):
+            first = rng.choice(words)
+            query = first[:rng.randint(1, min(6, len(first)))]
+            if rng.random() < 0.3:
+                query = f'{first} {rng.choice(words)[:rng.randint(1, 4)]}'
+            queries.append(query)
+
+        for label, selected in (('1-2 letters', [q for q in queries if len(q) <= 2]),
+                                ('3+ letters', [q for q in queries if len(q) > 2 and ' ' not in q]),
+                                ('two words', [q for q in queries if ' ' in q])):
+            timings = []
+            for query in selected:
+                before = time.perf_counter()
+                index.suggest(query, options['limit'])
+                timings.append(time.perf_counter() - before)
+            timings.sort()
+            count = len(timings)
+            self.stdout.write(
+                f'  {label:<12} {count:>6} queries: mean {sum(timings) / count * 1e6:7.1f} us  '
+                f'p50 {timings[count // 2] * 1e6:7.1f} us  p99 {timings[int(count * 0.99)] * 1e6:7.1f} us'
+            )
+
+        # listing saves (title edits and popularity changes) and deletes, as the signals apply them
+        timings = []
+        for listing_id, title, address, popularity in rng.sample(rows, 2000):
+            before = time.perf_counter()
+            index.upsert(listing_id, f'{title} renovated', address, popularity + rng.randint(0, 50))
+            timings.append(time.perf_counter() - before)
+        for listing_id, _, _, _ in rng.sample(rows, 2000):
+            before = time.perf_counter()
+            index.remove(listing_id)
+            timings.append(time.perf_counter() - before)
+        timings.sort()
+        self.stdout.write(
+            f'  updates      {len(timings):>6} saves/deletes: mean {sum(timings) / len(timings) * 1e6:7.1f} us  '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:7.1f} us'
+        )
@@ -0,0 +1,40 @@
+# Benchmark Celery task throughput against an in-memory broker
+from django.core.management.base import BaseCommand
+from celery.contrib.testing.worker import start_worker
+from alx_travel_app.celery import app
+import time
+
+
+@app.task(name='listings.bench.noop')
+def noop(item_id):
+    return item_id
+
+
+class Command(BaseCommand):
+    help = 'Measure publish and end-to-end task throughput using an in-memory broker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['tasks']
+        # Settings are loaded with the CELERY_ namespace, so overrides use the same keys
+        app.conf.update(
+            CELERY_BROKER_URL='memory://',
+            CELERY_RESULT_BACKEND='cache+memory://',
+            CELERY_TASK_ALWAYS_EAGER=False,
+            CELERY_TASK_IGNORE_RESULT=False,
+        )
+        # celery.ping is used by start_worker's readiness check
+        import celery.contrib.testing.tasks  # noqa: F401
+
+        with start_worker(app, pool='solo', perform_ping_check=True, shutdown_timeout=30):
+            started = time.perf_counter()
+            results = [noop.delay(i) for i in range(count)]
+            published = time.perf_counter() - started
+            for result in results:
+                result.get(timeout=60)
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'publish     {count / published:10.0f} tasks/s')
+        self.stdout.write(f'end-to-end  {count / elapsed:10.0f} tasks/s ({count} tasks, solo pool)')
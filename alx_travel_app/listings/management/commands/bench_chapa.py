@@ -0,0 +1,77 @@
+# Load-test Chapa payment initiation against a local fake Chapa, with and without the limiter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from listings.chapa_limiter import PRIORITY_CHECKOUT, PRIORITY_RETRY, PRIORITY_NAMES
+from listings.chapa_service import ChapaService
+from listings.fake_chapa import FakeChapa
+import logging
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Burst payment initiations at a fake Chapa that adds latency and answers 429 when overloaded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--concurrency', type=int, default=64, help='caller threads (web workers)')
+        parser.add_argument('--retry-share', type=float, default=0.3, help='fraction of calls that are retries')
+        parser.add_argument('--latency-ms', type=float, default=50)
+        parser.add_argument('--capacity', type=int, default=10, help='fake Chapa in-flight requests before 429s')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='extra random 429 probability')
+        parser.add_argument('--max-in-flight', type=int, default=8)
+        parser.add_argument('--queue-timeout', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        # per-request info logs would dominate the run
+        logging.getLogger('chapa_payment').setLevel(logging.ERROR)
+        random.seed(0)
+        priorities = [
+            PRIORITY_RETRY if random.random() < options['retry_share'] else PRIORITY_CHECKOUT
+            for _ in range(options['requests'])
+        ]
+
+        # "unlimited" lets every caller thread through at once, as before the limiter existed
+        for label, max_in_flight in (('unlimited', options['concurrency']), ('limited', options['max_in_flight'])):
+            with FakeChapa(latency=options['latency_ms'] / 1000, capacity=options['capacity'],
+                           throttle_rate=options['throttle_rate'], retry_after=0) as fake:
+                with override_settings(CHAPA_BASE_URL=fake.base_url, CHAPA_SECRET_KEY='CHASECK_TEST-bench',
+                                       CHAPA_MAX_IN_FLIGHT=max_in_flight, CHAPA_MAX_QUEUE=options['requests'],
+                                       CHAPA_QUEUE_TIMEOUT=options['queue_timeout'], CHAPA_THROTTLE_BACKOFF=0.05):
+                    service = ChapaService()
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(options['concurrency']) as pool:
+                        outcomes = list(pool.map(lambda args: self._call(service, *args), enumerate(priorities)))
+                    elapsed = time.perf_counter() - started
+                self._report(label, outcomes, elapsed, service.limiter.snapshot(), fake.stats())
+
+    def _call(self, service, index, priority):
+        started = time.perf_counter()
+        result = service.initiate_payment(
+            amount=100, email='bench@example.com', first_name='Bench', last_name='User',
+            tx_ref=f'bench-{index}', return_url='http://localhost/payment-success/', priority=priority,
+        )
+        outcome = 'ok' if result['success'] else 'busy' if result.get('busy') else 'error'
+        return PRIORITY_NAMES[priority], outcome, time.perf_counter() - started
+
+    def _report(self, label, outcomes, elapsed, limiter, fake):
+        self.stdout.write(f'{label}: {len(outcomes)} calls in {elapsed:.2f}s, '
+                          f'fake Chapa served {fake["served"]} / throttled {fake["throttled"]} '
+                          f'(peak {fake["peak_active"]} in flight)')
+        for name in ('checkout', 'retry'):
+            rows = [(outcome, latency) for kind, outcome, latency in outcomes if kind == name]
+            if not rows:
+                continue
+            latencies = sorted(latency for _, latency in rows)
+            ok = sum(1 for outcome, _ in rows if outcome == 'ok')
+            busy = sum(1 for outcome, _ in rows if outcome == 'busy')
+            self.stdout.write(
+                f'  {name:<9} {ok:>5} ok {busy:>5} busy {len(rows) - ok - busy:>5} error   '
+                f'p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms  '
+                f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms'
+            )
+        self.stdout.write(
+            f'  limiter: queue depth max {limiter["queue_depth_max"]}, wait avg {limiter["wait_avg_ms"]} ms / '
+            f'max {limiter["wait_max_ms"]} ms, timed out {limiter["timed_out"]}, 429s seen {limiter["throttled"]}'
+        )
@@ -0,0 +1,61 @@
+# Benchmark request throughput with and without connection reuse
+from django.core import signals
+from django.core.management.base import BaseCommand
+from django.db import connections
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure simulated requests per second with per-request, persistent and pooled connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        connection = connections[options['database']]
+        original = {
+            'CONN_MAX_AGE': connection.settings_dict['CONN_MAX_AGE'],
+            'OPTIONS': dict(connection.settings_dict.get('OPTIONS', {})),
+        }
+
+        modes = [
+            ('new connection per request', 0, None),
+            ('persistent connections', 600, None),
+        ]
+        if connection.vendor == 'postgresql':
+            try:
+                import psycopg_pool  # noqa: F401
+                modes.append(('psycopg pool', 0, {'min_size': 1, 'max_size': 4}))
+            except ImportError:
+                self.stdout.write('psycopg_pool is not installed; skipping pooled mode')
+
+        try:
+            for label, max_age, pool in modes:
+                self._configure(connection, max_age, pool)
+                elapsed = self._run(connection, count)
+                self.stdout.write(f'{label:<28} {count / elapsed:10.0f} requests/s')
+        finally:
+            self._configure(connection, original['CONN_MAX_AGE'], original['OPTIONS'].get('pool'))
+
+    def _configure(self, connection, max_age, pool):
+        connection.close()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        connection.settings_dict.setdefault('OPTIONS', {}).pop('pool', None)
+        if pool:
+            connection.settings_dict['OPTIONS']['pool'] = pool
+
+    def _run(self, connection, count):
+        # request_started/request_finished drive Django's connection lifecycle
+        # exactly as they do for a real request
+        started = time.perf_counter()
+        for _ in range(count):
+            signals.request_started.send(sender=self.__class__)
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            signals.request_finished.send(sender=self.__class__)
+        return time.perf_counter() - started
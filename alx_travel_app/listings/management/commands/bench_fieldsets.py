@@ -0,0 +1,73 @@
+# Benchmark payload size, queries and time for sparse fieldsets
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from listings.models import User, Listing, Review, Booking
+from listings.views import BookingViewSet, ListingViewSet
+from datetime import date, timedelta
+import time
+
+CASES = [
+    (ListingViewSet, '/api/listings/', ''),
+    (ListingViewSet, '/api/listings/', 'fields=title,price_per_night'),
+    (BookingViewSet, '/api/bookings/', ''),
+    (BookingViewSet, '/api/bookings/', 'fields=id,start_date,end_date,status,listing'),
+    (BookingViewSet, '/api/bookings/', 'fields=id,start_date,listing.title'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare default and sparse (?fields=) list responses: bytes, queries and time per page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+
+        # Data is created inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            staff = self._seed(options['rows'])
+            for viewset, path, query in CASES:
+                view = viewset.as_view({'get': 'list'})
+                url = f'{path}?{query}' if query else path
+
+                def call():
+                    request = factory.get(url, HTTP_ACCEPT='application/json')
+                    force_authenticate(request, user=staff)
+                    response = view(request)
+                    response.render()
+                    return response
+
+                with CaptureQueriesContext(connection) as ctx:
+                    response = call()
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    call()
+                elapsed = (time.perf_counter() - started) / options['repeat']
+
+                self.stdout.write(
+                    f'{path:<16} {query or "(all fields)":<48} {len(response.content):>9} bytes '
+                    f'{len(ctx.captured_queries):>3} queries {elapsed * 1000:8.2f} ms'
+                )
+            transaction.set_rollback(True)
+
+    def _seed(self, rows):
+        staff = User.objects.create(username='bench_fieldsets', email='bench_fieldsets@example.com', is_staff=True)
+        listings = Listing.objects.bulk_create([
+            Listing(host=staff, title=f'Listing {i}', description='A place to stay ' * 20,
+                    address=f'{i} Bench Street', price_per_night=100 + i, amenities=['wifi', 'pool'])
+            for i in range(rows)
+        ])
+        Review.objects.bulk_create([
+            Review(listing=listing, user=staff, rating=5, comment='Great') for listing in listings
+        ])
+        start = date(2030, 1, 1)
+        Booking.objects.bulk_create([
+            Booking(listing=listing, user=staff, start_date=start + timedelta(days=i),
+                    end_date=start + timedelta(days=i + 2), total_price=200)
+            for i, listing in enumerate(listings)
+        ])
+        return staff
@@ -0,0 +1,63 @@
+# Benchmark currency conversion: page conversion and cross-currency price-range filtering
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from listings import fx
+from listings.models import Listing, User
+import random
+import time
+
+CURRENCIES = ('ETB', 'ETB', 'NGN', 'KES', 'USD', 'EUR')
+
+
+class Command(BaseCommand):
+    help = 'Time converting listing pages into one currency and filtering a price range across currencies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=50_000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        rates = fx.RateTable('USD', {'USD': Decimal(1), 'ETB': Decimal('57.15'), 'NGN': Decimal('1535.2'),
+                                     'KES': Decimal('129.25'), 'EUR': Decimal('0.9215')}, 'bench')
+        rows = [(Decimal(rng.randint(2000, 50_000)) / 100 * rates.rates[currency], currency)
+                for currency in (rng.choice(CURRENCIES) for _ in range(options['listings']))]
+        rows = [(price.quantize(fx.CENT), currency) for price, currency in rows]
+
+        # a page converted one listing at a time vs in one pass
+        size = options['page_size']
+        pages = [rows[start:start + size] for start in range(0, len(rows), size)]
+        started = time.perf_counter()
+        for page in pages:
+            for price, currency in page:
+                fx.convert_prices([price], [currency], 'USD', rates)
+        per_row = (time.perf_counter() - started) / len(pages)
+        started = time.perf_counter()
+        for page in pages:
+            fx.convert_prices([price for price, _ in page], [currency for _, currency in page], 'USD', rates)
+        one_pass = (time.perf_counter() - started) / len(pages)
+        self.stdout.write(f'page of {size}: per row {per_row * 1e6:.0f} us, one pass {one_pass * 1e6:.0f} us')
+
+        with transaction.atomic():
+            host = User.objects.create(username='bench_fx_host', email='bench_fx_host@example.com')
+            Listing.objects.bulk_create([
+                Listing(host=host, title=f'Listing {index}', description='', address='', price_per_night=price,
+                        currency=currency)
+                for index, (price, currency) in enumerate(rows)
+            ], batch_size=5000)
+            ranges = [(Decimal(low), Decimal(low + rng.randint(5, 60))) for low in
+                      (rng.randint(20, 400) for _ in range(options['queries']))]
+            listings = Listing.objects.all()
+            for label, build in (
+                ('bounds per currency', lambda low, high: listings.filter(fx.price_range(low, high, 'USD', rates))),
+                ('converted in SQL', lambda low, high: listings.alias(price=fx.converted_price('USD', rates))
+                    .filter(price__gte=low - fx.HALF_CENT, price__lt=high + fx.HALF_CENT)),
+            ):
+                started = time.perf_counter()
+                counts = [build(low, high).count() for low, high in ranges]
+                elapsed = (time.perf_counter() - started) / len(ranges)
+                self.stdout.write(f'price range, {label}: {elapsed * 1e3:.2f} ms per query '
+                                  f'({sum(counts) / len(counts):.0f} matches on average)')
+            transaction.set_rollback(True)
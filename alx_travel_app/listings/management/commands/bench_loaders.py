@@ -0,0 +1,68 @@
+# Benchmark batch relation loading (listings.loaders) for serialized pages
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from listings.loaders import Loader
+from listings.models import Booking, Listing, Payment, User
+from listings.serializers import BookingSerializer, PaymentSerializer
+from datetime import date, timedelta
+from unittest import mock
+import time
+
+CASES = [
+    ('bookings', BookingSerializer, lambda: Booking.objects.order_by('start_date')),
+    ('bookings, select_related', BookingSerializer,
+     lambda: Booking.objects.select_related('user', 'listing__host').prefetch_related('listing__reviews')
+     .order_by('start_date')),
+    ('payments', PaymentSerializer, lambda: Payment.objects.order_by('created_at')),
+]
+
+
+class Command(BaseCommand):
+    help = 'Queries and time to serialize booking/payment pages with and without batch relation loading'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._seed(options['rows'])
+            for label, serializer_class, queryset in CASES:
+                for loading in (False, True):
+                    with mock.patch.object(Loader, 'load', Loader.load if loading else lambda *args: None):
+                        connection.queries_log.clear()
+                        with CaptureQueriesContext(connection) as ctx:
+                            serializer_class(queryset(), many=True).data
+                        started = time.perf_counter()
+                        for _ in range(options['repeat']):
+                            serializer_class(queryset(), many=True).data
+                        elapsed = (time.perf_counter() - started) / options['repeat']
+                    self.stdout.write(
+                        f'{label:<26} {"batched" if loading else "per row":<8} '
+                        f'{len(ctx.captured_queries):>5} queries {elapsed * 1000:8.2f} ms'
+                    )
+            transaction.set_rollback(True)
+
+    def _seed(self, rows):
+        # a few hosts and guests shared by many rows, as on a real page
+        hosts = User.objects.bulk_create([
+            User(username=f'bench_loader_host_{i}', email=f'bench_loader_host_{i}@example.com') for i in range(20)
+        ])
+        guests = User.objects.bulk_create([
+            User(username=f'bench_loader_guest_{i}', email=f'bench_loader_guest_{i}@example.com') for i in range(50)
+        ])
+        listings = Listing.objects.bulk_create([
+            Listing(host=hosts[i % len(hosts)], title=f'Listing {i}', description='A place to stay',
+                    address=f'{i} Bench Street', price_per_night=100 + i)
+            for i in range(rows // 4 or 1)
+        ])
+        start = date(2030, 1, 1)
+        bookings = Booking.objects.bulk_create([
+            Booking(listing=listings[i % len(listings)], user=guests[i % len(guests)],
+                    start_date=start + timedelta(days=i), end_date=start + timedelta(days=i + 2), total_price=200)
+            for i in range(rows)
+        ])
+        Payment.objects.bulk_create([
+            Payment(booking=booking, amount=200, currency='ETB') for booking in bookings
+        ])
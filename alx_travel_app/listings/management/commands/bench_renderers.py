@@ -0,0 +1,66 @@
+# Benchmark JSON rendering CPU and response bytes for large listing/booking pages
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from listings.models import User, Listing, Review, Booking
+from listings.renderers import ORJSONRenderer
+from listings.serializers import ListingSerializer, BookingSerializer
+from datetime import date, timedelta
+import gzip
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Compare JSONRenderer and ORJSONRenderer time and bytes (raw, gzip, brotli) on large pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Data is created inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            self._seed(options['rows'])
+            pages = {
+                'listings': ListingSerializer(
+                    Listing.objects.select_related('host').prefetch_related('reviews'), many=True).data,
+                'bookings': BookingSerializer(
+                    Booking.objects.select_related('listing__host', 'user', 'payment'), many=True).data,
+            }
+            transaction.set_rollback(True)
+
+        for page, data in pages.items():
+            for renderer in (JSONRenderer(), ORJSONRenderer()):
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    body = renderer.render(data)
+                elapsed = (time.perf_counter() - started) / options['repeat']
+
+                sizes = f'raw {len(body):>9}  gzip {len(gzip.compress(body, 6)):>8}'
+                if brotli is not None:
+                    sizes += f'  br {len(brotli.compress(body, quality=4)):>8}'
+                self.stdout.write(
+                    f'{page:<9} {type(renderer).__name__:<15} {elapsed * 1000:8.2f} ms  {sizes} bytes'
+                )
+
+    def _seed(self, rows):
+        user = User.objects.create(username='bench_renderers', email='bench_renderers@example.com')
+        listings = Listing.objects.bulk_create([
+            Listing(host=user, title=f'Listing {i}', description='A place to stay ' * 20,
+                    address=f'{i} Bench Street', price_per_night=100 + i, amenities=['wifi', 'pool', 'tv'])
+            for i in range(rows)
+        ])
+        Review.objects.bulk_create([
+            Review(listing=listing, user=user, rating=4, comment='Nice') for listing in listings for _ in range(3)
+        ])
+        start = date(2030, 1, 1)
+        Booking.objects.bulk_create([
+            Booking(listing=listing, user=user, start_date=start + timedelta(days=i),
+                    end_date=start + timedelta(days=i + 3), total_price=300)
+            for i, listing in enumerate(listings)
+        ])
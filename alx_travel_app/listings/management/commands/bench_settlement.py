@@ -0,0 +1,61 @@
+# Benchmark host payout settlement over a large synthetic ledger
+from collections import defaultdict
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from listings.ledger import settle
+from listings.models import HostLedgerEntry, HostPayout, User
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic ledger and time one settlement pass over it (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1_000_000)
+        parser.add_argument('--hosts', type=int, default=5000)
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            hosts = User.objects.bulk_create([
+                User(username=f'bench_host_{i}', email=f'bench_host_{i}@example.com') for i in range(options['hosts'])
+            ])
+            host_ids = [host.pk for host in hosts]
+            expected = defaultdict(Decimal)
+            started = time.perf_counter()
+            batch = []
+            for _ in range(options['entries']):
+                host_id, currency = rng.choice(host_ids), rng.choice(('ETB', 'ETB', 'ETB', 'NGN'))
+                amount = Decimal(rng.randint(500, 2_000_000)) / 100
+                if rng.random() < 0.01:
+                    # refund-style adjustment
+                    amount = -(amount / 4).quantize(Decimal('0.01'))
+                expected[(host_id, currency)] += amount
+                batch.append(HostLedgerEntry(host_id=host_id, entry_type='earning' if amount > 0 else 'adjustment',
+                                             amount=amount, currency=currency))
+                if len(batch) == 10_000:
+                    HostLedgerEntry.objects.bulk_create(batch)
+                    batch = []
+            HostLedgerEntry.objects.bulk_create(batch)
+            self.stdout.write(f'seeded {options["entries"]} entries for {len(host_ids)} hosts in {time.perf_counter() - started:.1f}s')
+
+            with override_settings(SETTLEMENT_LAG_SECONDS=0):
+                started = time.perf_counter()
+                settlement = settle(chunk_size=options['chunk_size'])
+                elapsed = time.perf_counter() - started
+                again = settle()
+
+            paid = {(host_id, currency): amount for host_id, currency, amount in
+                    HostPayout.objects.filter(settlement=settlement).values_list('host_id', 'currency', 'amount')}
+            exact = all(paid.get(key, Decimal(0)) == max(total, Decimal(0)) for key, total in expected.items())
+            self.stdout.write(
+                f'settled {options["entries"]} entries in {elapsed:.2f}s '
+                f'({options["entries"] / elapsed:,.0f} entries/s): {settlement.payout_count} payouts, '
+                f'{len(settlement.carried)} carried, totals exact: {exact}'
+            )
+            self.stdout.write(f'second run: {"nothing to settle" if again is None else "settled again (unexpected)"}')
+            transaction.set_rollback(True)
@@ -0,0 +1,57 @@
+# Benchmark the similar-listings rebuild: feature building, neighbour search and storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from listings.models import AMENITIES, PROPERTY_TYPES, User, Listing, ListingNeighbours
+from listings import similarity
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Time the similar-listings rebuild on synthetic listings (in memory, or end to end with --db)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=100_000)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--db', action='store_true',
+                            help='seed the listings and run the full rebuild (load, compute, store) in a rolled-back transaction')
+
+    def handle(self, *args, **options):
+        count = options['listings']
+        rng = random.Random(0)
+        types = [key for key, _ in PROPERTY_TYPES]
+        amenities = [key for key, _ in AMENITIES]
+        data = [
+            (rng.choice(types), rng.sample(amenities, rng.randint(0, len(amenities))),
+             round(rng.lognormvariate(4.5, 0.6), 2), rng.choice([None, 1, 2, 3, 4, 5, 3.5, 4.5]))
+            for _ in range(count)
+        ]
+
+        if not options['db']:
+            started = time.perf_counter()
+            features = similarity.build_features(*zip(*data))
+            built = time.perf_counter()
+            similarity.nearest_neighbours(features, options['k'])
+            done = time.perf_counter()
+            self.stdout.write(
+                f'{count} listings, k={options["k"]}: features {built - started:.2f}s, '
+                f'neighbours {done - built:.2f}s, total {done - started:.2f}s'
+            )
+            return
+
+        # Data is created inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            host = User.objects.create(username='bench_similarity', email='bench_similarity@example.com')
+            Listing.objects.bulk_create([
+                Listing(host=host, title=f'Listing {i}', description='', address='', property_type=kind,
+                        amenities=listing_amenities, price_per_night=price)
+                for i, (kind, listing_amenities, price, _) in enumerate(data)
+            ], batch_size=2000)
+            timings = similarity.rebuild(k=options['k'])
+            stored = ListingNeighbours.objects.count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'{timings["listings"]} listings, k={options["k"]}: load {timings["load"]:.2f}s, '
+            f'compute {timings["compute"]:.2f}s, store {timings["store"]:.2f}s ({stored} rows)'
+        )
@@ -0,0 +1,40 @@
+# Benchmark the per-request cost of the token-bucket throttles
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from listings.throttling import IPBucketThrottle, cache_store, local_store
+import time
+
+
+class _View:
+    throttle_scope = 'bench'
+
+
+class Command(BaseCommand):
+    help = 'Measure the time spent in the token-bucket throttle per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=1000, help='number of distinct client IPs')
+
+    def handle(self, *args, **options):
+        count, clients = options['requests'], options['clients']
+        factory = APIRequestFactory()
+        requests = [factory.get('/bench/', REMOTE_ADDR=f'10.0.{i // 256 % 256}.{i % 256}') for i in range(clients)]
+        capacity, rate = 1000, 1000.0
+
+        # Raw bucket stores
+        for label, store in (('shared_cache_store', cache_store), ('local_fallback_store', local_store)):
+            started = time.perf_counter()
+            for i in range(count):
+                store.consume(f'bench:{label}:{i % clients}', capacity, rate, time.time())
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label:<24} {elapsed / count * 1e6:8.2f} us/check')
+
+        # Full throttle path, including key derivation and rate lookup
+        throttle = IPBucketThrottle()
+        throttle.get_rate = lambda view: (capacity, rate)
+        started = time.perf_counter()
+        for i in range(count):
+            throttle.allow_request(requests[i % clients], _View)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{"IPBucketThrottle":<24} {elapsed / count * 1e6:8.2f} us/request')
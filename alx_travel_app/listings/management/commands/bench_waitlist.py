@@ -0,0 +1,83 @@
+# Benchmark waitlist matching for a hot listing with thousands of waiting guests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from listings import waitlist
+from listings.models import Booking, CalendarBlock, Listing, User, WaitlistEntry
+from datetime import timedelta
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Time matching freed dates against the waitlist of a hot listing, and releasing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--waiters', type=int, default=5000, help='entries on the hot listing')
+        parser.add_argument('--other-entries', type=int, default=50_000, help='entries on other listings')
+        parser.add_argument('--cancellations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        today = timezone.localdate()
+        max_nights = settings.WAITLIST_MAX_NIGHTS
+
+        def entry(listing, user):
+            start = today + timedelta(days=rng.randint(1, 365))
+            return WaitlistEntry(listing=listing, user=user, start_date=start,
+                                 end_date=start + timedelta(days=rng.randint(1, max_nights)))
+
+        with transaction.atomic():
+            host = User.objects.create(username='bench_waitlist_host', email='bench_waitlist_host@example.com')
+            guests = User.objects.bulk_create([
+                User(username=f'bench_waitlist_{i}', email=f'bench_waitlist_{i}@example.com') for i in range(2000)
+            ])
+            listings = Listing.objects.bulk_create([
+                Listing(host=host, title=f'Listing {i}', description='', address='', price_per_night=100)
+                for i in range(200)
+            ])
+            hot = listings[0]
+            # the hot listing is booked solid in 5-night stays
+            bookings = Booking.objects.bulk_create([
+                Booking(listing=hot, user=guests[i], start_date=today + timedelta(days=1 + 5 * i),
+                        end_date=today + timedelta(days=6 + 5 * i), total_price=500, status='confirmed')
+                for i in range(73)
+            ])
+            entries = [entry(hot, rng.choice(guests)) for _ in range(options['waiters'])]
+            entries += [entry(rng.choice(listings[1:]), rng.choice(guests)) for _ in range(options['other_entries'])]
+            WaitlistEntry.objects.bulk_create(entries, batch_size=5000, ignore_conflicts=True)
+            self.stdout.write(f'{WaitlistEntry.objects.filter(listing=hot).count()} guests waiting on the hot listing, '
+                              f'{len(entries)} entries in total')
+
+            freed = rng.sample(bookings, min(options['cancellations'], len(bookings)))
+            Booking.objects.filter(id__in=[booking.id for booking in freed]).update(status='cancelled')
+            def per_entry(booking):
+                # every overlapping entry, each checked with its own NOT EXISTS subqueries
+                taken = Booking.objects.overlapping(OuterRef('start_date'), OuterRef('end_date')).filter(listing=hot)
+                blocked = CalendarBlock.objects.overlapping(OuterRef('start_date'), OuterRef('end_date')).filter(listing=hot)
+                return list(
+                    WaitlistEntry.objects.filter(listing=hot, start_date__gte=today, start_date__lt=booking.end_date,
+                                                 end_date__gt=booking.start_date)
+                    .exclude(Exists(taken)).exclude(Exists(blocked))
+                    .order_by('created_at', 'id').values_list('id', flat=True)
+                )
+
+            for label, query in (
+                ('range scan + sweep', lambda booking: waitlist.matching(hot.pk, booking.start_date, booking.end_date)),
+                ('per-entry subqueries', per_entry),
+            ):
+                started = time.perf_counter()
+                matched = [len(query(booking)) for booking in freed]
+                elapsed = (time.perf_counter() - started) / len(freed)
+                self.stdout.write(f'  {label:<21} {elapsed * 1e3:7.2f} ms per cancellation, '
+                                  f'{sum(matched) / len(matched):.1f} guests matched on average')
+
+            started = time.perf_counter()
+            released = [len(waitlist.release(booking.id)) for booking in freed]
+            elapsed = (time.perf_counter() - started) / len(freed)
+            batches = sum(-(-count // settings.WAITLIST_NOTIFY_BATCH) for count in released)
+            self.stdout.write(f'  release()             {elapsed * 1e3:7.2f} ms per cancellation '
+                              f'(match, stamp, record), {batches} notification batches queued in total')
+            transaction.set_rollback(True)
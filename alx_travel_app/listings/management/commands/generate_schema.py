@@ -0,0 +1,73 @@
+# Build the static OpenAPI schema artifact served at /openapi.json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pathlib import Path
+import hashlib
+import logging
+
+# Source that shapes the schema; the artifact is rebuilt only when these change
+SOURCE_DIRS = ['alx_travel_app', 'listings']
+
+
+def source_fingerprint():
+    digest = hashlib.sha256()
+    for directory in SOURCE_DIRS:
+        for path in sorted((Path(settings.BASE_DIR) / directory).rglob('*.py')):
+            if 'migrations' in path.parts or 'management' in path.parts:
+                continue
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class _CollectingHandler(logging.Handler):
+    # Keeps the warnings and errors logged while the schema is generated
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema artifact (skipped when the API source has not changed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='regenerate even if the source is unchanged')
+        parser.add_argument('--url', default=None, help='base API URL to embed in the schema')
+
+    def handle(self, *args, **options):
+        output = Path(settings.OPENAPI_SCHEMA_PATH)
+        fingerprint_file = output.with_name(output.name + '.sha256')
+        fingerprint = source_fingerprint()
+
+        if (not options['force'] and output.exists() and fingerprint_file.exists()
+                and fingerprint_file.read_text().strip() == fingerprint):
+            self.stdout.write(f'OpenAPI schema is up to date ({output})')
+            return
+
+        from drf_yasg.codecs import OpenAPICodecJson
+        from drf_yasg.generators import OpenAPISchemaGenerator
+        from alx_travel_app.swagger import api_info
+
+        # drf_yasg logs a view that fails during generation and leaves its operations out;
+        # a partial schema must fail the build rather than be published
+        errors = _CollectingHandler()
+        yasg_logger = logging.getLogger('drf_yasg')
+        yasg_logger.addHandler(errors)
+        try:
+            generator = OpenAPISchemaGenerator(api_info, url=options['url'])
+            schema = generator.get_schema(request=None, public=True)
+        finally:
+            yasg_logger.removeHandler(errors)
+        if errors.messages:
+            raise CommandError('Schema generation logged errors:\n' + '\n'.join(errors.messages))
+        body = OpenAPICodecJson(validators=[], pretty=False).encode(schema)
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output.with_name(output.name + '.tmp')
+        tmp.write_bytes(body)
+        tmp.replace(output)
+        fingerprint_file.write_text(fingerprint)
+        self.stdout.write(f'OpenAPI schema written to {output} ({len(body)} bytes)')
@@ -0,0 +1,41 @@
+# Import external iCal feeds into listing availability
+from django.core.management.base import BaseCommand, CommandError
+from listings.ical import CalendarImportError, fetch_and_sync, sync_calendar
+from listings.models import ExternalCalendar, Listing
+import requests
+
+
+class Command(BaseCommand):
+    help = 'Import an .ics file into a listing calendar, or sync every external calendar that has a feed URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listing', help='listing id to import --file into')
+        parser.add_argument('--file', help='.ics file to import')
+        parser.add_argument('--name', default='import', help='calendar name (created when missing)')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            if not options['listing']:
+                raise CommandError('--file needs --listing')
+            listing = Listing.objects.filter(pk=options['listing']).first()
+            if listing is None:
+                raise CommandError(f'Listing {options["listing"]} not found')
+            calendar, _ = ExternalCalendar.objects.get_or_create(listing=listing, name=options['name'])
+            try:
+                with open(options['file'], encoding='utf-8') as lines:
+                    counts = sync_calendar(calendar, lines)
+            except CalendarImportError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'{calendar}: {self._describe(counts)}')
+            return
+
+        for calendar in ExternalCalendar.objects.exclude(url='').select_related('listing'):
+            try:
+                counts = fetch_and_sync(calendar)
+            except (requests.RequestException, CalendarImportError) as e:
+                self.stderr.write(f'{calendar}: failed ({e})')
+                continue
+            self.stdout.write(f'{calendar}: {self._describe(counts) if counts is not None else "not modified"}')
+
+    def _describe(self, counts):
+        return ', '.join(f'{value} {key}' for key, value in counts.items())
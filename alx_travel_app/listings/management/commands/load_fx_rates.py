@@ -0,0 +1,28 @@
+# Load exchange rates from a file into the FxRate table
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from listings import fx
+from listings.models import FxRate
+
+
+class Command(BaseCommand):
+    help = 'Replace the FxRate table with the rates in a JSON or CSV file (rebased on FX_BASE_CURRENCY)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='JSON ({"base": ..., "rates": {...}}) or CSV (currency,rate) rates file')
+
+    def handle(self, *args, **options):
+        try:
+            rates = fx.parse_rates_file(options['file'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        with transaction.atomic():
+            FxRate.objects.exclude(currency__in=rates).delete()
+            for currency, rate in rates.items():
+                FxRate.objects.update_or_create(currency=currency, defaults={'rate': rate.quantize(Decimal('1e-8'))})
+        fx.invalidate()
+        self.stdout.write(f'{len(rates)} rates loaded, per one {settings.FX_BASE_CURRENCY}')
+        if settings.FX_RATES_FILE:
+            self.stderr.write(f'Note: FX_RATES_FILE is set, so {settings.FX_RATES_FILE} is used instead of this table')
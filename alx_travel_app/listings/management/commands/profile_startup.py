@@ -0,0 +1,65 @@
+# Profile worker cold-start: import times and total boot time
+from django.core.management.base import BaseCommand, CommandError
+import os
+import subprocess
+import sys
+import time
+
+# What a gunicorn worker does before serving its first request
+BOOT_SCRIPT = (
+    'from django.core.wsgi import get_wsgi_application; '
+    'application = get_wsgi_application(); '
+    'from django.urls import get_resolver; get_resolver().url_patterns'
+)
+
+
+class Command(BaseCommand):
+    help = 'Boot the WSGI application in a fresh interpreter and report the slowest imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='number of imports to list')
+        parser.add_argument('--runs', type=int, default=3, help='boots to time (the fastest is reported)')
+        parser.add_argument('--budget-ms', type=float, default=None,
+                            help='fail (exit code 1) when boot time exceeds this many milliseconds')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'alx_travel_app.settings')
+
+        boot_times = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            self._boot(env)
+            boot_times.append((time.perf_counter() - started) * 1000)
+        boot_ms = min(boot_times)
+
+        imports = self._parse_importtime(self._boot(env, importtime=True))
+        imports.sort(key=lambda item: item[1], reverse=True)
+
+        self.stdout.write(f'{"cumulative ms":>14} {"self ms":>9}  module')
+        for module, cumulative, self_us in imports[:options['top']]:
+            self.stdout.write(f'{cumulative / 1000:14.1f} {self_us / 1000:9.1f}  {module}')
+        self.stdout.write(f'\nWorker boot time: {boot_ms:.0f} ms (best of {len(boot_times)})')
+
+        budget = options['budget_ms']
+        if budget is not None and boot_ms > budget:
+            raise CommandError(f'Boot time {boot_ms:.0f} ms exceeds the {budget:.0f} ms budget')
+
+    def _boot(self, env, importtime=False):
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        result = subprocess.run(command + ['-c', BOOT_SCRIPT], env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'Application failed to boot:\n{result.stderr}')
+        return result.stderr
+
+    def _parse_importtime(self, output):
+        # Lines look like: "import time:       self |  cumulative | package"
+        imports = []
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            imports.append((module.strip(), int(cumulative_us), int(self_us)))
+        return imports
@@ -0,0 +1,23 @@
+# Recompute ListingRatingStats from the reviews table (backfill or repair)
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from listings.models import ListingRatingStats, Review
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every listing rating histogram from its reviews with one GROUP BY'
+
+    def handle(self, *args, **options):
+        rows = (
+            Review.objects.order_by().values('listing_id')
+            .annotate(
+                review_count=Count('id'), rating_sum=Sum('rating'),
+                **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+            )
+        )
+        stats = [ListingRatingStats(**row) for row in rows]
+        with transaction.atomic():
+            ListingRatingStats.objects.all().delete()
+            ListingRatingStats.objects.bulk_create(stats, batch_size=1000)
+        self.stdout.write(f'Rebuilt rating stats for {len(stats)} listings')
@@ -0,0 +1,31 @@
+# Relay process for the booking/payment outbox
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from listings import outbox
+import time
+
+
+class Command(BaseCommand):
+    help = 'Publish outbox events to the configured sink (OUTBOX_SINK) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='drain the outbox once and exit')
+        parser.add_argument('--requeue-parked', nargs='*', type=int, metavar='ID',
+                            help='give parked events (all, or the given ids) fresh attempts, then exit')
+
+    def handle(self, *args, **options):
+        if options['requeue_parked'] is not None:
+            requeued = outbox.requeue_parked(options['requeue_parked'] or None)
+            self.stdout.write(f'Requeued {requeued} parked events')
+            return
+        sink = outbox.get_sink()
+        while True:
+            published = outbox.relay(batch_size=options['batch_size'], sink=sink)
+            if published:
+                self.stdout.write(f'Published {published} events')
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+# Compute host payouts from the ledger
+from django.core.management.base import BaseCommand
+from listings.ledger import settle
+import time
+
+
+class Command(BaseCommand):
+    help = 'Settle every host balance accrued since the last settlement (resumes an interrupted run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10_000, help='ledger rows fetched per round trip')
+        parser.add_argument('--checkpoint-every', type=int, default=200_000,
+                            help='save progress after this many entries, for resuming')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        settlement = settle(chunk_size=options['chunk_size'], checkpoint_every=options['checkpoint_every'])
+        if settlement is None:
+            self.stdout.write('Nothing to settle')
+            return
+        self.stdout.write(
+            f'Settlement {settlement.id}: ledger entries {settlement.from_entry_id + 1}-{settlement.to_entry_id}, '
+            f'{settlement.payout_count} payouts, {len(settlement.carried)} negative balances carried '
+            f'({time.perf_counter() - started:.1f}s)'
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('host', 'Host'), ('guest', 'Guest'), ('both', 'Both'), ('agency', 'Agency')], default='guest', max_length=10),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_reviews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingNeighbours',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='listings.listing')),
+                ('neighbours', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
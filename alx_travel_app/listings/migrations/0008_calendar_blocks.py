@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+import django.db.models.deletion
+import listings.models
+import uuid
+from django.db import migrations, models
+
+
+def assign_calendar_tokens(apps, schema_editor):
+    # AddField gives every existing listing the same default; each feed needs its own token
+    Listing = apps.get_model('listings', 'Listing')
+    for listing in Listing.objects.only('pk').iterator():
+        Listing.objects.filter(pk=listing.pk).update(calendar_token=listings.models.new_calendar_token())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_listingneighbours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='calendar_token',
+            field=models.CharField(default=listings.models.new_calendar_token, editable=False, max_length=64),
+        ),
+        migrations.RunPython(assign_calendar_tokens, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ExternalCalendar',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('url', models.URLField(blank=True, max_length=500)),
+                ('etag', models.CharField(blank=True, max_length=200)),
+                ('last_modified', models.CharField(blank=True, max_length=100)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='external_calendars', to='listings.listing')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CalendarBlock',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('uid', models.CharField(max_length=255)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('summary', models.CharField(blank=True, max_length=200)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_blocks', to='listings.listing')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='listings.externalcalendar')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='externalcalendar',
+            constraint=models.UniqueConstraint(fields=('listing', 'name'), name='external_calendar_unique_name'),
+        ),
+        migrations.AddIndex(
+            model_name='calendarblock',
+            index=models.Index(fields=['listing', 'start_date', 'end_date'], name='calendar_block_dates_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='calendarblock',
+            constraint=models.UniqueConstraint(fields=('calendar', 'uid'), name='calendar_block_unique_uid'),
+        ),
+    ]
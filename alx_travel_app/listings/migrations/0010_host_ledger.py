@@ -0,0 +1,78 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutSettlement',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed')], default='running', max_length=10)),
+                ('from_entry_id', models.BigIntegerField()),
+                ('to_entry_id', models.BigIntegerField()),
+                ('progress_entry_id', models.BigIntegerField()),
+                ('partial_sums', models.JSONField(default=dict)),
+                ('carried', models.JSONField(default=dict)),
+                ('payout_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'running')), fields=('status',), name='settlement_single_running')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HostBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('host', 'currency'), name='host_balance_unique_currency')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HostPayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payouts', to=settings.AUTH_USER_MODEL)),
+                ('settlement', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payouts', to='listings.payoutsettlement')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('settlement', 'host', 'currency'), name='payout_unique_host_currency')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HostLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('entry_type', models.CharField(choices=[('earning', 'Earning'), ('adjustment', 'Adjustment'), ('payout', 'Payout')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('currency', models.CharField(max_length=3)),
+                ('payment_id', models.UUIDField(blank=True, null=True)),
+                ('booking_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+                ('settlement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='listings.payoutsettlement')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['host', 'id'], name='ledger_host_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('payment_id__isnull', False)), fields=('payment_id', 'entry_type'), name='ledger_unique_payment_entry')],
+            },
+        ),
+    ]
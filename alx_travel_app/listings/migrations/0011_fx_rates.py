@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0010_host_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('currency', models.CharField(max_length=3, primary_key=True, serialize=False)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='currency',
+            field=models.CharField(default='ETB', max_length=3),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['currency', 'price_per_night'], name='listing_currency_price_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:38
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_fx_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistRelease',
+            fields=[
+                ('booking_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('listing_id', models.UUIDField()),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('released_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('notify_count', models.PositiveIntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='listings.listing')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', 'start_date', 'end_date'], name='waitlist_listing_dates_idx'), models.Index(fields=['user', '-created_at'], name='waitlist_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('listing', 'user', 'start_date', 'end_date'), name='waitlist_unique_request')],
+            },
+        ),
+    ]
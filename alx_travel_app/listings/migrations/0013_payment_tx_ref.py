@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_waitlist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='chapa_reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['tx_ref'], name='payment_event_tx_ref_idx'),
+        ),
+    ]
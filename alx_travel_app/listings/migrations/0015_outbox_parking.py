@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_payment_refund_due'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedOutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('outbox_id', models.BigIntegerField()),
+                ('consumer', models.CharField(max_length=50)),
+                ('processed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='outboxevent',
+            name='outbox_unpublished_idx',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='parked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('parked_at__isnull', True), ('published_at__isnull', True)), fields=['id'], name='outbox_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['published_at'], name='outbox_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processedoutboxevent',
+            index=models.Index(fields=['processed_at'], name='processed_outbox_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='processedoutboxevent',
+            constraint=models.UniqueConstraint(fields=('outbox_id', 'consumer'), name='processed_outbox_unique_consumer'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:02
+
+import listings.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0015_outbox_parking'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', listings.models.UserManager()),
+            ],
+        ),
+    ]
@@ -1,5 +1,11 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+from collections import defaultdict
+from django.db import models, transaction
+from django.db.models import F
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.dispatch import Signal
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+import secrets
 import uuid
 
 # Create your models here.
@@ -9,7 +15,9 @@ import uuid
 USER_ROLES = (
     ('host', 'Host'),
     ('guest', 'Guest'),
-    ('both', 'Both')
+    ('both', 'Both'),
+    # agency partners may book and reschedule on behalf of other users
+    ('agency', 'Agency'),
 )
 
 # Property type choices
@@ -33,6 +41,42 @@ AMENITIES = (
     ('gym', 'Gym'),
 )
 
+# Booking status choices
+# pending -> confirmed -> completed, and pending/confirmed -> cancelled
+BOOKING_STATUSES = (
+    ('pending', 'Pending'),
+    ('confirmed', 'Confirmed'),
+    ('cancelled', 'Cancelled'),
+    ('completed', 'Completed'),
+)
+
+BOOKING_TRANSITIONS = {
+    'pending': ('confirmed', 'cancelled'),
+    'confirmed': ('completed', 'cancelled'),
+    'cancelled': (),
+    'completed': (),
+}
+
+# Bookings in these states hold the listing's dates
+ACTIVE_BOOKING_STATUSES = ('pending', 'confirmed')
+
+# Sent after a queryset update() of users, which sends no post_save for the rows it changes
+users_updated = Signal()
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # update() skips auto_now, and updated_at drives the ETags of listings and bookings
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        users_updated.send(sender=self.model)
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 # User model
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -43,10 +87,17 @@ class User(AbstractUser):
     role = models.CharField(max_length=10, choices=USER_ROLES, default='guest')
     password_hash = models.CharField(max_length=128)
     date_joined = models.DateTimeField(auto_now_add=True)
+    # Bumped on every save; listings and bookings render their user, so it is part of their ETag
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserManager()
 
     def __str__(self):
         return self.username
 
+def new_calendar_token():
+    return secrets.token_urlsafe(24)
+
 # Listing model
 class Listing(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -59,11 +110,23 @@ class Listing(models.Model):
     amenities = models.JSONField(default=list)
     address = models.CharField(max_length=255)
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
+    # ISO 4217 code of price_per_night; shown converted to the caller's currency (listings.fx)
+    currency = models.CharField(max_length=3, default='ETB')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every save and when a review is added/removed; drives ETag/Last-Modified
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Secret in the iCal export URL, so other platforms can poll it without logging in
+    calendar_token = models.CharField(max_length=64, default=new_calendar_token, editable=False)
 
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            # price-range search across currencies compares each currency's own bounds
+            models.Index(fields=['currency', 'price_per_night'], name='listing_currency_price_idx'),
+        ]
+
 # Review model
 # Note: Each listing can have multiple reviews, but each review is linked to one listing and one user. Only users who have booked a listing can leave a review.
 class Review(models.Model):
@@ -74,9 +137,140 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored (listing, rating), so ListingRatingStats can be adjusted by the difference on save/delete
+        instance._stored_rating = (instance.__dict__.get('listing_id'), instance.__dict__.get('rating'))
+        return instance
+
     def __str__(self):
         return f'Review by {self.user} for {self.listing.title}'
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'user'], name='review_one_per_user_listing'),
+        ]
+        indexes = [
+            # per-listing review feed, newest first (cursor pagination)
+            models.Index(fields=['listing', '-created_at'], name='review_listing_feed_idx'),
+        ]
+
+
+# Per-listing rating histogram
+# Note: Maintained incrementally by signals on Review save/delete (listings.signals),
+# so reads never aggregate over the reviews table.
+class ListingRatingStats(models.Model):
+    listing = models.OneToOneField(Listing, primary_key=True, related_name='rating_stats', on_delete=models.CASCADE)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def record_change(cls, listing_id, added=None, removed=None):
+        """Count a review with rating `added` in, and/or one with rating `removed` out"""
+        deltas = defaultdict(int)
+        for rating, sign in ((added, 1), (removed, -1)):
+            if rating is None:
+                continue
+            deltas['review_count'] += sign
+            deltas['rating_sum'] += sign * rating
+            if 1 <= rating <= 5:
+                deltas[f'stars_{rating}'] += sign
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if not updates:
+            return
+        cls.objects.get_or_create(listing_id=listing_id)
+        cls.objects.filter(listing_id=listing_id).update(**updates)
+
+    @property
+    def histogram(self):
+        return {str(stars): getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+    @property
+    def average(self):
+        return round(self.rating_sum / self.review_count, 2) if self.review_count else None
+
+    def __str__(self):
+        return f'Rating stats for listing {self.listing_id}'
+
+
+# Similar listings
+# Note: Rebuilt in batch by listings.similarity.rebuild() (periodic Celery task); the
+# similar-listings endpoint reads one row by primary key.
+class ListingNeighbours(models.Model):
+    listing = models.OneToOneField(Listing, primary_key=True, related_name='neighbours', on_delete=models.CASCADE)
+    # [[listing_id, score], ...], most similar first
+    neighbours = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Similar listings for {self.listing_id}'
+
+class BookingQuerySet(models.QuerySet):
+    def active(self):
+        # Only pending and confirmed bookings block a listing's dates
+        return self.filter(status__in=ACTIVE_BOOKING_STATUSES)
+
+    def overlapping(self, start_date, end_date):
+        return self.active().filter(start_date__lt=end_date, end_date__gt=start_date)
+
+    def stays(self, user, listing):
+        # Paid-for stays of `user` at `listing` that have ended (served by booking_user_listing_end_idx)
+        return self.filter(
+            user=user, listing=listing, end_date__lte=timezone.localdate(), status__in=('confirmed', 'completed')
+        )
+
+    def expire_pending(self, older_than):
+        """
+        Cancel pending bookings created before `older_than` that were never paid,
+        releasing their dates. Returns the number of bookings expired.
+        """
+        with transaction.atomic():
+            expired_ids = list(
+                self.filter(status='pending', created_at__lt=older_than)
+                .exclude(payment__status='completed')
+                .values_list('id', flat=True)
+            )
+            if not expired_ids:
+                return 0
+            now = timezone.now()
+            Payment.objects.filter(booking_id__in=expired_ids, status='pending').update(status='canceled', updated_at=now)
+            expired = self.filter(id__in=expired_ids, status='pending').update(
+                status='cancelled', status_changed_at=now, updated_at=now
+            )
+            OutboxEvent.objects.bulk_create([
+                OutboxEvent(aggregate_type='booking', aggregate_id=str(booking_id), event_type='booking.expired',
+                            payload={'booking_id': str(booking_id)})
+                for booking_id in expired_ids
+            ])
+            return expired
+
+    def complete_ended(self, today):
+        """
+        Complete confirmed bookings whose stay ended on or before `today`, so they
+        become reviewable history and archivable. Returns the number completed.
+        """
+        with transaction.atomic():
+            ended_ids = list(self.filter(status='confirmed', end_date__lte=today).values_list('id', flat=True))
+            if not ended_ids:
+                return 0
+            now = timezone.now()
+            completed = self.filter(id__in=ended_ids, status='confirmed').update(
+                status='completed', status_changed_at=now, updated_at=now
+            )
+            OutboxEvent.objects.bulk_create([
+                OutboxEvent(aggregate_type='booking', aggregate_id=str(booking_id), event_type='booking.completed',
+                            payload={'booking_id': str(booking_id)})
+                for booking_id in ended_ids
+            ])
+            return completed
+
+
 # Booking model
 class Booking(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -85,10 +279,70 @@ class Booking(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=BOOKING_STATUSES, default='pending')
+    status_changed_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every save and when its payment changes; drives ETag/Last-Modified
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    def transition_to(self, new_status):
+        """
+        Move the booking to `new_status`, enforcing BOOKING_TRANSITIONS, and
+        record a booking.<status> outbox event in the same transaction.
+        Moving to the current status is a no-op.
+
+        The row is only updated if it still has the status the transition was
+        checked against, so of two concurrent transitions only one applies; the
+        other is re-checked against the status the first one wrote.
+        """
+        while new_status != self.status:
+            if new_status not in BOOKING_TRANSITIONS[self.status]:
+                raise ValidationError(f"Cannot change booking from {self.status} to {new_status}.")
+            now = timezone.now()
+            with transaction.atomic():
+                changed = Booking.objects.filter(pk=self.pk, status=self.status).update(
+                    status=new_status, status_changed_at=now, updated_at=now,
+                )
+                if changed:
+                    self.status, self.status_changed_at, self.updated_at = new_status, now, now
+                    OutboxEvent.objects.create(
+                        aggregate_type='booking', aggregate_id=str(self.id),
+                        event_type=f'booking.{new_status}', payload={'booking_id': str(self.id)},
+                    )
+                    return
+            self.refresh_from_db(fields=['status', 'status_changed_at', 'updated_at'])
+
+    def confirm(self):
+        self.transition_to('confirmed')
+
+    def cancel(self):
+        self.transition_to('cancelled')
+
+    def complete(self):
+        self.transition_to('completed')
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_BOOKING_STATUSES
 
     def __str__(self):
         return f'Booking by {self.user} for {self.listing.title} from {self.start_date} to {self.end_date}'
+
+    class Meta:
+        indexes = [
+            # availability checks: active bookings of a listing overlapping a date range
+            models.Index(
+                fields=['listing', 'start_date', 'end_date'],
+                condition=models.Q(status__in=ACTIVE_BOOKING_STATUSES),
+                name='booking_active_dates_idx',
+            ),
+            # expiry job: oldest pending bookings first
+            models.Index(fields=['status', 'created_at'], name='booking_status_created_idx'),
+            # review eligibility: has this user stayed at this listing?
+            models.Index(fields=['user', 'listing', 'end_date'], name='booking_user_listing_end_idx'),
+        ]
     
 # Payment model
 class Payment(models.Model):
@@ -97,24 +351,433 @@ class Payment(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('canceled', 'Canceled'),
+        # paid for a booking that expired or was cancelled; the guest is owed the money back
+        ('refund_due', 'Refund due'),
     ]
+    # a successful charge has been applied; verifying the payment again changes nothing
+    SETTLED_STATUSES = ('completed', 'refund_due')
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name="payment")
     transaction_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default="NGN")
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
-    chapa_reference = models.CharField(max_length=100, blank=True, null=True)
+    # tx_ref of the current Chapa checkout; a retry starts a new one, the primary key stays
+    chapa_reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     payment_method = models.CharField(max_length=50, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     paid_at = models.DateTimeField(blank=True, null=True)
-    
-    # Additional fields for tracking
-    initiation_response = models.JSONField(blank=True, null=True)
-    verification_response = models.JSONField(blank=True, null=True)
-    
+
+    @classmethod
+    def for_tx_ref(cls, tx_ref, queryset=None):
+        """
+        The payment a Chapa tx_ref belongs to: the current checkout, or one a retry
+        superseded (found through the event log). Raises DoesNotExist.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        payment = queryset.filter(chapa_reference=tx_ref).first()
+        if payment is None:
+            payment = queryset.filter(
+                events__tx_ref=tx_ref, events__event_type__in=('initiation', 'retry'),
+            ).distinct().first()
+        if payment is None:
+            raise cls.DoesNotExist(f"No payment for tx_ref {tx_ref}")
+        return payment
+
+    # Provider payloads live in PaymentEvent so that list and status queries
+    # only ever touch the narrow columns above
+    def record_event(self, event_type, payload=None, tx_ref=None):
+        """Append a Chapa exchange to this payment's event log"""
+        return PaymentEvent.objects.create(
+            payment=self,
+            event_type=event_type,
+            tx_ref=tx_ref or self.chapa_reference or '',
+            payload=payload,
+        )
+
+    def latest_event(self, event_type):
+        """Fetch the most recent event of the given type, or None"""
+        return self.events.filter(event_type=event_type).order_by('-created_at').first()
+
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.status}"
     
     class Meta:
         ordering = ['-created_at']
+
+
+# PaymentEvent model
+# Note: Append-only log of every request/response exchanged with Chapa for a payment.
+# Rows are never updated, so retries keep the full history of previous attempts.
+class PaymentEvent(models.Model):
+    EVENT_TYPES = [
+        ('initiation', 'Initiation'),
+        ('verification', 'Verification'),
+        ('retry', 'Retry'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    tx_ref = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("PaymentEvent rows are append-only and cannot be updated.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.event_type} event for payment {self.payment_id}"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['payment', 'created_at']),
+            # webhooks for a checkout a retry replaced are matched by its tx_ref
+            models.Index(fields=['tx_ref'], name='payment_event_tx_ref_idx'),
+        ]
+
+
+# OutboxEvent model
+# Note: Side effects of Booking/Payment changes are written here in the same transaction
+# as the change itself; listings.outbox.relay() publishes them afterwards in batches.
+class OutboxEvent(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    aggregate_type = models.CharField(max_length=30)
+    aggregate_id = models.CharField(max_length=64)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # set once publishing failed OUTBOX_MAX_ATTEMPTS times; the relay skips parked events
+    parked_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.event_type} for {self.aggregate_type} {self.aggregate_id}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # the relay only ever scans pending (unpublished, unparked) events in id order
+            models.Index(
+                fields=['id'], condition=models.Q(published_at__isnull=True, parked_at__isnull=True),
+                name='outbox_pending_idx',
+            ),
+            # purge of old published events
+            models.Index(fields=['published_at'], name='outbox_published_idx'),
+        ]
+
+
+# Consumed outbox events
+# Note: One row per (outbox event, consumer) whose side effect has been carried out,
+# written in the same transaction as it (listings.outbox.consume_once), so a redelivered
+# event is recognised and not acted on twice.
+class ProcessedOutboxEvent(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    outbox_id = models.BigIntegerField()
+    consumer = models.CharField(max_length=50)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Outbox event {self.outbox_id} processed by {self.consumer}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['outbox_id', 'consumer'], name='processed_outbox_unique_consumer'),
+        ]
+        indexes = [
+            models.Index(fields=['processed_at'], name='processed_outbox_time_idx'),
+        ]
+
+
+# External calendars
+# Note: Hosts register the iCal feeds of other platforms; listings.ical imports their
+# events as CalendarBlocks, which the availability checks treat like active bookings.
+class ExternalCalendar(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    listing = models.ForeignKey(Listing, related_name='external_calendars', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    url = models.URLField(max_length=500, blank=True)
+    # HTTP validators from the last fetch, sent back so unchanged feeds answer 304
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    last_synced_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} calendar for listing {self.listing_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'name'], name='external_calendar_unique_name'),
+        ]
+
+
+class CalendarBlockQuerySet(models.QuerySet):
+    def overlapping(self, start_date, end_date):
+        return self.filter(start_date__lt=end_date, end_date__gt=start_date)
+
+
+class CalendarBlock(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    calendar = models.ForeignKey(ExternalCalendar, related_name='blocks', on_delete=models.CASCADE)
+    # copied from the calendar so availability checks don't need a join
+    listing = models.ForeignKey(Listing, related_name='calendar_blocks', on_delete=models.CASCADE)
+    uid = models.CharField(max_length=255)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    summary = models.CharField(max_length=200, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CalendarBlockQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Blocked {self.start_date} to {self.end_date} for listing {self.listing_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['calendar', 'uid'], name='calendar_block_unique_uid'),
+        ]
+        indexes = [
+            models.Index(fields=['listing', 'start_date', 'end_date'], name='calendar_block_dates_idx'),
+        ]
+
+
+# Archive
+# Note: Finished bookings (with their payment and payment events) are moved here by
+# `manage.py archive_bookings` once they are older than BOOKING_ARCHIVE_AFTER_DAYS, so the
+# hot Booking/Payment tables only hold recent and open history. Columns mirror the hot
+# models; timestamps are plain fields so the original values are kept.
+class ArchivedBookingQuerySet(models.QuerySet):
+    def stays(self, user, listing):
+        return self.filter(user=user, listing=listing, status__in=('confirmed', 'completed'))
+
+
+class ArchivedBooking(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False)
+    listing = models.ForeignKey(Listing, related_name='archived_bookings', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='archived_bookings', on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=BOOKING_STATUSES)
+    status_changed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ArchivedBookingQuerySet.as_manager()
+
+    def __str__(self):
+        return f'Archived booking {self.id} from {self.start_date} to {self.end_date}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-start_date'], name='archived_booking_user_idx'),
+            models.Index(fields=['user', 'listing', 'end_date'], name='archived_booking_stay_idx'),
+        ]
+
+
+class ArchivedPayment(models.Model):
+    booking = models.OneToOneField(ArchivedBooking, on_delete=models.CASCADE, related_name='payment')
+    transaction_id = models.UUIDField(primary_key=True, editable=False)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS)
+    chapa_reference = models.CharField(max_length=100, blank=True, null=True)
+    payment_method = models.CharField(max_length=50, blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    paid_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived payment {self.transaction_id} - {self.status}"
+
+
+class ArchivedPaymentEvent(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False)
+    payment = models.ForeignKey(ArchivedPayment, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=20, choices=PaymentEvent.EVENT_TYPES)
+    tx_ref = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived {self.event_type} event for payment {self.payment_id}"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['payment', 'created_at'], name='archived_event_payment_idx'),
+        ]
+
+
+# Host payouts
+# Note: HostLedgerEntry is append-only: an earning per completed payment, and a negative
+# payout entry per host and currency when a settlement pays the balance out (see
+# listings.ledger). Payments are referenced by id only, so archiving them leaves the
+# ledger untouched. HostBalance is the running sum of a host's entries per currency.
+LEDGER_ENTRY_TYPES = (
+    ('earning', 'Earning'),
+    ('adjustment', 'Adjustment'),
+    ('payout', 'Payout'),
+)
+
+
+class HostLedgerEntry(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    host = models.ForeignKey(User, related_name='ledger_entries', on_delete=models.PROTECT)
+    entry_type = models.CharField(max_length=20, choices=LEDGER_ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    payment_id = models.UUIDField(blank=True, null=True)
+    booking_id = models.UUIDField(blank=True, null=True)
+    settlement = models.ForeignKey('PayoutSettlement', related_name='entries', blank=True, null=True,
+                                   on_delete=models.PROTECT)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("HostLedgerEntry rows are append-only and cannot be updated.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.entry_type} of {self.amount} {self.currency} for host {self.host_id}"
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            # a payment is earned once, however often it is verified
+            models.UniqueConstraint(fields=['payment_id', 'entry_type'], condition=models.Q(payment_id__isnull=False),
+                                    name='ledger_unique_payment_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['host', 'id'], name='ledger_host_idx'),
+        ]
+
+
+class HostBalance(models.Model):
+    host = models.ForeignKey(User, related_name='balances', on_delete=models.CASCADE)
+    currency = models.CharField(max_length=3)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def apply(cls, host_id, currency, amount):
+        """Add `amount` to the host's balance in `currency` (call with the ledger entry's transaction)"""
+        balances = cls.objects.filter(host_id=host_id, currency=currency)
+        if not balances.update(balance=F('balance') + amount, updated_at=timezone.now()):
+            cls.objects.get_or_create(host_id=host_id, currency=currency)
+            balances.update(balance=F('balance') + amount, updated_at=timezone.now())
+
+    def __str__(self):
+        return f"{self.balance} {self.currency} owed to host {self.host_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'currency'], name='host_balance_unique_currency'),
+        ]
+
+
+SETTLEMENT_STATUSES = (
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+)
+
+
+class PayoutSettlement(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    status = models.CharField(max_length=10, choices=SETTLEMENT_STATUSES, default='running')
+    # covers ledger entries with from_entry_id < id <= to_entry_id
+    from_entry_id = models.BigIntegerField()
+    to_entry_id = models.BigIntegerField()
+    # checkpoint of an interrupted run: last entry summed and the sums so far
+    progress_entry_id = models.BigIntegerField()
+    partial_sums = models.JSONField(default=dict)
+    # negative balances (refunds above earnings) carried into the next settlement
+    carried = models.JSONField(default=dict)
+    payout_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Settlement {self.id} ({self.status}) of ledger entries {self.from_entry_id}-{self.to_entry_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['status'], condition=models.Q(status='running'),
+                                    name='settlement_single_running'),
+        ]
+
+
+class HostPayout(models.Model):
+    settlement = models.ForeignKey(PayoutSettlement, related_name='payouts', on_delete=models.PROTECT)
+    host = models.ForeignKey(User, related_name='payouts', on_delete=models.PROTECT)
+    currency = models.CharField(max_length=3)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f"Payout of {self.amount} {self.currency} to host {self.host_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['settlement', 'host', 'currency'], name='payout_unique_host_currency'),
+        ]
+
+
+# Exchange rates
+# Note: Units of each currency per one unit of FX_BASE_CURRENCY. Used by listings.fx when
+# FX_RATES_FILE is not set; `manage.py load_fx_rates` fills it from a rates file.
+class FxRate(models.Model):
+    currency = models.CharField(max_length=3, primary_key=True)
+    rate = models.DecimalField(max_digits=20, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"1 base = {self.rate} {self.currency}"
+
+
+# Waitlist
+# Note: A guest waiting for dates of a listing that are taken. When a booking of the listing
+# is cancelled or expires, listings.waitlist finds the entries whose whole range is free again
+# and notifies them; entries stay until the guest removes them, so a later cancellation can
+# notify them again. Ranges span at most WAITLIST_MAX_NIGHTS, which bounds the index scan.
+class WaitlistEntry(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    listing = models.ForeignKey(Listing, related_name='waitlist', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='waitlist_entries', on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(blank=True, null=True)
+    notify_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} waiting for {self.listing_id} from {self.start_date} to {self.end_date}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'user', 'start_date', 'end_date'], name='waitlist_unique_request'),
+        ]
+        indexes = [
+            # entries of a listing overlapping freed dates: a start_date range scan (see listings.waitlist)
+            models.Index(fields=['listing', 'start_date', 'end_date'], name='waitlist_listing_dates_idx'),
+            models.Index(fields=['user', '-created_at'], name='waitlist_user_idx'),
+        ]
+
+
+# Note: One row per cancelled/expired booking whose dates were offered to the waitlist, so a
+# redelivered booking.cancelled/booking.expired event notifies nobody twice.
+class WaitlistRelease(models.Model):
+    booking_id = models.UUIDField(primary_key=True)
+    listing_id = models.UUIDField()
+    matched = models.PositiveIntegerField(default=0)
+    released_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Dates of booking {self.booking_id} offered to {self.matched} waiting guests"
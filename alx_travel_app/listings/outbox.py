@@ -0,0 +1,225 @@
+# Transactional outbox for booking and payment events
+# Views and tasks call record() inside the same transaction that changes a Booking or
+# Payment. relay() later drains unpublished events in id order, hands them to the
+# configured sink in batches, and marks them published. Delivery is at-least-once:
+# an event is only marked published after the sink accepted it. Every event carries its
+# outbox id, and consumers with side effects run them through consume_once(), so a
+# redelivered event is acted on once.
+#
+# An event that fails to publish OUTBOX_MAX_ATTEMPTS times is parked: the relay skips
+# it from then on, so it cannot hold up the events behind it. requeue_parked() puts
+# parked events back once the cause is fixed. purge() deletes published events (and
+# their consumption records) after OUTBOX_RETENTION_DAYS.
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent, ProcessedOutboxEvent
+
+logger = logging.getLogger('chapa_payment')
+
+
+def record(aggregate_type, aggregate_id, event_type, payload=None):
+    """
+    Add an event to the outbox. Must be called inside the transaction that
+    makes the change the event describes.
+    """
+    return OutboxEvent.objects.create(
+        aggregate_type=aggregate_type,
+        aggregate_id=str(aggregate_id),
+        event_type=event_type,
+        payload=payload or {},
+    )
+
+
+@contextmanager
+def consume_once(outbox_id, consumer):
+    """
+    Carry out `consumer`'s side effect of an outbox event at most once:
+
+        with outbox.consume_once(outbox_id, 'booking_confirmation') as first:
+            if first:
+                send_mail(...)
+
+    `first` is False when an earlier delivery of the event already did it. The record
+    is committed together with the block, so when the block raises, the next delivery
+    runs it again; a concurrent delivery waits for the block to finish. Without an
+    outbox id (a direct call) the block always runs.
+    """
+    if outbox_id is None:
+        yield True
+        return
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                ProcessedOutboxEvent.objects.create(outbox_id=outbox_id, consumer=consumer)
+        except IntegrityError:
+            first = False
+        else:
+            first = True
+        yield first
+
+
+class OutboxSink:
+    """
+    Base class for relay destinations. publish() is called once per event, in
+    order, inside a batch() context that can hold a shared connection.
+    """
+    @contextmanager
+    def batch(self):
+        yield
+
+    def publish(self, event):
+        raise NotImplementedError('.publish() must be overridden')
+
+
+class CelerySink(OutboxSink):
+    """
+    Publishes events as Celery tasks, reusing one producer connection per batch.
+    Handlers are called with the aggregate id and outbox_id=<event id>.
+    Events without a handler are acknowledged without publishing anything.
+    """
+    HANDLERS = {
+        # the guest is told once the booking is confirmed (paid for or accepted by the host)
+        'booking.confirmed': 'listings.tasks.send_booking_confirmation',
+        # freed dates are offered to the listing's waitlist
+        'booking.cancelled': 'listings.tasks.match_waitlist',
+        'booking.expired': 'listings.tasks.match_waitlist',
+    }
+
+    def __init__(self):
+        from alx_travel_app.celery import app
+        self.app = app
+        self._producer = None
+
+    @contextmanager
+    def batch(self):
+        with self.app.producer_or_acquire() as producer:
+            self._producer = producer
+            try:
+                yield
+            finally:
+                self._producer = None
+
+    def publish(self, event):
+        task_name = self.HANDLERS.get(event.event_type)
+        if task_name is not None:
+            self.app.send_task(
+                task_name,
+                args=[event.aggregate_id],
+                kwargs={'outbox_id': event.id},
+                task_id=f'outbox-{event.id}',
+                producer=self._producer,
+            )
+
+
+class LoggingSink(OutboxSink):
+    """Writes events to the log; useful locally and as a template for other sinks"""
+    def publish(self, event):
+        logger.info("Outbox event", extra={
+            'outbox_id': event.id,
+            'event_type': event.event_type,
+            'aggregate_id': event.aggregate_id,
+            'action': 'outbox_event'
+        })
+
+
+def get_sink():
+    return import_string(getattr(settings, 'OUTBOX_SINK', 'listings.outbox.CelerySink'))()
+
+
+def relay(batch_size=None, sink=None):
+    """
+    Publish one batch of unpublished events. Returns the number published.
+
+    Events of the same aggregate are published in id order; once one fails,
+    the aggregate's later events wait for the next run. An event failing for the
+    OUTBOX_MAX_ATTEMPTS-th time is parked.
+    """
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 500)
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 10)
+    sink = sink or get_sink()
+
+    # Rows are locked without skip_locked: a second relay waits instead of
+    # overtaking, which keeps per-aggregate ordering across processes
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update()
+            .filter(published_at__isnull=True, parked_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        published_ids = []
+        failed = {}
+        attempts = {event.id: event.attempts for event in events}
+        blocked = set()
+        with sink.batch():
+            for event in events:
+                aggregate = (event.aggregate_type, event.aggregate_id)
+                if aggregate in blocked:
+                    continue
+                try:
+                    sink.publish(event)
+                except Exception as e:
+                    blocked.add(aggregate)
+                    failed[event.id] = str(e)
+                    logger.error("Outbox event publish failed", extra={
+                        'outbox_id': event.id,
+                        'event_type': event.event_type,
+                        'error': str(e),
+                        'action': 'outbox_publish_failed'
+                    })
+                    continue
+                published_ids.append(event.id)
+
+        now = timezone.now()
+        if published_ids:
+            OutboxEvent.objects.filter(id__in=published_ids).update(published_at=now)
+        for event_id, error in failed.items():
+            parked = attempts[event_id] + 1 >= max_attempts
+            OutboxEvent.objects.filter(id=event_id).update(
+                attempts=F('attempts') + 1, last_error=error, parked_at=now if parked else None,
+            )
+            if parked:
+                logger.error("Outbox event parked after repeated publish failures", extra={
+                    'outbox_id': event_id,
+                    'attempts': attempts[event_id] + 1,
+                    'action': 'outbox_event_parked'
+                })
+
+    return len(published_ids)
+
+
+def requeue_parked(event_ids=None):
+    """Give parked events (all, or those in `event_ids`) a fresh set of attempts. Returns the count."""
+    parked = OutboxEvent.objects.filter(parked_at__isnull=False, published_at__isnull=True)
+    if event_ids is not None:
+        parked = parked.filter(id__in=event_ids)
+    return parked.update(parked_at=None, attempts=0)
+
+
+def purge(older_than=None, batch_size=10_000):
+    """
+    Delete events published before `older_than` (default: OUTBOX_RETENTION_DAYS ago) and
+    consumption records as old, in batches. Returns the number of events deleted.
+    """
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'OUTBOX_RETENTION_DAYS', 7))
+    deleted = 0
+    for model, field in ((OutboxEvent, 'published_at'), (ProcessedOutboxEvent, 'processed_at')):
+        while True:
+            ids = list(model.objects.filter(**{f'{field}__lt': older_than}).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            count = model.objects.filter(id__in=ids).delete()[0]
+            if model is OutboxEvent:
+                deleted += count
+    return deleted
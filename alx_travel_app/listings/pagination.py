@@ -0,0 +1,23 @@
+# Pagination classes for feeds that are read front to back
+from rest_framework.pagination import CursorPagination
+
+
+class ReviewCursorPagination(CursorPagination):
+    """
+    Newest-first review feed. The cursor seeks on (listing, created_at) via
+    review_listing_feed_idx instead of counting and skipping rows with OFFSET.
+    """
+    ordering = '-created_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class LedgerCursorPagination(CursorPagination):
+    """
+    Newest-first ledger statement, seeking on (host, id) via ledger_host_idx
+    """
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
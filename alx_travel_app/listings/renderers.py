@@ -0,0 +1,63 @@
+# Fast JSON rendering for API responses
+# orjson serializes dicts/lists/str/UUID/datetime natively in C; Decimal (and any other
+# type DRF's encoder knows) goes through a single default() hook. Falls back to DRF's
+# JSONRenderer when orjson is not installed. orjson is imported on the first render,
+# not at worker boot.
+import decimal
+import uuid
+from functools import cache
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+@cache
+def _orjson():
+    try:
+        import orjson
+    except ImportError:  # pragma: no cover - orjson is in requirements.txt
+        return None
+    return orjson
+
+
+_fallback_encoder = JSONEncoder()
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    return _fallback_encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same output through orjson
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        orjson = _orjson()
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        option = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+
+
+class ICalRenderer(BaseRenderer):
+    """
+    text/calendar for the listing availability feed; the view hands over the
+    already rendered body (listings.ical)
+    """
+    media_type = 'text/calendar'
+    format = 'ics'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        # errors (403/404) still need a body a calendar client can show
+        return str(data.get('detail', data) if isinstance(data, dict) else data).encode()
@@ -1,37 +1,193 @@
 # Serializers for Listing and Booking models
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Listing, Booking, Review, User, Payment
+from . import fx
+from .availability import is_available, lock_listings
+from .fieldsets import SparseFieldsetMixin
+from .loaders import BatchListSerializer, BatchLoadMixin
+from .models import Listing, Booking, Review, User, Payment, PaymentEvent, ListingRatingStats, ExternalCalendar, ArchivedBooking, HostLedgerEntry, HostBalance, WaitlistEntry
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(BatchLoadMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = User
+        list_serializer_class = BatchListSerializer
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'date_joined']
 
+class ListingListSerializer(BatchListSerializer):
+    # converts the prices of the whole page in one pass (listings.fx) before the rows render
+    def to_representation(self, data):
+        listings = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.convert_prices(listings)
+        return super().to_representation(listings)
+
+
 # Serializer for the Listing model
-class ListingSerializer(serializers.ModelSerializer):
+# display_price is price_per_night in the caller's ?currency= (default FX_BASE_CURRENCY)
+class ListingSerializer(BatchLoadMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     host = UserSerializer()
     host_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='host', write_only=True)
     reviews = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    currency = serializers.CharField(max_length=3, required=False)
+    display_price = serializers.SerializerMethodField()
+    display_currency = serializers.SerializerMethodField()
 
     class Meta:
         model = Listing
-        fields = ['host_id', 'host', 'title', 'listing_image', 'description', 'description_image', 'property_type', 'amenities', 'address', 'price_per_night', 'created_at', 'reviews']
+        fields = ['host_id', 'host', 'title', 'listing_image', 'description', 'description_image', 'property_type', 'amenities', 'address', 'price_per_night', 'currency', 'display_price', 'display_currency', 'created_at', 'reviews']
         read_only_fields = ['id', 'created_at', 'reviews']
+        list_serializer_class = ListingListSerializer
+        # columns read by SerializerMethodFields, for ?fields= projection and batch loading
+        field_dependencies = {
+            'display_price': ['price_per_night', 'currency'],
+            'display_currency': [],
+        }
+
+    def validate_currency(self, value):
+        value = value.strip().upper()
+        if value not in fx.get_rates():
+            raise serializers.ValidationError("No exchange rate is known for this currency.")
+        return value
+
+    def target_currency(self):
+        if not hasattr(self, '_target_currency'):
+            try:
+                self._target_currency = fx.requested_currency(self.context.get('request'))
+            except fx.UnknownCurrency:
+                raise serializers.ValidationError({'currency': "No exchange rate is known for this currency."})
+        return self._target_currency
+
+    def convert_prices(self, listings):
+        # called by ListingListSerializer with the page; single objects are converted on their own
+        if 'display_price' not in self.fields:
+            return
+        prices = fx.convert_prices([listing.price_per_night for listing in listings],
+                                   [listing.currency for listing in listings], self.target_currency())
+        self._converted = {listing.pk: price for listing, price in zip(listings, prices)}
+
+    def get_display_price(self, obj):
+        converted = getattr(self, '_converted', {})
+        if obj.pk in converted:
+            price = converted[obj.pk]
+        else:
+            price = fx.convert_prices([obj.price_per_night], [obj.currency], self.target_currency())[0]
+        return None if price is None else str(price)
+
+    def get_display_currency(self, obj):
+        return self.target_currency()
 
 #Serializer for the Booking model
-class BookingSerializer(serializers.ModelSerializer):
-    user = UserSerializer()
-    user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='user', write_only=True)
-    listing = ListingSerializer()
+class BookingSerializer(BatchLoadMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+    # the guest defaults to the requester; only staff and agency partners may name another
+    # user (BookingViewSet.perform_create). Neither can be changed once the booking exists.
+    user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='user', write_only=True,
+                                                 required=False)
+    listing = ListingSerializer(read_only=True)
     listing_id = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all(), source='listing', write_only=True)
     payment_status = serializers.CharField(source='payment.status', read_only=True, allow_null=True)
-    payment_id = serializers.UUIDField(source='payment.id', read_only=True, allow_null=True)
+    payment_id = serializers.UUIDField(source='payment.transaction_id', read_only=True, allow_null=True)
     
     class Meta:
         model = Booking
+        list_serializer_class = BatchListSerializer
         fields = ['id', 'listing_id', 'user_id', 'user', 'listing', 'start_date', 'end_date', 
-                  'payment_status', 'payment_id', 'total_price', 'created_at']
-        read_only_fields = ['id', 'user', 'total_price', 'created_at']
+                  'status', 'payment_status', 'payment_id', 'total_price', 'created_at']
+        read_only_fields = ['id', 'user', 'status', 'total_price', 'created_at']
+
+    def validate(self, attrs):
+        # New and moved dates go through the same availability check as search, so
+        # imported calendar blocks are honoured; the booking being moved doesn't block itself
+        instance = self.instance
+        if instance is not None:
+            moved = {
+                field: 'A booking cannot be moved to another user or listing.'
+                for field, source in (('user_id', 'user'), ('listing_id', 'listing')) if source in attrs
+            }
+            if moved:
+                raise serializers.ValidationError(moved)
+        listing = attrs.get('listing', getattr(instance, 'listing', None))
+        start_date = attrs.get('start_date', getattr(instance, 'start_date', None))
+        end_date = attrs.get('end_date', getattr(instance, 'end_date', None))
+        if listing is None or start_date is None or end_date is None:
+            return attrs
+        if start_date >= end_date:
+            raise serializers.ValidationError({'end_date': 'End date must be after start date.'})
+        if instance is not None and not instance.is_active:
+            raise serializers.ValidationError('Only pending or confirmed bookings can be changed.')
+        # the same listing lock as listings.bulk, held until the booking is written; callers
+        # validate inside the transaction that saves
+        lock_listings([listing.pk])
+        exclude = [instance.pk] if instance is not None else []
+        if not is_available(listing.pk, start_date, end_date, exclude_booking_ids=exclude):
+            raise serializers.ValidationError('The listing is not available for these dates.')
+        attrs['total_price'] = listing.price_per_night * (end_date - start_date).days
+        if instance is not None and attrs['total_price'] != instance.total_price and Payment.objects.filter(
+                booking=instance, status__in=Payment.SETTLED_STATUSES).exists():
+            raise serializers.ValidationError('A paid booking can only be moved to dates with the same price.')
+        return attrs
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            booking = super().update(instance, validated_data)
+            # an unpaid checkout is charged the new price
+            Payment.objects.filter(booking=booking, status='pending').update(
+                amount=booking.total_price, updated_at=timezone.now(),
+            )
+        return booking
+
+
+class ReviewSerializer(BatchLoadMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    listing_id = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all(), source='listing')
+    user = serializers.CharField(source='user.username', read_only=True)
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+
+    class Meta:
+        model = Review
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'listing_id', 'user', 'rating', 'comment', 'created_at']
+        read_only_fields = ['id', 'user', 'created_at']
+
+    def validate_listing_id(self, value):
+        if self.instance is not None and value.pk != self.instance.listing_id:
+            raise serializers.ValidationError("A review cannot be moved to another listing.")
+        return value
+
+    def validate(self, attrs):
+        request = self.context.get('request')
+        if self.instance is None and Review.objects.filter(listing=attrs['listing'], user=request.user).exists():
+            raise serializers.ValidationError("You have already reviewed this listing.")
+        return attrs
+
+
+class ArchivedBookingSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    """
+    Read-only view of an archived booking (see listings.archive)
+    """
+    listing_id = serializers.UUIDField(read_only=True)
+    listing_title = serializers.CharField(source='listing.title', read_only=True)
+    payment_status = serializers.CharField(source='payment.status', read_only=True, allow_null=True)
+    payment_id = serializers.UUIDField(source='payment.transaction_id', read_only=True, allow_null=True)
+
+    class Meta:
+        model = ArchivedBooking
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'listing_id', 'listing_title', 'start_date', 'end_date', 'status',
+                  'payment_status', 'payment_id', 'total_price', 'created_at', 'archived_at']
+        read_only_fields = fields
+
+
+class ListingRatingStatsSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    listing_id = serializers.UUIDField(read_only=True)
+    histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    average = serializers.FloatField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = ListingRatingStats
+        list_serializer_class = BatchListSerializer
+        fields = ['listing_id', 'review_count', 'average', 'histogram']
+        read_only_fields = fields
 
 
 class PaymentInitiationSerializer(serializers.Serializer):
@@ -58,7 +214,7 @@ class PaymentInitiationSerializer(serializers.Serializer):
         except Booking.DoesNotExist:
             raise serializers.ValidationError("Booking not found.")
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(BatchLoadMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for Payment model - Updated for UUID
     """
@@ -70,6 +226,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Payment
+        list_serializer_class = BatchListSerializer
         fields = [
             'transaction_id', 'booking_id', 'booking_reference', 'transaction_id', 
             'amount', 'currency', 'status', 'chapa_reference', 'payment_method',
@@ -80,8 +237,115 @@ class PaymentSerializer(serializers.ModelSerializer):
             'amount', 'currency', 'chapa_reference', 'payment_method',
             'listing_title', 'user_email', 'user_name', 'created_at', 'updated_at', 'paid_at'
         ]
+        # columns read by SerializerMethodFields, for ?fields= projection and batch loading
+        field_dependencies = {
+            'user_name': ['booking__user__first_name', 'booking__user__last_name', 'booking__user__email'],
+        }
     
     def get_user_name(self, obj):
         """Get user's full name"""
         user = obj.booking.user
-        return f"{user.first_name} {user.last_name}".strip() or user.email
\ No newline at end of file
+        return f"{user.first_name} {user.last_name}".strip() or user.email
+
+
+class PaymentEventSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    """
+    Serializer for the Chapa exchanges recorded against a payment
+    """
+    class Meta:
+        model = PaymentEvent
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'event_type', 'tx_ref', 'payload', 'created_at']
+        read_only_fields = fields
+
+
+class BulkBookingItemSerializer(serializers.Serializer):
+    """
+    One entry of a bulk booking request. Users and listings are only checked
+    for format here; listings.bulk resolves them for the whole batch at once.
+    """
+    user_id = serializers.UUIDField()
+    listing_id = serializers.UUIDField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['end_date'] <= attrs['start_date']:
+            raise serializers.ValidationError({'end_date': 'End date must be after start date.'})
+        return attrs
+
+
+class BulkRescheduleItemSerializer(serializers.Serializer):
+    """
+    One entry of a bulk reschedule request
+    """
+    booking_id = serializers.UUIDField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['end_date'] <= attrs['start_date']:
+            raise serializers.ValidationError({'end_date': 'End date must be after start date.'})
+        return attrs
+
+
+class ExternalCalendarSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    """
+    An iCal feed of another platform imported into a listing's availability
+    """
+    class Meta:
+        model = ExternalCalendar
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'name', 'url', 'last_synced_at', 'last_error', 'created_at']
+        read_only_fields = ['id', 'last_synced_at', 'last_error', 'created_at']
+        # unique per listing; the listing comes from the URL, so the view checks it
+        validators = []
+
+
+class HostLedgerEntrySerializer(BatchLoadMixin, serializers.ModelSerializer):
+    class Meta:
+        model = HostLedgerEntry
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'entry_type', 'amount', 'currency', 'payment_id', 'booking_id', 'settlement_id', 'created_at']
+        read_only_fields = fields
+
+
+class HostBalanceSerializer(BatchLoadMixin, serializers.ModelSerializer):
+    class Meta:
+        model = HostBalance
+        list_serializer_class = BatchListSerializer
+        fields = ['currency', 'balance', 'updated_at']
+        read_only_fields = fields
+
+
+class WaitlistEntrySerializer(BatchLoadMixin, serializers.ModelSerializer):
+    """
+    A guest's request to be told when taken dates of a listing free up
+    """
+    listing_id = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all(), source='listing')
+    listing_title = serializers.CharField(source='listing.title', read_only=True)
+
+    class Meta:
+        model = WaitlistEntry
+        list_serializer_class = BatchListSerializer
+        fields = ['id', 'listing_id', 'listing_title', 'start_date', 'end_date', 'created_at', 'notified_at', 'notify_count']
+        read_only_fields = ['id', 'listing_title', 'created_at', 'notified_at', 'notify_count']
+        # one entry per user and range; the user comes from the request, so validate() checks it
+        validators = []
+
+    def validate(self, attrs):
+        listing, start_date, end_date = attrs['listing'], attrs['start_date'], attrs['end_date']
+        if end_date <= start_date:
+            raise serializers.ValidationError({'end_date': 'End date must be after start date.'})
+        if start_date < timezone.localdate():
+            raise serializers.ValidationError({'start_date': 'Start date cannot be in the past.'})
+        if (end_date - start_date).days > settings.WAITLIST_MAX_NIGHTS:
+            raise serializers.ValidationError(
+                {'end_date': f'You can wait for at most {settings.WAITLIST_MAX_NIGHTS} nights.'}
+            )
+        user = self.context['request'].user
+        if WaitlistEntry.objects.filter(listing=listing, user=user, start_date=start_date, end_date=end_date).exists():
+            raise serializers.ValidationError("You are already waiting for these dates.")
+        if is_available(listing.pk, start_date, end_date):
+            raise serializers.ValidationError("These dates are available; book them instead.")
+        return attrs
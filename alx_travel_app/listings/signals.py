@@ -0,0 +1,63 @@
+# Model signal receivers for the listings app, connected in ListingsConfig.ready()
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from . import autocomplete
+from .models import Listing, Booking, Review, Payment, ListingRatingStats
+
+
+def touch_listing_on_review(sender, instance, **kwargs):
+    # A listing's representation includes its review ids, so a review change is a listing change
+    Listing.objects.filter(pk=instance.listing_id).update(updated_at=timezone.now())
+
+
+def update_rating_stats_on_review_save(sender, instance, created, **kwargs):
+    # Adjust the listing histogram by the difference between the stored and the new rating
+    if created:
+        ListingRatingStats.record_change(instance.listing_id, added=instance.rating)
+    else:
+        listing_id, rating = getattr(instance, '_stored_rating', (None, None))
+        if rating is None:
+            # loaded without its rating (e.g. deferred), so there is nothing to diff against;
+            # `manage.py rebuild_rating_stats` repairs the histogram
+            pass
+        elif listing_id == instance.listing_id:
+            ListingRatingStats.record_change(listing_id, added=instance.rating, removed=rating)
+        else:
+            ListingRatingStats.record_change(listing_id, removed=rating)
+            ListingRatingStats.record_change(instance.listing_id, added=instance.rating)
+    instance._stored_rating = (instance.listing_id, instance.rating)
+
+
+def update_rating_stats_on_review_delete(sender, instance, **kwargs):
+    listing_id, rating = getattr(instance, '_stored_rating', (None, None))
+    if rating is None:
+        listing_id, rating = instance.listing_id, instance.__dict__.get('rating')
+    ListingRatingStats.record_change(listing_id, removed=rating)
+
+
+def touch_booking_on_payment(sender, instance, **kwargs):
+    # A booking's representation includes its payment status
+    Booking.objects.filter(pk=instance.booking_id).update(updated_at=timezone.now())
+
+
+def update_autocomplete_on_listing_save(sender, instance, **kwargs):
+    # Patch this process's autocomplete index once the new title/address is committed
+    listing_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.listing_saved(listing_id))
+
+
+def update_autocomplete_on_listing_delete(sender, instance, **kwargs):
+    listing_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.listing_deleted(listing_id))
+
+
+def connect_signals():
+    post_save.connect(touch_listing_on_review, sender=Review, dispatch_uid='touch_listing_review_save')
+    post_delete.connect(touch_listing_on_review, sender=Review, dispatch_uid='touch_listing_review_delete')
+    post_save.connect(update_rating_stats_on_review_save, sender=Review, dispatch_uid='rating_stats_review_save')
+    post_delete.connect(update_rating_stats_on_review_delete, sender=Review, dispatch_uid='rating_stats_review_delete')
+    post_save.connect(touch_booking_on_payment, sender=Payment, dispatch_uid='touch_booking_payment_save')
+    post_save.connect(update_autocomplete_on_listing_save, sender=Listing, dispatch_uid='autocomplete_listing_save')
+    post_delete.connect(update_autocomplete_on_listing_delete, sender=Listing, dispatch_uid='autocomplete_listing_delete')
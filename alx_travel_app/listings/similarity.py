@@ -0,0 +1,171 @@
+# Similar-listing recommendations, precomputed in batch
+# Each listing becomes a weighted feature vector:
+#   property_type   one-hot                       x TYPE_WEIGHT
+#   amenities       multi-hot over AMENITIES       x AMENITY_WEIGHT
+#   price_per_night log price scaled to [0, 1]     x PRICE_WEIGHT (in FX_BASE_CURRENCY;
+#                   listings in a currency without a rate sit mid-scale)
+#   rating          average stars scaled to [0, 1] x RATING_WEIGHT (unrated listings sit mid-scale)
+# Neighbours are the listings at the smallest Euclidean distance (exact search, pruned
+# by the categorical part of the distance; see nearest_neighbours).
+# rebuild() stores the top K per listing in ListingNeighbours; the API only reads that row.
+# NumPy is imported here only, so web and worker boot never pay for it.
+import time
+
+import numpy as np
+from alx_travel_app.db_routing import replica_reads, routing_scope
+from django.conf import settings
+from django.db import transaction
+
+from . import fx
+from .models import AMENITIES, PROPERTY_TYPES, Listing, ListingNeighbours
+
+TYPE_WEIGHT = 1.0
+AMENITY_WEIGHT = 0.5
+PRICE_WEIGHT = 1.5
+RATING_WEIGHT = 1.0
+
+# Upper bound on the number of pairwise distances held in memory at once
+BLOCK_CELLS = 16_000_000
+
+_TYPE_INDEX = {key: index for index, (key, _) in enumerate(PROPERTY_TYPES)}
+_AMENITY_INDEX = {}
+for _index, (_key, _label) in enumerate(AMENITIES):
+    _AMENITY_INDEX[_key] = _index
+    _AMENITY_INDEX[_label.lower()] = _index
+
+
+def build_features(property_types, amenities, prices, ratings):
+    """
+    Feature matrix (float32, one row per listing) from parallel sequences.
+    `prices` are in one currency (None where unknown), `ratings` average stars
+    or None for unrated listings.
+    """
+    count = len(prices)
+    type_columns = len(PROPERTY_TYPES)
+    amenity_columns = len(AMENITIES)
+    features = np.zeros((count, type_columns + amenity_columns + 2), dtype=np.float32)
+
+    type_index = np.fromiter((_TYPE_INDEX.get(value, -1) for value in property_types), dtype=np.int64, count=count)
+    known = type_index >= 0
+    features[np.nonzero(known)[0], type_index[known]] = TYPE_WEIGHT
+
+    for row, values in enumerate(amenities):
+        for value in values or ():
+            column = _AMENITY_INDEX.get(str(value).lower())
+            if column is not None:
+                features[row, type_columns + column] = AMENITY_WEIGHT
+
+    log_prices = np.log1p(np.array([np.nan if price is None else price for price in prices], dtype=np.float64))
+    priced = ~np.isnan(log_prices)
+    scaled = np.full(count, 0.5)
+    if priced.any():
+        low, high = log_prices[priced].min(), log_prices[priced].max()
+        scaled[priced] = (log_prices[priced] - low) / (high - low) if high > low else 0.0
+    features[:, -2] = scaled * PRICE_WEIGHT
+
+    stars = np.array([rating if rating is not None else 3.0 for rating in ratings], dtype=np.float64)
+    features[:, -1] = (stars - 1.0) / 4.0 * RATING_WEIGHT
+    return features
+
+
+def nearest_neighbours(features, k):
+    """
+    (indices, distances), each of shape (n, min(k, n - 1)), nearest first,
+    excluding each row itself. Exact.
+
+    The categorical columns (type and amenities) take few distinct values, so
+    listings are bucketed by them. For each bucket the other buckets are visited
+    in order of their (exact) categorical distance, and the search stops once that
+    alone exceeds every member's current k-th best distance. Price and rating are
+    only compared within the visited buckets.
+    """
+    count = features.shape[0]
+    k = min(k, count - 1)
+    if k <= 0:
+        return np.empty((count, 0), dtype=np.int64), np.empty((count, 0), dtype=np.float32)
+
+    categorical = features[:, :-2].astype(np.float64)
+    continuous = features[:, -2:].astype(np.float64)
+    buckets, bucket_of = np.unique(categorical, axis=0, return_inverse=True)
+    bucket_of = bucket_of.ravel()
+    by_bucket = np.argsort(bucket_of, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(bucket_of, minlength=len(buckets)))))
+    members = [by_bucket[bounds[b]:bounds[b + 1]] for b in range(len(buckets))]
+    bucket_squared = np.einsum('ij,ij->i', buckets, buckets)
+    # rows compared at once, so one distance block stays under BLOCK_CELLS
+    chunk = max(1, BLOCK_CELLS // (2 * max(len(rows) for rows in members)))
+
+    indices = np.empty((count, k), dtype=np.int64)
+    distances = np.empty((count, k), dtype=np.float32)
+    for bucket, rows in enumerate(members):
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, exact for these small multiples of the weights
+        base = np.maximum(bucket_squared + bucket_squared[bucket] - 2.0 * (buckets @ buckets[bucket]), 0.0)
+        visit = np.argsort(base, kind='stable')
+
+        for start in range(0, len(rows), chunk):
+            chunk_rows = rows[start:start + chunk]
+            best_d2 = np.full((len(chunk_rows), k), np.inf)
+            best_index = np.full((len(chunk_rows), k), -1, dtype=np.int64)
+            for other in visit:
+                if base[other] >= best_d2.max():
+                    break
+                columns = members[other]
+                d2 = base[other] + ((continuous[chunk_rows, None, :] - continuous[None, columns, :]) ** 2).sum(axis=2)
+                if other == bucket:
+                    d2[chunk_rows[:, None] == columns[None, :]] = np.inf
+                merged_d2 = np.concatenate((best_d2, d2), axis=1)
+                merged_index = np.concatenate((best_index, np.broadcast_to(columns, d2.shape)), axis=1)
+                keep = np.argpartition(merged_d2, k - 1, axis=1)[:, :k]
+                best_d2 = np.take_along_axis(merged_d2, keep, axis=1)
+                best_index = np.take_along_axis(merged_index, keep, axis=1)
+
+            order = np.argsort(best_d2, axis=1, kind='stable')
+            indices[chunk_rows] = np.take_along_axis(best_index, order, axis=1)
+            distances[chunk_rows] = np.sqrt(np.take_along_axis(best_d2, order, axis=1))
+    return indices, distances
+
+
+def _score(distance):
+    return round(1.0 / (1.0 + float(distance)), 4)
+
+
+def rebuild(k=10, batch_size=2000):
+    """Recompute and store the top-k similar listings of every listing. Returns timings."""
+    timings = {}
+    started = time.perf_counter()
+    # the full-catalogue scan is the heaviest read of the job: a replica serves it when one is healthy
+    with routing_scope(), replica_reads():
+        rows = list(
+            Listing.objects.order_by()
+            .values_list('id', 'property_type', 'amenities', 'price_per_night', 'currency',
+                         'rating_stats__rating_sum', 'rating_stats__review_count')
+            .iterator(chunk_size=batch_size)
+        )
+    ids = [row[0] for row in rows]
+    ratings = [row[5] / row[6] if row[6] else None for row in rows]
+    # prices are compared in one currency, or a listing priced in ETB looks ~50x dearer than one in USD
+    prices = fx.convert_prices([row[3] for row in rows], [row[4] for row in rows], settings.FX_BASE_CURRENCY)
+    timings['load'] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    features = build_features([row[1] for row in rows], [row[2] for row in rows], prices, ratings)
+    del rows
+    indices, distances = nearest_neighbours(features, k)
+    timings['compute'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    with transaction.atomic():
+        ListingNeighbours.objects.all().delete()
+        for start in range(0, len(ids), batch_size):
+            ListingNeighbours.objects.bulk_create([
+                ListingNeighbours(
+                    listing_id=ids[row],
+                    neighbours=[[str(ids[column]), _score(distance)]
+                                for column, distance in zip(indices[row], distances[row])],
+                )
+                for row in range(start, min(start + batch_size, len(ids)))
+            ])
+    timings['store'] = time.perf_counter() - mark
+    timings['listings'] = len(ids)
+    return timings
+
@@ -1,17 +1,22 @@
-from celery import shared_task
-from django.core.mail import send_mail
+from celery import group, shared_task
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
 import logging
-from .models import Booking
+from .models import Booking, OutboxEvent, Payment
+from . import ledger, outbox, waitlist
 
 # Get logger for payments
 logger = logging.getLogger('chapa_payment')
 
-@shared_task
-def send_booking_confirmation(booking_id):
+@shared_task(bind=True, max_retries=5)
+def send_booking_confirmation(self, booking_id, outbox_id=None):
     """
-    Send booking confirmation email
+    Send booking confirmation email. Takes the booking id only; everything else is loaded here.
+    Sent once per booking.confirmed outbox event (`outbox_id`), however often it is delivered;
+    a failed send is retried, since the relay has already handed the event over.
     """
     logger.info("📧 Starting booking confirmation email task", extra={
         'booking_id': booking_id,
@@ -19,44 +24,45 @@ def send_booking_confirmation(booking_id):
     })
     
     try:
-        booking = Booking.objects.get(id=booking_id)
+        booking = Booking.objects.select_related('user', 'listing').get(id=booking_id)
         user = booking.user
-        property = booking.property
-        
-        subject = f'Booking Confirmation - {booking.reference}'
+        listing = booking.listing
         
-        html_message = render_to_string('emails/booking_confirmation.html', {
-            'user': user,
-            'booking': booking,
-            'property': property,
-        })
+        subject = f'Booking Confirmation - {booking.id}'
         
         plain_message = f"""
         Dear {user.get_full_name() or 'Customer'},
         
         Your booking has been confirmed!
         
-        Booking Reference: {booking.reference}
-        Property: {property.title}
-        Check-in: {booking.check_in}
-        Check-out: {booking.check_out}
+        Booking Reference: {booking.id}
+        Property: {listing.title}
+        Check-in: {booking.start_date}
+        Check-out: {booking.end_date}
         Total Amount: {booking.total_price}
         
         Thank you for choosing us!
         """
         
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
+        with outbox.consume_once(outbox_id, 'booking_confirmation') as first:
+            if not first:
+                logger.info("Booking confirmation already sent for this event", extra={
+                    'booking_id': booking_id,
+                    'outbox_id': outbox_id,
+                    'action': 'email_already_sent'
+                })
+                return f"Confirmation email already sent to {user.email}"
+            send_mail(
+                subject=subject,
+                message=plain_message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=[user.email],
+                fail_silently=False,
+            )
         
         logger.info("✅ Booking confirmation email sent successfully", extra={
             'booking_id': booking_id,
-            'booking_reference': booking.reference,
+            'booking_reference': str(booking.id),
             'recipient': user.email,
             'action': 'email_sent_success'
         })
@@ -74,6 +80,302 @@ def send_booking_confirmation(booking_id):
         logger.error("💥 Failed to send booking confirmation email", extra={
             'booking_id': booking_id,
             'error': str(e),
+            'retry_count': self.request.retries,
             'action': 'email_send_failed'
         })
-        return f"Failed to send email: {str(e)}"
+        # nothing was recorded for this event (consume_once rolled back), so the retry sends it
+        raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
+
+
+@shared_task
+def expire_pending_bookings():
+    """
+    Cancel unpaid pending bookings older than BOOKING_PENDING_TTL_MINUTES so their dates are released
+    """
+    cutoff = timezone.now() - timedelta(minutes=settings.BOOKING_PENDING_TTL_MINUTES)
+    expired = Booking.objects.expire_pending(cutoff)
+
+    logger.info("Expired pending bookings", extra={
+        'expired_count': expired,
+        'cutoff': cutoff.isoformat(),
+        'action': 'bookings_expired'
+    })
+    return expired
+
+
+@shared_task
+def complete_ended_bookings():
+    """
+    Complete confirmed bookings whose stay has ended, so archive_bookings picks them up
+    """
+    completed = Booking.objects.complete_ended(timezone.localdate())
+
+    logger.info("Completed ended bookings", extra={
+        'completed_count': completed,
+        'action': 'bookings_completed'
+    })
+    return completed
+
+
+@shared_task(bind=True, max_retries=5)
+def verify_payment(self, transaction_id, tx_ref=None):
+    """
+    Verify a payment's Chapa checkout `tx_ref` (default: the current one) and apply
+    the result to the Payment and its Booking. Safe to run more than once for the same
+    payment (duplicate webhooks, retries): a result is applied once.
+    """
+    from .chapa_service import get_chapa_service
+
+    try:
+        payment = Payment.objects.only('transaction_id', 'status', 'chapa_reference').get(transaction_id=transaction_id)
+    except Payment.DoesNotExist:
+        logger.error("Payment not found for verification", extra={
+            'transaction_id': transaction_id,
+            'action': 'payment_not_found_verification'
+        })
+        return None
+    if payment.status in Payment.SETTLED_STATUSES:
+        # already applied by an earlier delivery; no need to ask Chapa again
+        return payment.status
+
+    tx_ref = tx_ref or payment.chapa_reference
+    chapa = get_chapa_service()
+    verification_result = chapa.verify_payment(tx_ref)
+
+    if verification_result.get('busy'):
+        # Chapa is saturated or throttling us; try again once it has had a breather
+        raise self.retry(countdown=verification_result['retry_after'])
+
+    if not verification_result['success']:
+        logger.error("Payment verification failed", extra={
+            'transaction_id': transaction_id,
+            'error': verification_result.get('message'),
+            'action': 'verification_failed_webhook'
+        })
+        return None
+
+    chapa_status = verification_result['status']
+    response_data = verification_result.get('response_data')
+
+    with transaction.atomic():
+        # The row lock serialises concurrent verifications of this payment (the Chapa call
+        # above is made without it); whichever gets it second sees the result applied
+        payment = (
+            Payment.objects.select_for_update(of=('self',)).select_related('booking__listing')
+            .get(transaction_id=transaction_id)
+        )
+        if payment.status in Payment.SETTLED_STATUSES:
+            return payment.status
+
+        if chapa_status == 'success' and payment.booking.status == 'cancelled':
+            # The checkout completed after the booking expired or was cancelled, so its dates
+            # may already be someone else's: flag the payment for a refund instead of
+            # confirming the booking or crediting the host
+            payment.status = 'refund_due'
+            payment.paid_at = timezone.now()
+            payment.save()
+            payment.record_event('verification', response_data, tx_ref=tx_ref)
+            outbox.record('payment', payment.transaction_id, 'payment.refund_due', {
+                'transaction_id': str(payment.transaction_id),
+                'booking_id': str(payment.booking.id),
+            })
+            logger.error("Payment completed for a cancelled booking, refund due", extra={
+                'transaction_id': transaction_id,
+                'booking_id': str(payment.booking.id),
+                'action': 'payment_refund_due'
+            })
+
+        elif chapa_status == 'success':
+            payment.status = 'completed'
+            payment.paid_at = timezone.now()
+            payment.save()
+            if payment.booking.status == 'pending':
+                payment.booking.confirm()
+            ledger.credit_booking(payment.booking)
+            payment.record_event('verification', response_data, tx_ref=tx_ref)
+            outbox.record('payment', payment.transaction_id, 'payment.completed', {
+                'transaction_id': str(payment.transaction_id),
+                'booking_id': str(payment.booking.id),
+            })
+            logger.info("Payment completed via webhook", extra={
+                'transaction_id': transaction_id,
+                'booking_id': str(payment.booking.id),
+                'action': 'payment_completed_webhook'
+            })
+
+        elif chapa_status in ['failed', 'cancelled']:
+            # a failed checkout that a retry has replaced leaves the current one pending,
+            # and a repeated failure of the current one is only applied once
+            if tx_ref == payment.chapa_reference and payment.status != 'failed':
+                payment.status = 'failed'
+                payment.save()
+                payment.record_event('verification', response_data, tx_ref=tx_ref)
+                outbox.record('payment', payment.transaction_id, 'payment.failed', {
+                    'transaction_id': str(payment.transaction_id),
+                    'booking_id': str(payment.booking.id),
+                })
+            elif tx_ref != payment.chapa_reference:
+                payment.record_event('verification', response_data, tx_ref=tx_ref)
+            logger.warning("Payment failed via webhook", extra={
+                'transaction_id': transaction_id,
+                'status': chapa_status,
+                'action': 'payment_failed_webhook'
+            })
+
+    return payment.status
+
+
+@shared_task
+def purge_outbox():
+    """
+    Delete outbox events published more than OUTBOX_RETENTION_DAYS ago
+    """
+    deleted = outbox.purge()
+    parked = OutboxEvent.objects.filter(parked_at__isnull=False, published_at__isnull=True).count()
+    logger.info("Purged published outbox events", extra={
+        'deleted': deleted,
+        'parked': parked,
+        'action': 'outbox_purged'
+    })
+    return deleted
+
+
+@shared_task(name='listings.analytics.rebuild_similar_listings', time_limit=1800, soft_time_limit=1700)
+def rebuild_similar_listings(k=None):
+    """
+    Recompute the top-K similar listings of every listing (routed to the analytics queue)
+    """
+    from .similarity import rebuild
+
+    timings = rebuild(k=k or settings.SIMILAR_LISTINGS_K)
+    logger.info("Rebuilt similar listings", extra={
+        'listings': timings['listings'],
+        'load_seconds': round(timings['load'], 2),
+        'compute_seconds': round(timings['compute'], 2),
+        'store_seconds': round(timings['store'], 2),
+        'action': 'similar_listings_rebuilt'
+    })
+    return timings['listings']
+
+
+@shared_task
+def sync_external_calendar(calendar_id):
+    """
+    Fetch one external iCal feed and update its listing's blocked dates
+    """
+    from .ical import CalendarImportError, fetch_and_sync
+    from .models import ExternalCalendar
+    import requests
+
+    calendar = ExternalCalendar.objects.filter(id=calendar_id).exclude(url='').first()
+    if calendar is None:
+        return None
+    try:
+        counts = fetch_and_sync(calendar)
+    except (requests.RequestException, CalendarImportError):
+        # already recorded on the calendar and logged; the next scheduled run retries
+        return None
+
+    logger.info("Synced external calendar", extra={
+        'calendar_id': str(calendar.id),
+        'listing_id': str(calendar.listing_id),
+        'counts': counts,
+        'action': 'ical_synced' if counts is not None else 'ical_not_modified'
+    })
+    return counts
+
+
+@shared_task
+def sync_external_calendars():
+    """
+    Queue a sync of every external calendar that has a feed URL
+    """
+    from .models import ExternalCalendar
+
+    calendar_ids = list(ExternalCalendar.objects.exclude(url='').values_list('id', flat=True))
+    for calendar_id in calendar_ids:
+        sync_external_calendar.delay(str(calendar_id))
+    return len(calendar_ids)
+
+
+@shared_task(name='listings.analytics.settle_host_payouts', time_limit=3600, soft_time_limit=3500)
+def settle_host_payouts():
+    """
+    Compute the payouts owed to every host since the last settlement (resumes an interrupted one)
+    """
+    settlement = ledger.settle()
+    if settlement is None:
+        return None
+    logger.info("Settled host payouts", extra={
+        'settlement_id': settlement.id,
+        'to_entry_id': settlement.to_entry_id,
+        'payouts': settlement.payout_count,
+        'action': 'host_payouts_settled'
+    })
+    return settlement.id
+
+
+@shared_task
+def match_waitlist(booking_id, outbox_id=None):
+    """
+    Offer the dates of a cancelled or expired booking to its listing's waitlist
+    (run for booking.cancelled / booking.expired outbox events; release() itself
+    runs once per booking, so redeliveries need no outbox_id check)
+    """
+    entry_ids = waitlist.release(booking_id)
+    if entry_ids:
+        batch = settings.WAITLIST_NOTIFY_BATCH
+        # one publish for every batch of notifications
+        group(
+            notify_waitlist.s([str(entry_id) for entry_id in entry_ids[start:start + batch]])
+            for start in range(0, len(entry_ids), batch)
+        ).apply_async()
+
+    logger.info("Matched waitlist against released dates", extra={
+        'booking_id': booking_id,
+        'matched': len(entry_ids),
+        'action': 'waitlist_matched'
+    })
+    return len(entry_ids)
+
+
+@shared_task(bind=True, max_retries=3)
+def notify_waitlist(self, entry_ids):
+    """
+    Email a batch of waitlisted guests that their dates are free, over one mail connection
+    """
+    from .models import WaitlistEntry
+
+    entries = WaitlistEntry.objects.filter(id__in=entry_ids).select_related('user', 'listing')
+    messages = [
+        EmailMessage(
+            subject=f'Your dates at {entry.listing.title} are available',
+            body=(
+                f"Dear {entry.user.get_full_name() or 'Customer'},\n\n"
+                f"{entry.listing.title} is now free from {entry.start_date} to {entry.end_date}, "
+                f"the dates you were waiting for. Book soon: other guests have been told too.\n"
+            ),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[entry.user.email],
+        )
+        for entry in entries
+    ]
+    if not messages:
+        return 0
+    try:
+        with get_connection() as connection:
+            sent = connection.send_messages(messages)
+    except Exception as e:
+        logger.error("Failed to send waitlist notifications", extra={
+            'entries': len(messages),
+            'error': str(e),
+            'action': 'waitlist_notify_failed'
+        })
+        raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
+
+    logger.info("Sent waitlist notifications", extra={
+        'entries': len(messages),
+        'sent': sent,
+        'action': 'waitlist_notified'
+    })
+    return sent
@@ -1,3 +1,1186 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Avg
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from alx_travel_app import db_routing
+from alx_travel_app.log_pipeline import BackgroundQueueHandler, JSONFormatter
+
+from . import archive, autocomplete, fx, ical, ledger, outbox, similarity, waitlist
+from .authentication import CachedModelBackend, CachedTokenAuthentication, auth_cache
+from .availability import is_available, lock_listings
+from .bulk import bulk_reschedule_bookings
+from .chapa_limiter import PAUSE_KEY, PRIORITY_CHECKOUT, PRIORITY_RETRY, PRIORITY_VERIFY, ChapaLimiter
+from .chapa_service import ChapaService
+from .fake_chapa import FakeChapa
+from .management.commands.profile_startup import BOOT_SCRIPT
+from .models import (
+    ArchivedBooking, ArchivedPayment, ArchivedPaymentEvent, Booking, CalendarBlock, ExternalCalendar, FxRate,
+    HostBalance, HostLedgerEntry, HostPayout, Listing, ListingNeighbours, ListingRatingStats, OutboxEvent, Payment,
+    PaymentEvent, ProcessedOutboxEvent, Review, User, WaitlistEntry, WaitlistRelease,
+)
+from .serializers import BookingSerializer, PaymentSerializer
+from .tasks import complete_ended_bookings, send_booking_confirmation
+from .throttling import cache_store, local_store
+
+REPLICA = 'replica_test'
+
+ICAL_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'ical')
+
+# Kept out of worker boot; each is imported on the first request that needs it
+LAZY_MODULES = ('numpy', 'orjson', 'drf_yasg')
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Routing between two SQLite databases: the test database as the primary and a
+    temporary file as the replica. Rows are created in one or the other only, so a
+    response shows which database served it.
+    """
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        # the replica is registered here rather than in settings, so the runner never creates
+        # it; from then on the test case wraps it in a rolled-back transaction like the primary
+        cls._replica_dir = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls._replica_dir.name, 'replica.sqlite3')}
+        connections.settings[REPLICA] = connections.configure_settings(
+            {'default': connections.settings['default'], REPLICA: replica}
+        )[REPLICA]
+        # the replica gets the schema only: the router never migrates it
+        with connections[REPLICA].schema_editor() as editor:
+            for model in apps.get_models():
+                if model._meta.managed and not model._meta.proxy:
+                    editor.create_model(model)
+        cls.databases = {'default', REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        db_routing._lag_cache.clear()
+        cls._replica_dir.cleanup()
+
+    def setUp(self):
+        db_routing._lag_cache.clear()
+        self.host = User.objects.create(username='host', email='host@example.com')
+        User.objects.using(REPLICA).create(id=self.host.id, username='host', email='host@example.com')
+        Listing.objects.create(host=self.host, title='On the primary', description='-', address='-', price_per_night=10)
+        Listing.objects.using(REPLICA).create(
+            host_id=self.host.id, title='On the replica', description='-', address='-', price_per_night=10,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def titles(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [listing['title'] for listing in response.data['results']]
+
+    def test_opted_in_actions_read_from_the_replica(self):
+        self.assertEqual(self.titles(self.client.get('/api/listings/')), ['On the replica'])
+
+    def test_host_reports_read_from_the_replica(self):
+        HostBalance.objects.using(REPLICA).create(host_id=self.host.id, currency='ETB', balance=5)
+        response = self.client.get('/api/ledger/balance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['currency'] for row in response.data['results']], ['ETB'])
+
+    def test_other_reads_stay_on_the_primary(self):
+        response = self.client.get('/api/waitlist/')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            self.client.get('/api/bookings/')
+        self.assertEqual(len(replica_queries), 0)
+
+    def test_client_that_wrote_reads_its_writes_from_the_primary(self):
+        # any unsafe request sets the pin cookie, whether or not it succeeds
+        response = self.client.post('/api/waitlist/', {}, format='json')
+        self.assertIn(db_routing.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.titles(self.client.get('/api/listings/')), ['On the primary'])
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=-1)
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.assertEqual(self.titles(self.client.get('/api/listings/')), ['On the primary'])
+
+    def test_request_picks_its_replica_once(self):
+        with mock.patch.object(db_routing, 'choose_replica', wraps=db_routing.choose_replica) as choose, \
+                CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            self.titles(self.client.get('/api/listings/'))
+        self.assertGreater(len(replica_queries), 1)
+        self.assertEqual(choose.call_count, 1)
+
+
+class WorkerBootTests(SimpleTestCase):
+    def test_worker_boot_leaves_heavy_modules_unimported(self):
+        # a fresh interpreter doing what a production worker does before its first request
+        script = BOOT_SCRIPT + f'; import sys; print(*[m for m in {LAZY_MODULES!r} if m in sys.modules])'
+        env = dict(os.environ, API_DOCS_ENABLED='False')
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'alx_travel_app.settings')
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), [])
+
+
+class SchemaGenerationTests(SimpleTestCase):
+    def test_schema_covers_every_view_without_errors(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(OPENAPI_SCHEMA_PATH=os.path.join(directory, 'openapi.json')):
+            # raises CommandError when a view fails during generation
+            call_command('generate_schema', force=True, stdout=StringIO())
+            with open(os.path.join(directory, 'openapi.json')) as schema:
+                paths = json.load(schema)['paths']
+        self.assertIn('/listings/', paths)
+        self.assertIn('/bookings/', paths)
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.listings = [
+            Listing.objects.create(host=self.host, title=title, description='-', address='-', price_per_night=10)
+            for title in ('First', 'Second')
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def test_list_is_validated_by_etag_only(self):
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/listings/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # a deletion leaves max(updated_at) unchanged but must still invalidate the list
+        self.listings[0].delete()
+        response = self.client.get('/api/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_nested_users_are_part_of_the_version(self):
+        guest = User.objects.create(username='guest', email='guest@example.com')
+        Booking.objects.create(listing=self.listings[0], user=guest, start_date=date(2030, 1, 1),
+                               end_date=date(2030, 1, 3), total_price=20)
+        self.client.force_authenticate(guest)
+        urls = ['/api/listings/', f'/api/listings/{self.listings[0].pk}/', '/api/bookings/']
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        # the host renders inside every listing and booking, and is renamed with a bulk update
+        User.objects.filter(pk=self.host.pk).update(first_name='Renamed')
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertIn('Renamed', json.dumps(response.data))
+
+    def test_retrieve_sends_last_modified(self):
+        response = self.client.get(f'/api/listings/{self.listings[0].pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+
+class ChapaLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.delete(PAUSE_KEY)
+        self.addCleanup(cache.delete, PAUSE_KEY)
+
+    def wait_for_queue(self, limiter, depth):
+        deadline = time.monotonic() + 5
+        while limiter.snapshot()['queue_depth'] < depth:
+            self.assertLess(time.monotonic(), deadline, 'callers never queued')
+            time.sleep(0.005)
+
+    def test_queued_calls_are_served_by_priority_then_arrival(self):
+        limiter = ChapaLimiter(max_in_flight=1, max_queue=10, queue_timeout=5)
+        served = []
+
+        def call(name, priority):
+            with limiter.slot(priority):
+                served.append(name)
+
+        limiter.acquire()
+        callers = []
+        # enqueued lowest priority first, so the order served is the queue's doing
+        for name, priority in (('retry', PRIORITY_RETRY), ('verify', PRIORITY_VERIFY),
+                               ('checkout 1', PRIORITY_CHECKOUT), ('checkout 2', PRIORITY_CHECKOUT)):
+            caller = threading.Thread(target=call, args=(name, priority))
+            caller.start()
+            callers.append(caller)
+            self.wait_for_queue(limiter, len(callers))
+        limiter.release()
+        for caller in callers:
+            caller.join(5)
+
+        self.assertEqual(served, ['checkout 1', 'checkout 2', 'verify', 'retry'])
+        self.assertEqual(limiter.snapshot()['queue_depth_max'], 4)
+
+    def service(self, fake):
+        with override_settings(CHAPA_BASE_URL=fake.base_url, CHAPA_SECRET_KEY='CHASECK_TEST-limiter',
+                               CHAPA_MAX_IN_FLIGHT=2, CHAPA_QUEUE_TIMEOUT=5, CHAPA_THROTTLE_BACKOFF=0.05):
+            return ChapaService()
+
+    def initiate(self, service, tx_ref):
+        return service.initiate_payment(
+            amount=100, email='guest@example.com', first_name='Guest', last_name='User',
+            tx_ref=tx_ref, return_url='http://localhost/payment-success/',
+        )
+
+    def test_429_pauses_every_process_for_retry_after(self):
+        with FakeChapa(latency=0.01, jitter=0, capacity=0, retry_after=1) as fake:
+            # two services stand in for two worker processes sharing the cache
+            first, second = self.service(fake), self.service(fake)
+            result = self.initiate(first, 'tx-throttled')
+            self.assertTrue(result['busy'])
+            self.assertEqual(result['retry_after'], 1)
+
+            fake.capacity = 10
+            started = time.monotonic()
+            self.assertTrue(self.initiate(second, 'tx-after-pause')['success'])
+            waited = time.monotonic() - started
+
+        # the second process queued out the Retry-After instead of hitting Chapa again
+        self.assertGreaterEqual(waited, 0.8)
+        self.assertEqual(fake.stats()['throttled'], 1)
+        self.assertEqual(fake.stats()['served'], 1)
+        self.assertEqual(first.limiter.snapshot()['throttled'], 1)
+
+    def test_overload_is_queued_not_sent(self):
+        with FakeChapa(latency=0.05, jitter=0, capacity=2) as fake:
+            service = self.service(fake)
+            results = []
+            callers = [
+                threading.Thread(target=lambda index=index: results.append(self.initiate(service, f'tx-{index}')))
+                for index in range(8)
+            ]
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join(10)
+
+        # at most CHAPA_MAX_IN_FLIGHT reach the fake at once, so its 429 limit is never hit
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(len(results), 8)
+        self.assertEqual(fake.stats()['throttled'], 0)
+        self.assertLessEqual(fake.stats()['peak_active'], 2)
+        self.assertGreater(service.limiter.snapshot()['queue_depth_max'], 0)
+
+
+class CalendarSyncTests(TestCase):
+    """
+    Imports fixtures/ical/host_calendar.ics, then host_calendar_updated.ics, into one
+    external calendar and checks the blocks and the listing's availability after each
+    """
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(
+            host=self.host, title='Cabin', description='-', address='-', price_per_night=10,
+        )
+        self.calendar = ExternalCalendar.objects.create(listing=self.listing, name='other-platform')
+
+    def sync(self, name):
+        with open(os.path.join(ICAL_FIXTURES, name), encoding='utf-8') as lines:
+            return ical.sync_calendar(self.calendar, lines)
+
+    def available(self, start, end):
+        return is_available(self.listing.pk, date.fromisoformat(start), date.fromisoformat(end))
+
+    def blocks(self):
+        return dict(CalendarBlock.objects.filter(calendar=self.calendar).values_list('uid', 'start_date'))
+
+    def test_initial_import(self):
+        counts = self.sync('host_calendar.ics')
+
+        self.assertEqual(counts, {'created': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'conflicts': 0})
+        # the cancelled reservation is not imported
+        self.assertEqual(set(self.blocks()), {'res-1001@example.com', 'res-1002@example.com', 'block-7@example.com'})
+        self.assertIn('folded onto a second line', CalendarBlock.objects.get(uid='res-1002@example.com').summary)
+        self.assertFalse(self.available('2030-01-13', '2030-01-15'))
+        self.assertTrue(self.available('2030-01-14', '2030-01-16'))
+        # date-times count by day: 1 Feb 15:00 to 5 Feb 11:00 holds the nights of 1-4 Feb
+        self.assertFalse(self.available('2030-02-04', '2030-02-05'))
+        self.assertTrue(self.available('2030-02-05', '2030-02-06'))
+        # an event without DTEND blocks its start day only
+        self.assertFalse(self.available('2030-03-01', '2030-03-02'))
+        self.assertTrue(self.available('2030-03-02', '2030-03-03'))
+        self.assertTrue(self.available('2030-03-20', '2030-03-22'))
+
+    def test_resync_applies_moves_additions_and_removals(self):
+        self.sync('host_calendar.ics')
+        counts = self.sync('host_calendar_updated.ics')
+
+        self.assertEqual(counts, {'created': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1, 'conflicts': 0})
+        self.assertEqual(self.blocks(), {
+            'res-1001@example.com': date(2030, 1, 10),
+            'res-1002@example.com': date(2030, 2, 2),
+            'res-1004@example.com': date(2030, 4, 15),
+        })
+        self.assertTrue(self.available('2030-02-01', '2030-02-02'))
+        self.assertFalse(self.available('2030-02-05', '2030-02-06'))
+        self.assertTrue(self.available('2030-03-01', '2030-03-02'))
+        self.assertFalse(self.available('2030-04-16', '2030-04-20'))
+        # re-importing the same feed changes nothing
+        self.assertEqual(self.sync('host_calendar_updated.ics')['unchanged'], 3)
+
+    def test_bookings_respect_imported_blocks(self):
+        self.sync('host_calendar.ics')
+        client = APIClient()
+        client.force_authenticate(self.guest)
+
+        def book(start, end):
+            return client.post('/api/bookings/', {
+                'listing_id': str(self.listing.pk), 'user_id': str(self.guest.pk),
+                'start_date': start, 'end_date': end,
+            }, format='json')
+
+        self.assertEqual(book('2030-01-12', '2030-01-16').status_code, 400)
+        response = book('2030-01-14', '2030-01-17')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_price']), 30)
+
+        # moving the booking onto a block is refused; onto free dates it is re-priced
+        booking = Booking.objects.get(pk=response.data['id'])
+        reschedule = f'/api/bookings/{booking.pk}/reschedule/'
+        self.assertEqual(client.post(reschedule, {'start_date': '2030-02-03', 'end_date': '2030-02-06'},
+                                     format='json').status_code, 400)
+        response = client.post(reschedule, {'start_date': '2030-01-15', 'end_date': '2030-01-19'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        booking.refresh_from_db()
+        self.assertEqual((booking.start_date, booking.total_price), (date(2030, 1, 15), 40))
+
+
+class CompleteEndedBookingsTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+
+    def booking(self, status, ends_in_days):
+        end = timezone.localdate() + timedelta(days=ends_in_days)
+        return Booking.objects.create(
+            listing=self.listing, user=self.guest, start_date=end - timedelta(days=2), end_date=end,
+            total_price=20, status=status,
+        )
+
+    def test_ended_confirmed_stays_are_completed_and_become_archivable(self):
+        ended = self.booking('confirmed', -400)
+        checkout_today = self.booking('confirmed', 0)
+        ongoing = self.booking('confirmed', 1)
+        unpaid = self.booking('pending', -3)
+
+        self.assertEqual(complete_ended_bookings(), 2)
+
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[ended.id], 'completed')
+        self.assertEqual(statuses[checkout_today.id], 'completed')
+        self.assertEqual(statuses[ongoing.id], 'confirmed')
+        self.assertEqual(statuses[unpaid.id], 'pending')
+        self.assertEqual(
+            OutboxEvent.objects.filter(event_type='booking.completed').count(), 2,
+        )
+        cutoff = timezone.localdate() - timedelta(days=365)
+        self.assertEqual(list(archive.archivable(cutoff).values_list('id', flat=True)), [ended.id])
+        # already completed bookings are left alone
+        self.assertEqual(complete_ended_bookings(), 0)
+
+
+class HostLedgerTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(host=self.host, title='Cabin', description='-', address='-', price_per_night=50)
+        self.client = APIClient()
+
+    def paid_booking(self, amount, status='pending'):
+        booking = Booking.objects.create(
+            listing=self.listing, user=self.guest, start_date=date(2030, 1, 1), end_date=date(2030, 1, 3),
+            total_price=amount, status=status,
+        )
+        Payment.objects.create(booking=booking, amount=amount, currency='ETB', status='completed')
+        return booking
+
+    def balance(self):
+        return HostBalance.objects.get(host=self.host, currency='ETB').balance
+
+    def test_host_is_credited_when_the_booking_confirms(self):
+        booking = self.paid_booking(100)
+        self.assertIsNone(ledger.credit_booking(booking))
+        self.assertFalse(HostLedgerEntry.objects.exists())
+
+        self.client.force_authenticate(self.host)
+        self.assertEqual(self.client.post(f'/api/bookings/{booking.pk}/confirm/').status_code, 200)
+        self.assertEqual(list(HostLedgerEntry.objects.values_list('entry_type', 'amount')), [('earning', 100)])
+        self.assertEqual(self.balance(), 100)
+        # confirming again credits nothing more
+        self.assertIsNone(ledger.credit_booking(Booking.objects.get(pk=booking.pk)))
+
+    def test_cancelling_a_paid_booking_reverses_the_earning_before_settlement(self):
+        cancelled = self.paid_booking(100, status='confirmed')
+        kept = self.paid_booking(50, status='confirmed')
+        ledger.credit_booking(cancelled)
+        ledger.credit_booking(kept)
+
+        self.client.force_authenticate(self.guest)
+        for _ in range(2):
+            self.assertEqual(self.client.post(f'/api/bookings/{cancelled.pk}/cancel/').status_code, 200)
+
+        self.assertEqual(
+            list(HostLedgerEntry.objects.filter(booking_id=cancelled.pk).values_list('entry_type', 'amount')),
+            [('earning', 100), ('adjustment', -100)],
+        )
+        self.assertEqual(self.balance(), 50)
+        self.assertEqual(Payment.objects.get(booking=cancelled).status, 'refund_due')
+        self.assertTrue(OutboxEvent.objects.filter(event_type='payment.refund_due').exists())
+
+        with override_settings(SETTLEMENT_LAG_SECONDS=-60):
+            settlement = ledger.settle()
+        self.assertEqual(list(HostPayout.objects.filter(settlement=settlement).values_list('amount', flat=True)), [50])
+        self.assertEqual(self.balance(), 0)
+
+
+class BookingOwnershipTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.other = User.objects.create(username='other', email='other@example.com')
+        self.listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        self.other_listing = Listing.objects.create(
+            host=host, title='Loft', description='-', address='-', price_per_night=99,
+        )
+        self.client = APIClient()
+
+    def book(self, user, **data):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/bookings/', {
+            'listing_id': str(self.listing.pk), 'start_date': '2030-01-01', 'end_date': '2030-01-03', **data,
+        }, format='json')
+
+    def test_guests_book_for_themselves_whatever_user_id_says(self):
+        response = self.book(self.guest, user_id=str(self.other.pk))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get(pk=response.data['id']).user, self.guest)
+
+    def test_agency_partners_may_book_for_others(self):
+        agency = User.objects.create(username='agency', email='agency@example.com', role='agency')
+        response = self.book(agency, user_id=str(self.other.pk))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get(pk=response.data['id']).user, self.other)
+
+    def test_reschedule_cannot_change_the_guest_or_listing(self):
+        booking = Booking.objects.get(pk=self.book(self.guest).data['id'])
+        response = self.client.post(f'/api/bookings/{booking.pk}/reschedule/', {
+            'user_id': str(self.other.pk), 'listing_id': str(self.other_listing.pk),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'user_id', 'listing_id'})
+        booking.refresh_from_db()
+        self.assertEqual((booking.user, booking.listing), (self.guest, self.listing))
+
+    def test_reschedule_reprices_the_pending_payment(self):
+        booking = Booking.objects.get(pk=self.book(self.guest).data['id'])
+        payment = Payment.objects.create(booking=booking, amount=booking.total_price, currency='ETB')
+        response = self.client.post(f'/api/bookings/{booking.pk}/reschedule/',
+                                    {'start_date': '2030-01-01', 'end_date': '2030-01-05'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        payment.refresh_from_db()
+        self.assertEqual(payment.amount, 40)
+
+        # once paid, only a move to dates of the same price is allowed
+        Payment.objects.filter(pk=payment.pk).update(status='completed')
+        reschedule = f'/api/bookings/{booking.pk}/reschedule/'
+        self.assertEqual(self.client.post(reschedule, {'start_date': '2030-01-01', 'end_date': '2030-01-02'},
+                                          format='json').status_code, 400)
+        self.assertEqual(self.client.post(reschedule, {'start_date': '2030-01-02', 'end_date': '2030-01-06'},
+                                          format='json').status_code, 200)
+
+
+class BookingConfirmationEmailTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        guest = User.objects.create(username='guest', email='guest@example.com')
+        listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        self.booking = Booking.objects.create(
+            listing=listing, user=guest, start_date=date(2030, 1, 1), end_date=date(2030, 1, 3), total_price=20,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.booking.confirm()
+        self.event = OutboxEvent.objects.get(event_type='booking.confirmed')
+
+    def deliver(self):
+        return send_booking_confirmation.run(str(self.booking.id), outbox_id=self.event.id)
+
+    def test_failed_send_is_retried_and_then_sent_once(self):
+        with mock.patch('listings.tasks.send_mail', side_effect=OSError('SMTP down')), \
+                mock.patch.object(send_booking_confirmation, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                self.deliver()
+        retry.assert_called_once()
+        # nothing is recorded for the event, so the broker's redelivery sends it
+        self.assertFalse(ProcessedOutboxEvent.objects.exists())
+
+        self.deliver()
+        self.deliver()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('has been confirmed', mail.outbox[0].body)
+        self.assertEqual(ProcessedOutboxEvent.objects.filter(outbox_id=self.event.id).count(), 1)
+
+
+class RecordingSink(outbox.OutboxSink):
+    """Keeps what it is given; fails for the aggregate ids in `failing`"""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.published = []
+
+    def publish(self, event):
+        if event.aggregate_id in self.failing:
+            raise ConnectionError('broker unavailable')
+        self.published.append((event.aggregate_id, event.event_type))
+
+
+class OutboxRelayTests(TestCase):
+    def record(self, aggregate_id, event_type):
+        return outbox.record('booking', aggregate_id, event_type)
+
+    def test_events_are_published_once_in_commit_order(self):
+        self.record('a', 'booking.created')
+        try:
+            with transaction.atomic():
+                self.record('b', 'booking.created')
+                raise ValueError
+        except ValueError:
+            pass
+        self.record('a', 'booking.confirmed')
+        self.record('c', 'booking.created')
+
+        sink = RecordingSink()
+        self.assertEqual(outbox.relay(sink=sink), 3)
+        self.assertEqual(outbox.relay(sink=sink), 0)
+        # the rolled-back event never reaches the sink
+        self.assertEqual(sink.published, [('a', 'booking.created'), ('a', 'booking.confirmed'), ('c', 'booking.created')])
+
+    def test_failure_holds_back_the_aggregate_until_parked(self):
+        first = self.record('a', 'booking.created')
+        second = self.record('a', 'booking.confirmed')
+        self.record('b', 'booking.created')
+        sink = RecordingSink(failing={'a'})
+
+        with override_settings(OUTBOX_MAX_ATTEMPTS=2):
+            self.assertEqual(outbox.relay(sink=sink), 1)
+            first.refresh_from_db()
+            self.assertEqual((first.attempts, first.parked_at), (1, None))
+            outbox.relay(sink=sink)
+        first.refresh_from_db()
+        self.assertEqual(first.attempts, 2)
+        self.assertIsNotNone(first.parked_at)
+        # the later event of the same aggregate was never tried while the first one failed
+        second.refresh_from_db()
+        self.assertEqual((second.attempts, second.published_at), (0, None))
+
+        sink.failing.clear()
+        self.assertEqual(outbox.requeue_parked(), 1)
+        self.assertEqual(outbox.relay(sink=sink), 2)
+        self.assertEqual(sink.published, [('b', 'booking.created'), ('a', 'booking.created'), ('a', 'booking.confirmed')])
+
+    def test_redelivered_event_is_consumed_once(self):
+        event = self.record('a', 'booking.confirmed')
+        runs = []
+        for _ in range(2):
+            with outbox.consume_once(event.id, 'test') as first:
+                if first:
+                    runs.append(event.id)
+        self.assertEqual(runs, [event.id])
+
+        # a consumer that fails leaves no record, so the redelivery runs it
+        other = self.record('b', 'booking.confirmed')
+        with self.assertRaises(RuntimeError), outbox.consume_once(other.id, 'test') as first:
+            raise RuntimeError
+        with outbox.consume_once(other.id, 'test') as first:
+            self.assertTrue(first)
+        self.assertEqual(ProcessedOutboxEvent.objects.filter(consumer='test').count(), 2)
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        auth_cache.local.clear()
+        self.user = User.objects.create_user(username='guest', email='guest@example.com', password='s3cret-pass')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.token.key)[0]
+
+    def test_hits_build_a_fresh_user_without_the_password(self):
+        first = self.authenticate()
+        first.has_perm('listings.view_booking')
+        first.note = 'set by a view'
+        with self.assertNumQueries(0):
+            second = self.authenticate()
+        self.assertIsNot(second, first)
+        self.assertEqual(second, self.user)
+        self.assertFalse(hasattr(second, '_perm_cache') or hasattr(second, 'note'))
+        self.assertNotIn('pbkdf2', repr(cache.get(auth_cache._user_key(self.user.pk))))
+        with self.assertNumQueries(0):
+            self.assertEqual(second.get_session_auth_hash(), self.user.get_session_auth_hash())
+        # the password is still there for the few places that need it
+        self.assertTrue(second.check_password('s3cret-pass'))
+
+    def test_session_requests_are_served_from_the_cache(self):
+        client = APIClient()
+        client.force_login(self.user)
+        self.assertEqual(client.get('/api/bookings/').status_code, 200)
+        self.assertIsNotNone(CachedModelBackend().get_user(self.user.pk))
+        self.assertEqual(client.get('/api/bookings/').status_code, 200)
+
+    def test_queryset_update_drops_cached_users(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.assertIsNone(CachedModelBackend().get_user(self.user.pk))
+
+
+class BookingTransitionTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        guest = User.objects.create(username='guest', email='guest@example.com')
+        listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        self.booking = Booking.objects.create(
+            listing=listing, user=guest, start_date=date(2030, 1, 1), end_date=date(2030, 1, 3), total_price=20,
+        )
+
+    def test_stale_instance_is_checked_against_the_stored_status(self):
+        stale = Booking.objects.get(pk=self.booking.pk)
+        self.booking.cancel()
+
+        with self.assertRaises(DjangoValidationError):
+            stale.confirm()
+        self.assertEqual(stale.status, 'cancelled')
+        # cancelling again is a no-op rather than a second event
+        Booking.objects.get(pk=self.booking.pk).cancel()
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'cancelled')
+        self.assertEqual(list(OutboxEvent.objects.values_list('event_type', flat=True)), ['booking.cancelled'])
+
+    def test_transition_from_a_stale_status_that_is_still_allowed(self):
+        stale = Booking.objects.get(pk=self.booking.pk)
+        self.booking.confirm()
+        stale.cancel()
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'cancelled')
+        self.assertEqual(list(OutboxEvent.objects.order_by('id').values_list('event_type', flat=True)),
+                         ['booking.confirmed', 'booking.cancelled'])
+
+
+class SimilarListingsTests(TestCase):
+    def setUp(self):
+        fx.invalidate()
+        self.addCleanup(fx.invalidate)
+        FxRate.objects.create(currency='USD', rate=Decimal('0.02'))
+        self.host = User.objects.create(username='host', email='host@example.com')
+
+    def listing(self, title, price, currency):
+        return Listing.objects.create(host=self.host, title=title, description='-', address='-',
+                                      price_per_night=price, currency=currency)
+
+    def test_prices_are_compared_in_the_base_currency(self):
+        cheap_usd = self.listing('Cabin', 10, 'USD')
+        cheap_etb = self.listing('Hut', 500, 'ETB')
+        dear_etb = self.listing('Villa', 1500, 'ETB')
+        self.listing('Mystery', 80, 'XYZ')
+
+        similarity.rebuild(k=1)
+        nearest = dict(ListingNeighbours.objects.values_list('listing_id', 'neighbours'))
+        # 10 USD is 500 ETB: in their own currencies they would be the furthest apart
+        self.assertEqual(nearest[cheap_usd.pk][0][0], str(cheap_etb.pk))
+        self.assertEqual(nearest[cheap_etb.pk][0][0], str(cheap_usd.pk))
+        self.assertEqual(len(nearest[dear_etb.pk]), 1)
+
+
+class LogPipelineTests(SimpleTestCase):
+    def test_records_are_snapshotted_on_the_calling_thread(self):
+        stream = StringIO()
+        handler = BackgroundQueueHandler(stream=stream, max_field_chars=60)
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger('log_pipeline_test')
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        payload = {'status': 'pending', 'headers': {'Authorization': 'Bearer CHASECK_TEST-1'}}
+        args = ['first']
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.error("Payment %s", args, exc_info=True,
+                         extra={'payload': payload, 'secret_key': 'CHASECK_TEST-1', 'body': 'x' * 80})
+        # changed by the caller before the writer gets to the record
+        payload['status'] = 'completed'
+        args.append('second')
+        handler.flush_and_stop()
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['message'], "Payment ['first']")
+        self.assertEqual(entry['payload'], {'status': 'pending', 'headers': {'Authorization': '***'}})
+        self.assertEqual(entry['secret_key'], '***')
+        self.assertTrue(entry['body'].endswith('[truncated 20 chars]'))
+        self.assertIn('ValueError: boom', entry['exc'])
+
+
+class BookingLockTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create(username='host', email='host@example.com')
+        self.agency = User.objects.create(username='agency', email='agency@example.com', role='agency')
+        self.listing = Listing.objects.create(host=self.host, title='Cabin', description='-', address='-',
+                                              price_per_night=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.agency)
+
+    def booking(self, start, end):
+        return Booking.objects.create(listing=self.listing, user=self.agency, start_date=date(2030, 1, start),
+                                      end_date=date(2030, 1, end), total_price=10 * (end - start))
+
+    def test_single_bookings_lock_the_listing_before_the_overlap_check(self):
+        calls = []
+
+        def lock(listing_ids):
+            calls.append(('lock', list(listing_ids), transaction.get_connection().in_atomic_block))
+            return lock_listings(listing_ids)
+
+        def check(listing_id, *args, **kwargs):
+            calls.append(('check', [listing_id], transaction.get_connection().in_atomic_block))
+            return is_available(listing_id, *args, **kwargs)
+
+        with mock.patch('listings.serializers.lock_listings', side_effect=lock), \
+                mock.patch('listings.serializers.is_available', side_effect=check):
+            created = self.client.post('/api/bookings/', {
+                'listing_id': str(self.listing.pk), 'start_date': '2030-01-01', 'end_date': '2030-01-03',
+            }, format='json')
+            self.assertEqual(created.status_code, 201)
+            booking_url = f'/api/bookings/{created.data["id"]}/'
+            self.assertEqual(self.client.post(booking_url + 'reschedule/', {'end_date': '2030-01-04'},
+                                              format='json').status_code, 200)
+            self.assertEqual(self.client.patch(booking_url, {'end_date': '2030-01-05'},
+                                               format='json').status_code, 200)
+            self.assertEqual(self.client.post(f'/api/listings/{self.listing.pk}/create_booking/', {
+                'start_date': '2030-01-10', 'end_date': '2030-01-12',
+            }, format='json').status_code, 201)
+        self.assertEqual(calls, [('lock', [self.listing.pk], True), ('check', [self.listing.pk], True)] * 4)
+
+    def test_bulk_reschedule_checks_the_batch_against_itself(self):
+        first, second, third = self.booking(1, 3), self.booking(3, 5), self.booking(10, 12)
+        results = bulk_reschedule_bookings([
+            # swapping dates within one request is refused, in either order
+            {'booking_id': str(first.pk), 'start_date': '2030-01-03', 'end_date': '2030-01-05'},
+            {'booking_id': str(second.pk), 'start_date': '2030-01-01', 'end_date': '2030-01-03'},
+            # a booking may move onto part of its own dates
+            {'booking_id': str(third.pk), 'start_date': '2030-01-11', 'end_date': '2030-01-14'},
+            {'booking_id': str(third.pk), 'start_date': '2030-01-20', 'end_date': '2030-01-21'},
+        ], self.agency)
+        self.assertEqual([result['status'] for result in results], ['error', 'error', 'rescheduled', 'error'])
+        self.assertIn('more than once', results[3]['errors']['booking_id'][0])
+        third.refresh_from_db()
+        self.assertEqual((third.start_date, third.end_date, third.total_price), (date(2030, 1, 11), date(2030, 1, 14), 30))
+
+
+class BucketThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        clock = mock.patch('listings.throttling.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        rates = override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {'search_user': '3/min', 'search_ip': '100/min'},
+        })
+        rates.enable()
+        self.addCleanup(rates.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='guest', email='guest@example.com'))
+
+    def search(self, count=1):
+        return [self.client.get('/api/listings/').status_code for _ in range(count)]
+
+    def test_burst_is_capped_and_retry_after_says_when_a_token_is_back(self):
+        self.assertEqual(self.search(3), [200, 200, 200])
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 429)
+        # one token every 20 seconds at 3/min
+        self.assertEqual(response['Retry-After'], '20')
+
+        self.now += 19
+        self.assertEqual(self.search(), [429])
+        self.now += 1
+        self.assertEqual(self.search(2), [200, 429])
+
+    def test_idle_bucket_refills_to_the_burst_and_no_further(self):
+        self.search(3)
+        self.now += 3600
+        self.assertEqual(self.search(4), [200, 200, 200, 429])
+
+    def test_limits_per_worker_when_the_shared_cache_is_down(self):
+        local_store._buckets.clear()
+        with mock.patch.object(cache_store, 'consume', side_effect=ConnectionError):
+            self.assertEqual(self.search(4), [200, 200, 200, 429])
+            self.now += 20
+            self.assertEqual(self.search(2), [200, 429])
+
+
+class RatingStatsTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        self.listings = [
+            Listing.objects.create(host=host, title=title, description='-', address='-', price_per_night=10)
+            for title in ('Cabin', 'Loft')
+        ]
+        self.guests = [User.objects.create(username=f'guest{n}', email=f'guest{n}@example.com') for n in range(4)]
+
+    def assertStatsMatchReviews(self):
+        for listing in self.listings:
+            reviews = Review.objects.filter(listing=listing)
+            stats = ListingRatingStats.objects.filter(listing=listing).first() or ListingRatingStats(listing=listing)
+            average = reviews.aggregate(average=Avg('rating'))['average']
+            self.assertEqual(stats.average, round(average, 2) if average is not None else None)
+            self.assertEqual(stats.histogram, {
+                str(stars): reviews.filter(rating=stars).count() for stars in range(1, 6)
+            })
+
+    def test_stats_follow_review_create_update_and_delete(self):
+        cabin, loft = self.listings
+        reviews = [Review.objects.create(listing=cabin, user=guest, rating=rating, comment='-')
+                   for guest, rating in zip(self.guests, (5, 4, 4, 1))]
+        self.assertStatsMatchReviews()
+
+        reviews[3].rating = 3
+        reviews[3].save()
+        self.assertStatsMatchReviews()
+
+        # loaded fresh, then moved to the other listing with a new rating
+        moved = Review.objects.get(pk=reviews[0].pk)
+        moved.listing, moved.rating = loft, 2
+        moved.save()
+        self.assertStatsMatchReviews()
+
+        Review.objects.get(pk=reviews[1].pk).delete()
+        Review.objects.filter(listing=loft).delete()
+        self.assertStatsMatchReviews()
+
+    def test_histogram_endpoint_and_rebuild_after_a_bulk_update(self):
+        cabin = self.listings[0]
+        client = APIClient()
+        for guest, rating in zip(self.guests, (5, 3, 3)):
+            Booking.objects.create(listing=cabin, user=guest, start_date=date(2020, 1, 1), end_date=date(2020, 1, 3),
+                                   total_price=20, status='completed')
+            client.force_authenticate(guest)
+            self.assertEqual(client.post('/api/reviews/', {'listing_id': str(cabin.pk), 'rating': rating,
+                                                           'comment': '-'}, format='json').status_code, 201)
+        response = client.get(f'/api/reviews/histogram/?listing={cabin.pk}')
+        self.assertEqual(response.data['histogram'], {'1': 0, '2': 0, '3': 2, '4': 0, '5': 1})
+
+        # queryset updates bypass the signals; the rebuild command repairs the stats
+        Review.objects.filter(listing=cabin, rating=3).update(rating=1)
+        call_command('rebuild_rating_stats', stdout=StringIO())
+        self.assertStatsMatchReviews()
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        for week in range(3):
+            Booking.objects.create(listing=self.listing, user=guest, start_date=date(2030, 1, 1 + 7 * week),
+                                   end_date=date(2030, 1, 3 + 7 * week), total_price=20)
+        self.client = APIClient()
+        self.client.force_authenticate(guest)
+        # the FX table is loaded once per process; keep that query out of the counts
+        fx.get_rates()
+
+    def get(self, query, queries):
+        # the ETag version, the page count and the page itself, whatever the page size
+        with self.assertNumQueries(queries), CaptureQueriesContext(connections['default']) as captured:
+            response = self.client.get(f'/api/bookings/?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        return response.data['results'][0], captured.captured_queries[-1]['sql']
+
+    def test_unexpanded_relation_renders_as_its_id_without_a_join(self):
+        row, sql = self.get('fields=id,start_date,listing', 3)
+        self.assertEqual(set(row), {'id', 'start_date', 'listing'})
+        self.assertEqual(str(row['listing']), str(self.listing.pk))
+        self.assertNotIn('listings_listing', sql)
+        self.assertNotIn('total_price', sql)
+
+    def test_expanded_relation_renders_in_full(self):
+        # plus the listing's review ids, prefetched for the whole page
+        row, _ = self.get('fields=id,listing&expand=listing', 4)
+        self.assertEqual(row['listing']['title'], 'Cabin')
+        self.assertEqual(row['listing']['host']['username'], 'host')
+
+    def test_nested_fields_are_joined_and_trimmed(self):
+        row, sql = self.get('fields=id,listing.title,listing.host.username', 3)
+        self.assertEqual(row['listing'], {'title': 'Cabin', 'host': {'username': 'host'}})
+        self.assertNotIn('description', sql)
+        self.assertNotIn('email', sql)
+
+    def test_unknown_fields_are_ignored(self):
+        row, _ = self.get('fields=id,bogus,listing.bogus', 3)
+        self.assertEqual(set(row), {'id', 'listing'})
+        self.assertEqual(row['listing'], {})
+
+
+class BatchLoaderTests(TestCase):
+    def setUp(self):
+        hosts = [User.objects.create(username=f'host{n}', email=f'host{n}@example.com') for n in range(2)]
+        listings = [Listing.objects.create(host=host, title=f'Cabin {n}', description='-', address='-',
+                                           price_per_night=10) for n, host in enumerate(hosts)]
+        for n in range(6):
+            guest = User.objects.create(username=f'guest{n}', email=f'guest{n}@example.com', first_name=f'G{n}')
+            booking = Booking.objects.create(listing=listings[n % 2], user=guest, start_date=date(2030, 1, 1 + 3 * n),
+                                             end_date=date(2030, 1, 3 + 3 * n), total_price=20)
+            Payment.objects.create(booking=booking, amount=20, currency='ETB')
+        fx.get_rates()
+
+    def render(self, serializer_class, queryset, queries):
+        with self.assertNumQueries(queries), CaptureQueriesContext(connections['default']) as captured:
+            data = serializer_class(list(queryset), many=True).data
+        return data, [query['sql'] for query in captured.captured_queries[1:]]
+
+    def test_a_page_of_payments_loads_each_relation_level_once_with_its_columns(self):
+        # the payments, then their bookings, listings and guests: one query each, for any page size
+        data, loads = self.render(PaymentSerializer, Payment.objects.all(), 4)
+        self.assertEqual(len(data), 6)
+        self.assertEqual(sorted({row['listing_title'] for row in data}), ['Cabin 0', 'Cabin 1'])
+        self.assertEqual({row['user_email'] for row in data}, {f'guest{n}@example.com' for n in range(6)})
+        self.assertNotIn('total_price', loads[0])
+        self.assertNotIn('description', loads[1])
+        self.assertNotIn('password', loads[2])
+        # the same count for a shorter page
+        self.render(PaymentSerializer, Payment.objects.all()[:2], 4)
+
+    def test_a_page_of_bookings_loads_shared_users_once(self):
+        # bookings, guests, listings, their hosts, payments and review ids
+        data, loads = self.render(BookingSerializer, Booking.objects.all(), 6)
+        self.assertEqual({row['listing']['host']['username'] for row in data}, {'host0', 'host1'})
+        self.assertEqual({row['payment_status'] for row in data}, {'pending'})
+        self.assertFalse(any('password' in sql for sql in loads))
+
+
+class WaitlistReleaseTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        self.cancelled = self.booking(10, 15)
+        self.cancelled.cancel()
+
+    def booking(self, start, end):
+        return Booking.objects.create(listing=self.listing, user=self.guest, start_date=date(2030, 1, start),
+                                      end_date=date(2030, 1, end), total_price=10 * (end - start))
+
+    def wait(self, name, start, end):
+        user = User.objects.create(username=name, email=f'{name}@example.com')
+        return WaitlistEntry.objects.create(listing=self.listing, user=user, start_date=date(2030, 1, start),
+                                            end_date=date(2030, 1, end))
+
+    def test_entries_whose_whole_range_is_free_are_matched_once(self):
+        inside = self.wait('inside', 11, 13)
+        overlapping_end = self.wait('overlapping_end', 14, 16)
+        still_booked = self.wait('still_booked', 12, 17)
+        still_blocked = self.wait('still_blocked', 6, 11)
+        self.wait('elsewhere', 20, 22)
+        overlapping_start = self.wait('overlapping_start', 8, 11)
+        # another guest's booking and an imported block still hold part of some ranges
+        self.booking(16, 17)
+        feed = ExternalCalendar.objects.create(listing=self.listing, name='Airbnb', url='https://example.com/a.ics')
+        CalendarBlock.objects.create(listing=self.listing, calendar=feed, uid='block', start_date=date(2030, 1, 6),
+                                     end_date=date(2030, 1, 7))
+
+        matched = waitlist.release(self.cancelled.pk)
+        self.assertEqual(matched, [inside.pk, overlapping_end.pk, overlapping_start.pk])
+        self.assertFalse(WaitlistEntry.objects.filter(pk__in=[still_booked.pk, still_blocked.pk],
+                                                      notified_at__isnull=False).exists())
+
+        # a redelivered booking.cancelled finds the release already recorded
+        self.assertEqual(waitlist.release(self.cancelled.pk), [])
+        self.assertEqual(WaitlistRelease.objects.get(booking_id=self.cancelled.pk).matched, 3)
+        self.assertEqual(
+            sorted(WaitlistEntry.objects.filter(notified_at__isnull=False).values_list('notify_count', flat=True)),
+            [1, 1, 1],
+        )
+
+    def test_active_bookings_release_nothing(self):
+        self.wait('inside', 11, 13)
+        self.assertEqual(waitlist.release(self.booking(20, 22).pk), [])
+        self.assertFalse(WaitlistRelease.objects.exists())
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.addCleanup(autocomplete._swap, None, {'built_at': 0.0, 'checked_at': 0.0, 'mark': None, 'rows': 0})
+        autocomplete._swap(None, {})
+        self.host = User.objects.create(username='host', email='host@example.com')
+
+    def listing(self, title, address='Addis Ababa'):
+        return Listing.objects.create(host=self.host, title=title, description='-', address=address, price_per_night=10)
+
+    def titles(self, query):
+        return [title for _, title, _ in autocomplete.get_index().suggest(query)]
+
+    def test_prefix_lookup_ranks_by_popularity(self):
+        index = autocomplete.AutocompleteIndex().build([
+            (1, 'Cabin by the lake', 'Bahir Dar', 2),
+            (2, 'Café loft', 'Addis Ababa', 5),
+            (3, 'Castle view', 'Gondar', 0),
+            (4, 'Beach house', 'Bahir Dar', 9),
+        ])
+        self.assertEqual([title for _, title, _ in index.suggest('ca')], ['Café loft', 'Cabin by the lake', 'Castle view'])
+        self.assertEqual([title for _, title, _ in index.suggest('cafe')], ['Café loft'])
+        self.assertEqual([title for _, title, _ in index.suggest('bah ca')], ['Cabin by the lake'])
+
+        index.upsert(3, 'Cave retreat', 'Lalibela', 0)
+        index.remove(1)
+        self.assertEqual([title for _, title, _ in index.suggest('ca')], ['Café loft', 'Cave retreat'])
+        self.assertEqual(index.suggest('cast'), [])
+
+    @override_settings(AUTOCOMPLETE_REFRESH_SECONDS=0, AUTOCOMPLETE_REBUILD_SECONDS=3600)
+    def test_index_follows_saves_here_and_changes_made_elsewhere(self):
+        cabin = self.listing('Cabin')
+        self.assertEqual(self.titles('cab'), ['Cabin'])
+
+        # saved in this process: patched through the signal once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing('Cable car lodge')
+        self.assertEqual(sorted(self.titles('cab')), ['Cabin', 'Cable car lodge'])
+
+        # changed by another process: no signal here, picked up by the catch-up
+        Listing.objects.filter(pk=cabin.pk).update(title='Treehouse', updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.titles('tree'), ['Treehouse'])
+        self.assertEqual(self.titles('cab'), ['Cable car lodge'])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        host = User.objects.create(username='host', email='host@example.com')
+        self.guest = User.objects.create(username='guest', email='guest@example.com')
+        self.listing = Listing.objects.create(host=host, title='Cabin', description='-', address='-', price_per_night=10)
+        self.cutoff = date(2024, 1, 1)
+
+    def booking(self, status, payment_status=None, end=date(2023, 6, 3)):
+        booking = Booking.objects.create(listing=self.listing, user=self.guest, start_date=end - timedelta(days=2),
+                                         end_date=end, total_price=20, status=status)
+        if payment_status is not None:
+            payment = Payment.objects.create(booking=booking, amount=20, currency='ETB', status=payment_status)
+            payment.record_event('initiation', {'status': 'success'})
+            payment.record_event('verification', {'status': payment_status})
+        return booking
+
+    def test_finished_history_is_moved_once(self):
+        moved = [self.booking('completed', 'completed'), self.booking('cancelled'),
+                 self.booking('cancelled', 'canceled')]
+        kept = [
+            self.booking('cancelled', 'pending'),                    # a checkout still in flight
+            self.booking('confirmed', 'completed'),                  # not completed yet
+            self.booking('completed', 'completed', end=self.cutoff),  # ended on the cutoff
+        ]
+
+        self.assertEqual(list(archive.archive(self.cutoff, batch_size=2)), [2, 1])
+        self.assertEqual(list(archive.archive(self.cutoff)), [])
+        self.assertEqual(set(ArchivedBooking.objects.values_list('id', flat=True)), {booking.id for booking in moved})
+        self.assertEqual(set(Booking.objects.values_list('id', flat=True)), {booking.id for booking in kept})
+        self.assertEqual(ArchivedPayment.objects.count(), 2)
+        self.assertEqual(ArchivedPaymentEvent.objects.count(), 4)
+        self.assertEqual(PaymentEvent.objects.count(), 6)
+        archived = ArchivedBooking.objects.get(pk=moved[0].pk)
+        self.assertEqual((archived.status, archived.total_price, archived.payment.status), ('completed', 20, 'completed'))
+
+    def test_rows_locked_elsewhere_are_skipped(self):
+        self.booking('completed', 'completed')
+        # SQLite has no row locks; pretend to be a backend that has them and check the SQL
+        features = connections['default'].features
+        with mock.patch.multiple(features, has_select_for_update=True, has_select_for_update_skip_locked=True,
+                                 has_select_for_update_of=True), \
+                CaptureQueriesContext(connections['default']) as captured, self.assertRaises(DatabaseError):
+            archive.archive_batch(self.cutoff)
+        self.assertTrue(any('FOR UPDATE' in query['sql'] and 'SKIP LOCKED' in query['sql']
+                            for query in captured.captured_queries))
+        self.assertEqual(ArchivedBooking.objects.count(), 0)
+
+
+class FxTests(TestCase):
+    def setUp(self):
+        fx.invalidate()
+        self.addCleanup(fx.invalidate)
+
+    def test_rates_files_are_parsed_and_rebased_on_the_base_currency(self):
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'rates.json')
+            with open(json_path, 'w') as handle:
+                json.dump({'base': 'USD', 'rates': {'etb': '50', 'EUR': 0.8}}, handle)
+            csv_path = os.path.join(directory, 'rates.csv')
+            with open(csv_path, 'w') as handle:
+                handle.write('currency,rate\n# per one ETB\nUSD, 0.02\n\nEUR,0.016\n')
+            bad_path = os.path.join(directory, 'bad.csv')
+            with open(bad_path, 'w') as handle:
+                handle.write('USD,-1\n')
+
+            # per one ETB (FX_BASE_CURRENCY), whatever base the file was written in
+            self.assertEqual(fx.parse_rates_file(json_path),
+                             {'ETB': Decimal(1), 'USD': Decimal('0.02'), 'EUR': Decimal('0.016')})
+            self.assertEqual(fx.parse_rates_file(csv_path), {'ETB': Decimal(1), 'USD': Decimal('0.02'),
+                                                              'EUR': Decimal('0.016')})
+            with self.assertRaisesMessage(ValueError, 'Invalid exchange rate'):
+                fx.parse_rates_file(bad_path)
+
+            call_command('load_fx_rates', csv_path, stdout=StringIO())
+            self.assertEqual(dict(FxRate.objects.values_list('currency', 'rate')),
+                             {'ETB': 1, 'USD': Decimal('0.02'), 'EUR': Decimal('0.016')})
+            with self.assertRaises(CommandError):
+                call_command('load_fx_rates', bad_path, stdout=StringIO())
+
+    def test_price_range_matches_the_displayed_price_in_every_currency(self):
+        FxRate.objects.create(currency='USD', rate=Decimal('0.02'))
+        host = User.objects.create(username='host', email='host@example.com')
+        prices = [('10.00', 'USD'), ('9.99', 'USD'), ('500.00', 'ETB'), ('499.99', 'ETB'), ('499.50', 'ETB'),
+                  ('499.75', 'ETB'), ('12.00', 'EUR')]
+        listings = [
+            Listing.objects.create(host=host, title=f'{price} {currency}', description='-', address='-',
+                                   price_per_night=Decimal(price), currency=currency)
+            for price, currency in prices
+        ]
+        for target, low, high in (('ETB', '500', '500'), ('ETB', '499.5', '499.99'), ('USD', '10', '10'),
+                                  ('USD', '9.99', '9.99'), ('USD', None, '9.99'), ('ETB', '499.76', None)):
+            low, high = (Decimal(bound) if bound is not None else None for bound in (low, high))
+            displayed = fx.convert_prices([listing.price_per_night for listing in listings],
+                                          [listing.currency for listing in listings], target)
+            expected = {
+                listing.title for listing, price in zip(listings, displayed)
+                if price is not None and (low is None or price >= low) and (high is None or price <= high)
+            }
+            found = set(Listing.objects.filter(fx.price_range(low, high, target)).values_list('title', flat=True))
+            self.assertEqual(found, expected, (target, low, high))
@@ -0,0 +1,153 @@
+# Token-bucket throttles for expensive routes (search, payment creation)
+# Each bucket is two shared-cache keys: an atomic counter of admitted requests and
+# the time the counter was last rebased. The bucket level is derived from those on
+# every request, so a check is a constant number of cache operations.
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse '<requests>/<period>' (e.g. '120/min') into (capacity, tokens per second)
+    """
+    if rate is None:
+        return None
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """
+    In-process token buckets, used when the shared cache is unavailable
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class CacheBucketStore:
+    """
+    Token buckets kept in the shared Django cache.
+
+    `count` is incremented atomically for every request and drains at `rate`
+    tokens per second from `base`; a request is admitted while the resulting
+    level stays within `capacity`. A drained bucket is rebased to the current
+    time, which is the only non-atomic step and can at worst admit one extra
+    request under a race. Both keys expire 2 * capacity / rate seconds after the
+    last request, by which time the bucket would have drained to empty anyway.
+    """
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def consume(self, key, capacity, rate, now):
+        count_key, base_key = f'{key}:n', f'{key}:t'
+        timeout = max(1, int(2 * capacity / rate))
+        try:
+            count = self.cache.incr(count_key)
+            base = self.cache.get(base_key)
+        except ValueError:
+            base = None
+
+        level = count - (now - base) * rate if base is not None else 0
+        if level < 1:
+            self.cache.set_many({count_key: 1, base_key: now}, timeout)
+            return True, 0
+        # every request extends the keys' lifetime, so a bucket that is still draining is
+        # never dropped (which would hand the client a fresh full burst)
+        self.cache.touch(count_key, timeout)
+        self.cache.touch(base_key, timeout)
+        if level > capacity:
+            self.cache.decr(count_key)
+            return False, (level - capacity) / rate
+        return True, 0
+
+
+cache_store = CacheBucketStore(getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default'))
+local_store = LocalBucketStore()
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Token-bucket throttle scoped by the view's `throttle_scope`.
+
+    The rate is read from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] under
+    '<throttle_scope>_<kind>'; views without a scope or rate are not throttled.
+    """
+    kind = None
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return None
+        rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+        return parse_rate(rates.get(f'{scope}_{self.kind}'))
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        rate = self.get_rate(view)
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        capacity, per_second = rate
+        now = time.time()
+        try:
+            allowed, wait = cache_store.consume(key, capacity, per_second, now)
+        except Exception:
+            # Shared cache is down: keep limiting per worker rather than failing open
+            allowed, wait = local_store.consume(key, capacity, per_second, now)
+
+        if not allowed:
+            self.wait_time = wait
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserBucketThrottle(BucketThrottle):
+    """Throttle authenticated requests per user"""
+    kind = 'user'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+        return f'throttle:{view.throttle_scope}:user:{request.user.pk}'
+
+
+class IPBucketThrottle(BucketThrottle):
+    """Throttle every request per client IP"""
+    kind = 'ip'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{view.throttle_scope}:ip:{self.get_ident(request)}'
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ListingViewSet, BookingViewSet, PaymentViewSet, ChapaWebhookView, PaymentSuccessView
+from .views import ListingViewSet, BookingViewSet, PaymentViewSet, ReviewViewSet, HostLedgerViewSet, WaitlistViewSet, ChapaWebhookView, PaymentSuccessView
 from rest_framework.routers import DefaultRouter
 from django.urls import include
 
@@ -7,6 +7,9 @@ router = DefaultRouter()
 router.register(r'listings', ListingViewSet, basename='listing')
 router.register(r'bookings', BookingViewSet, basename='booking')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'reviews', ReviewViewSet, basename='review')
+router.register(r'ledger', HostLedgerViewSet, basename='ledger')
+router.register(r'waitlist', WaitlistViewSet, basename='waitlist')
 
 urlpatterns = [
     path('', include(router.urls)),
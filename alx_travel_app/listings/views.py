@@ -1,37 +1,60 @@
-from django.shortcuts import render, get_object_or_404
-from alx_travel_app.listings.tasks import send_booking_confirmation
-from rest_framework import viewsets, status
-from .models import Listing, Booking, User, Payment
+from django.shortcuts import get_object_or_404
+from . import outbox
+from .bulk import bulk_create_bookings, bulk_reschedule_bookings, can_act_for_others
+from .availability import exclude_unavailable
+from rest_framework import mixins, viewsets, status
+from .models import Listing, Booking, User, Payment, PaymentEvent, Review, ListingRatingStats, ListingNeighbours, ExternalCalendar, ArchivedBooking, HostLedgerEntry, HostBalance, WaitlistEntry
 from rest_framework.response import Response
-from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer
+from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer, PaymentEventSerializer, ReviewSerializer, ListingRatingStatsSerializer, ExternalCalendarSerializer, ArchivedBookingSerializer, HostLedgerEntrySerializer, HostBalanceSerializer, WaitlistEntrySerializer
+from .pagination import LedgerCursorPagination, ReviewCursorPagination
+from .renderers import ICalRenderer
+from . import autocomplete, fx, ical, ledger
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, api_view, permission_classes
 from django.db.models import Avg
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.conf import settings
 from django.urls import reverse
-from .chapa_service import ChapaService
+from django.db import IntegrityError, transaction
+from .throttling import UserBucketThrottle, IPBucketThrottle
+from alx_travel_app.db_routing import ReplicaReadMixin
+from .conditional import ConditionalGetMixin
+from .fieldsets import SparseFieldsetViewMixin
+from .chapa_limiter import PRIORITY_RETRY
 from django.utils import timezone
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
+from decimal import Decimal, InvalidOperation
 import logging
+import secrets
 import uuid
 
 logger = logging.getLogger('chapa_payment')
 
 # Create your views here.
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     # Ensuring CRUD operations for Listing model
+    # list/retrieve (search), the iCal export and the host/analytics reads may be served by a
+    # read replica; list/retrieve answer 304 via ETag (retrieve also via Last-Modified); the
+    # nested host is part of the version
     queryset = Listing.objects.all()
+    replica_actions = ('list', 'retrieve', 'calendar', 'similar', 'bookings', 'my_listings')
+    version_fields = ('updated_at', 'host__updated_at')
     serializer_class = ListingSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['property_type', 'price_per_night']
     search_fields = ['title', 'description', 'address', 'amenities']
-    ordering_fields = ['price_per_night', 'created_at']
+    # display_price orders by the price in ?currency= across listing currencies
+    ordering_fields = ['price_per_night', 'display_price', 'created_at']
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # schema generation runs without a request; the model is all drf_yasg needs
+            return Listing.objects.none()
         # filter the queryset to include related host and reviews for optimization
         queryset = Listing.objects.select_related('host').prefetch_related('reviews').all()
         
@@ -39,21 +62,53 @@ class ListingViewSet(viewsets.ModelViewSet):
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
         if start_date and end_date:
-            queryset = queryset.exclude(
-                bookings__start_date__lt=end_date,
-                bookings__end_date__gt=start_date
-            )
+            # active (pending/confirmed) bookings and imported calendar blocks take dates
+            queryset = exclude_unavailable(queryset, start_date, end_date)
         
         # filter by price range if min_price and max_price are provided in query params
+        # (in the caller's currency; listings.fx turns it into bounds per listing currency)
         min_price = self.request.query_params.get('min_price')
         max_price = self.request.query_params.get('max_price')
         if min_price and max_price:
-            queryset = queryset.filter(price_per_night__gte=min_price, price_per_night__lte=max_price)
+            try:
+                low, high = Decimal(min_price), Decimal(max_price)
+            except InvalidOperation:
+                low = high = None
+            if low is None or not (low.is_finite() and high.is_finite()):
+                raise ValidationError({'min_price': 'min_price and max_price must be numbers.'})
+            queryset = queryset.filter(fx.price_range(low, high, self._display_currency()))
             queryset = queryset.annotate(average_rating=Avg('reviews__rating'))
             queryset = queryset.order_by('-average_rating')
 
+        if 'display_price' in self.request.query_params.get('ordering', ''):
+            queryset = queryset.annotate(display_price=fx.converted_price(self._display_currency()))
+
         return queryset.distinct()
 
+    def _display_currency(self):
+        try:
+            return fx.requested_currency(self.request)
+        except fx.UnknownCurrency:
+            raise ValidationError({'currency': 'No exchange rate is known for this currency.'})
+
+    def _conditional(self, request, version, last_modified, build_response):
+        # converted prices also change with the FX table
+        if self.action in ('list', 'retrieve'):
+            rates = fx.get_rates()
+            version = (version, rates.version)
+            # lists carry no Last-Modified (see listings.conditional)
+            if self.action == 'retrieve' and rates.updated_at is not None and (
+                    last_modified is None or rates.updated_at > last_modified):
+                last_modified = rates.updated_at
+        return super()._conditional(request, version, last_modified, build_response)
+
+    def get_throttles(self):
+        # searches hit the database hardest, so they are throttled per user and per IP
+        if self.action == 'list':
+            self.throttle_scope = 'search'
+            return [UserBucketThrottle(), IPBucketThrottle()]
+        return super().get_throttles()
+
     def perform_create(self, serializer):
         # Automatically set the host to the logged-in user when creating a listing
         serializer.save(host=self.request.user)
@@ -70,12 +125,112 @@ class ListingViewSet(viewsets.ModelViewSet):
     def create_booking(self, request, pk=None):
         # Create a new booking for a specific listing
         listing = self.get_object()
-        serializer = BookingSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(listing=listing, user=request.user)
-            return Response(serializer.data, status=201)
-        return Response(serializer.errors, status=400)
+        # the listing and guest come from the URL and the requester, so availability is
+        # validated against this listing
+        data = request.data.copy()
+        data['listing_id'], data['user_id'] = listing.pk, request.user.pk
+        serializer = BookingSerializer(data=data)
+        # validation locks the listing (listings.availability.lock_listings) until the booking is saved
+        with transaction.atomic():
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
+            booking = serializer.save(listing=listing, user=request.user)
+            outbox.record('booking', booking.id, 'booking.created', {'booking_id': str(booking.id)})
+        return Response(serializer.data, status=201)
     
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        # Precomputed nearest neighbours (listings.similarity), read by primary key
+        try:
+            listing_id = uuid.UUID(pk)
+        except ValueError:
+            return Response({'error': 'Listing not found.'}, status=404)
+        neighbours = ListingNeighbours.objects.filter(listing_id=listing_id).values_list('neighbours', flat=True).first()
+        if neighbours is None:
+            get_object_or_404(Listing, pk=listing_id)
+            neighbours = []
+        try:
+            limit = min(int(request.query_params.get('limit', settings.SIMILAR_LISTINGS_K)), settings.SIMILAR_LISTINGS_K)
+        except ValueError:
+            limit = settings.SIMILAR_LISTINGS_K
+        neighbours = neighbours[:max(limit, 0)]
+
+        listings = Listing.objects.select_related('host').prefetch_related('reviews').in_bulk(
+            [listing_id for listing_id, _ in neighbours]
+        )
+        results = [
+            {'listing_id': listing_id, 'score': score,
+             'listing': ListingSerializer(listings[uuid.UUID(listing_id)], context=self.get_serializer_context()).data}
+            for listing_id, score in neighbours if uuid.UUID(listing_id) in listings
+        ]
+        return Response({'results': results})
+
+    @action(detail=True, methods=['get'], renderer_classes=[ICalRenderer], permission_classes=[AllowAny])
+    def calendar(self, request, pk=None, format=None):
+        # iCal feed of the listing's bookings, for other platforms to import (also at calendar.ics).
+        # Readable with the listing's ?token= or by its host/staff.
+        try:
+            listing_id = uuid.UUID(pk)
+        except ValueError:
+            return Response({'detail': 'Listing not found.'}, status=404)
+        row = Listing.objects.filter(pk=listing_id).values_list('host_id', 'calendar_token').first()
+        if row is None:
+            return Response({'detail': 'Listing not found.'}, status=404)
+        host_id, token = row
+        user = request.user
+        allowed = secrets.compare_digest(request.query_params.get('token', ''), token) or (
+            user.is_authenticated and (user.is_staff or user.pk == host_id)
+        )
+        if not allowed:
+            return Response({'detail': 'A valid calendar token is required.'}, status=403)
+
+        version = ical.feed_version(listing_id)
+        return self._conditional(
+            request, version, version[2],
+            lambda: Response(ical.cached_feed(listing_id, version), content_type='text/calendar; charset=utf-8'),
+        )
+
+    @action(detail=True, methods=['get', 'post'], url_path='external-calendars')
+    def external_calendars(self, request, pk=None):
+        # Host-managed iCal imports of this listing, and the URL of its own export feed
+        listing = get_object_or_404(Listing, pk=pk)
+        if listing.host_id != request.user.pk and not request.user.is_staff:
+            raise PermissionDenied("Only the host can manage this listing's calendars.")
+
+        if request.method == 'POST':
+            serializer = ExternalCalendarSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            if ExternalCalendar.objects.filter(listing=listing, name=serializer.validated_data['name']).exists():
+                raise ValidationError({'name': 'This listing already has a calendar with that name.'})
+            calendar = serializer.save(listing=listing)
+            if calendar.url:
+                from .tasks import sync_external_calendar
+                transaction.on_commit(lambda: sync_external_calendar.delay(str(calendar.id)))
+            return Response(serializer.data, status=201)
+
+        export_url = request.build_absolute_uri(
+            reverse('listing-calendar', kwargs={'pk': listing.pk, 'format': 'ics'})
+        ) + f'?token={listing.calendar_token}'
+        calendars = ExternalCalendar.objects.filter(listing=listing).order_by('created_at')
+        return Response({
+            'export_url': export_url,
+            'results': ExternalCalendarSerializer(calendars, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        # Search-box suggestions from the in-memory prefix index (listings.autocomplete); no SQL per keystroke
+        try:
+            limit = min(int(request.query_params.get('limit', settings.AUTOCOMPLETE_MAX_RESULTS)),
+                        settings.AUTOCOMPLETE_MAX_RESULTS)
+        except ValueError:
+            limit = settings.AUTOCOMPLETE_MAX_RESULTS
+        suggestions = autocomplete.get_index().suggest(request.query_params.get('q', ''), limit)
+        return Response({'results': [
+            {'id': listing_id, 'title': title, 'address': address}
+            for listing_id, title, address in suggestions
+        ]})
+
     @action(detail=False, methods=['get'])
     def my_listings(self, request):
         # Retrieve listings for the logged-in user
@@ -84,9 +239,15 @@ class ListingViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(listings, many=True)
         return Response(serializer.data)
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     # Ensuring CRUD operations for Booking model
+    # list/retrieve answer 304 via ETag (retrieve also via Last-Modified); the nested user, listing,
+    # listing host and payment are part of the version.
+    # The host report and the archived history may be served by a read replica.
     queryset = Booking.objects.all()
+    replica_actions = ('host_bookings', 'archived')
+    version_fields = ('updated_at', 'user__updated_at', 'listing__updated_at', 'listing__host__updated_at',
+                      'payment__updated_at')
     serializer_class = BookingSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['start_date', 'end_date', 'total_price']
@@ -94,11 +255,14 @@ class BookingViewSet(viewsets.ModelViewSet):
     ordering_fields = ['start_date', 'end_date', 'total_price']
 
     def get_queryset(self):
-        # users can only see their own bookings unless they are staff
+        if getattr(self, 'swagger_fake_view', False):
+            return Booking.objects.none()
+        # users can only see their own bookings unless they are staff; hosts confirm the
+        # bookings of their listings
         user = self.request.user
         queryset = Booking.objects.select_related('listing', 'user').all()
         if not user.is_staff:
-            queryset = queryset.filter(user=user)
+            queryset = queryset.filter(listing__host=user) if self.action == 'confirm' else queryset.filter(user=user)
 
         # filter by date range if start_date and end_date are provided in query params
         start_date = self.request.query_params.get('start_date')
@@ -112,23 +276,25 @@ class BookingViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(listing__title__icontains=listing_title)
         return queryset.distinct()
     
-    def perform_create(self, serializer):
-        # Save the booking instance
-        booking = serializer.save()
-
-        # Prepare email content
-        user_email = booking.user.email if booking.user else None
-        if user_email:
-            booking_id = (
-                f"Booking ID: {booking.id}\n"
-                f"Destination: {booking.destination}\n"
-                f"Date: {booking.date}\n"
-                f"Status: {booking.status}\n"
-                f"Created at: {booking.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
+    def create(self, request, *args, **kwargs):
+        # validation locks the listing (listings.availability.lock_listings) until the booking is saved
+        with transaction.atomic():
+            return super().create(request, *args, **kwargs)
 
-            # Trigger Celery background task
-            send_booking_confirmation.delay(booking_id)
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        # Save the booking and its outbox event together; the outbox relay
+        # triggers the confirmation email once the transaction has committed
+        # guests book for themselves; staff and agency partners may name the guest
+        user = self.request.user
+        if can_act_for_others(user):
+            user = serializer.validated_data.get('user', user)
+        with transaction.atomic():
+            booking = serializer.save(user=user)
+            outbox.record('booking', booking.id, 'booking.created', {'booking_id': str(booking.id)})
 
     @action(detail=False, methods=['get'])
     def my_bookings(self, request):
@@ -138,12 +304,24 @@ class BookingViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(bookings, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def archived(self, request):
+        # The logged-in user's booking history that archive_bookings moved out of the hot tables
+        bookings = (
+            ArchivedBooking.objects.filter(user=request.user)
+            .select_related('listing', 'payment')
+            .order_by('-start_date')
+        )
+        page = self.paginate_queryset(bookings)
+        serializer = ArchivedBookingSerializer(page if page is not None else bookings, many=True)
+        return self.get_paginated_response(serializer.data) if page is not None else Response(serializer.data)
+
     @action(detail=False, methods=['get'])
     def host_bookings(self, request):
-        # Retrieve bookings for listings owned by the logged-in host
+        # Retrieve active bookings for listings owned by the logged-in host
         user = request.user
         listings = Listing.objects.filter(host=user)
-        bookings = Booking.objects.filter(listing__in=listings)
+        bookings = Booking.objects.active().filter(listing__in=listings)
         serializer = self.get_serializer(bookings, many=True)
         return Response(serializer.data)
     
@@ -153,8 +331,24 @@ class BookingViewSet(viewsets.ModelViewSet):
         booking = self.get_object()
         if booking.user != request.user and not request.user.is_staff:
             return Response({'error': 'You do not have permission to cancel this booking.'}, status=403)
-        booking.delete()
-        return Response({'status': 'Booking cancelled'}, status=204)
+        # Bookings are soft-cancelled so the booking and payment history is kept
+        try:
+            with transaction.atomic():
+                booking.cancel()
+                now = timezone.now()
+                Payment.objects.filter(booking=booking, status='pending').update(status='canceled', updated_at=now)
+                # a paid booking: the guest is owed a refund and the host's earning is reversed
+                paid = Payment.objects.filter(booking=booking, status='completed').values_list('transaction_id', flat=True).first()
+                if paid is not None:
+                    Payment.objects.filter(pk=paid).update(status='refund_due', updated_at=now)
+                    outbox.record('payment', paid, 'payment.refund_due', {
+                        'transaction_id': str(paid),
+                        'booking_id': str(booking.id),
+                    })
+                    ledger.reverse_booking(booking)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages[0]}, status=400)
+        return Response({'status': 'Booking cancelled'}, status=200)
     
     @action(detail=True, methods=['post'])
     def reschedule(self, request, pk=None):
@@ -163,18 +357,52 @@ class BookingViewSet(viewsets.ModelViewSet):
         if booking.user != request.user and not request.user.is_staff:
             return Response({'error': 'You do not have permission to reschedule this booking.'}, status=403)
         serializer = BookingSerializer(booking, data=request.data, partial=True)
-        if serializer.is_valid():
+        with transaction.atomic():
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=400)
             serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=400)
+        return Response(serializer.data)
     
-    @action(detail=True, methods=['get'])
+    def _bulk(self, request, handler):
+        items = request.data.get('bookings') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Provide a non-empty list of bookings.'}, status=400)
+        if len(items) > settings.BULK_BOOKING_MAX_ITEMS:
+            return Response({'error': f'At most {settings.BULK_BOOKING_MAX_ITEMS} bookings per request.'}, status=400)
+
+        results = handler(items, request.user)
+        failed = sum(1 for result in results if result['status'] == 'error')
+        if not failed:
+            response_status = status.HTTP_201_CREATED if handler is bulk_create_bookings else status.HTTP_200_OK
+        elif failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({'succeeded': len(results) - failed, 'failed': failed, 'results': results}, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        # Create many bookings at once (agency partners may book for other users)
+        return self._bulk(request, bulk_create_bookings)
+
+    @action(detail=False, methods=['post'], url_path='bulk-reschedule')
+    def bulk_reschedule(self, request):
+        # Move many bookings to new dates at once
+        return self._bulk(request, bulk_reschedule_bookings)
+
+    @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
         # Confirm a specific booking (for hosts)
         booking = self.get_object()
         if booking.listing.host != request.user and not request.user.is_staff:
             return Response({'error': 'You do not have permission to confirm this booking.'}, status=403)
-        # Here you can add logic to mark the booking as confirmed
+        try:
+            with transaction.atomic():
+                booking.confirm()
+                # paid before the host confirmed: the earning is credited now
+                ledger.credit_booking(booking)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages[0]}, status=400)
         return Response({'status': 'Booking confirmed'}, status=200)
     
     @action(detail=True, methods=['post'])
@@ -202,16 +430,130 @@ class BookingViewSet(viewsets.ModelViewSet):
         })
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ReplicaReadMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
+    # Reviews of a listing (?listing=<id>), newest first with cursor pagination; the feed
+    # and the rating histogram may be served by a read replica
+    serializer_class = ReviewSerializer
+    replica_actions = ('list', 'histogram')
+    pagination_class = ReviewCursorPagination
+
+    def _listing_id(self):
+        try:
+            return uuid.UUID(self.request.query_params.get('listing', ''))
+        except ValueError:
+            raise ValidationError({'listing': 'A valid listing id is required.'})
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Review.objects.none()
+        queryset = Review.objects.select_related('user')
+        if self.action == 'list':
+            queryset = queryset.filter(listing_id=self._listing_id())
+        return queryset
+
+    def perform_create(self, serializer):
+        # Only guests with a finished stay may review; an EXISTS on booking_user_listing_end_idx,
+        # and on the archive only for stays old enough to have been moved there
+        listing = serializer.validated_data['listing']
+        if not (Booking.objects.stays(self.request.user, listing).exists()
+                or ArchivedBooking.objects.stays(self.request.user, listing).exists()):
+            raise PermissionDenied('Only guests who have stayed at this listing can review it.')
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        if serializer.instance.user_id != self.request.user.id:
+            raise PermissionDenied('You can only edit your own reviews.')
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        if instance.user_id != self.request.user.id and not self.request.user.is_staff:
+            raise PermissionDenied('You do not have permission to delete this review.')
+        with transaction.atomic():
+            instance.delete()
+
+    @action(detail=False, methods=['get'])
+    def histogram(self, request):
+        # 1-5 star counts for a listing, read from the incrementally maintained ListingRatingStats row
+        listing_id = self._listing_id()
+        stats = ListingRatingStats.objects.filter(listing_id=listing_id).first()
+        if stats is None:
+            if not Listing.objects.filter(id=listing_id).exists():
+                return Response({'error': 'Listing not found.'}, status=404)
+            stats = ListingRatingStats(listing_id=listing_id)
+        return Response(ListingRatingStatsSerializer(stats).data)
+
+
+class HostLedgerViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    # A host's payout ledger (newest first) and running balances; staff may pass ?host=<id>.
+    # Read-only reports, so every action may be served by a read replica.
+    serializer_class = HostLedgerEntrySerializer
+    replica_actions = ('list', 'retrieve', 'balance')
+    pagination_class = LedgerCursorPagination
+
+    def _host_id(self):
+        host_id = self.request.query_params.get('host')
+        if host_id and self.request.user.is_staff:
+            try:
+                return uuid.UUID(host_id)
+            except ValueError:
+                raise ValidationError({'host': 'A valid host id is required.'})
+        return self.request.user.pk
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return HostLedgerEntry.objects.none()
+        return HostLedgerEntry.objects.filter(host_id=self._host_id())
+
+    @action(detail=False, methods=['get'])
+    def balance(self, request):
+        balances = HostBalance.objects.filter(host_id=self._host_id()).order_by('currency')
+        return Response({'results': HostBalanceSerializer(balances, many=True).data})
+
+
+
+class WaitlistViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                      mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    # The user's waitlist entries; freed dates are matched against them by listings.waitlist
+    serializer_class = WaitlistEntrySerializer
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return WaitlistEntry.objects.none()
+        return WaitlistEntry.objects.filter(user=self.request.user).select_related('listing').order_by('-created_at')
+
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            # a concurrent request registered the same range (waitlist_unique_request)
+            raise ValidationError('You are already waiting for these dates.')
+
+
+def _provider_busy_response(payment_result):
+    # Chapa is saturated or throttling us: tell the client when to come back
+    response = Response(
+        {'error': payment_result['message']},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = str(int(payment_result['retry_after']))
+    return response
+
+
+class PaymentViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
-    lookup_field = 'id'  # Use UUID as lookup field
+    lookup_field = 'transaction_id'  # the UUID primary key; the Chapa tx_ref is chapa_reference
     
     def get_queryset(self):
         """
         Users can only see payments for their own bookings unless they are staff
         """
+        if getattr(self, 'swagger_fake_view', False):
+            return Payment.objects.none()
         user = self.request.user
         queryset = Payment.objects.select_related('booking', 'booking__user', 'booking__listing').all()
         
@@ -219,6 +561,13 @@ class PaymentViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(booking__user=user)
         
         return queryset
+
+    def get_throttles(self):
+        # every payment creation or retry is a call to Chapa
+        if self.action in ('create', 'retry_payment'):
+            self.throttle_scope = 'payment'
+            return [UserBucketThrottle(), IPBucketThrottle()]
+        return super().get_throttles()
     
     def create(self, request, *args, **kwargs):
         """
@@ -239,16 +588,17 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 'action': 'payment_processing_start'
             })
             
-            # Generate unique transaction reference with UUID
-            transaction_id = f"txn_{uuid.uuid4().hex[:10]}_{booking_id.hex[:8]}"
+            # Generate unique Chapa transaction reference (tx_ref) with UUID
+            tx_ref = f"txn_{uuid.uuid4().hex[:10]}_{booking_id.hex[:8]}"
             
             # Prepare return URL
             return_url = request.build_absolute_uri(
                 reverse('payment-success')
             ) + f"?booking={booking_id}"
             
-            # Initialize Chapa service
-            chapa = ChapaService()
+            # Chapa client is created lazily on the first payment, not at worker boot
+            from .chapa_service import get_chapa_service
+            chapa = get_chapa_service()
             
             # Get user details
             user = booking.user
@@ -260,7 +610,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 'booking_id': str(booking_id),
                 'amount': float(booking.total_price),
                 'user_email': user.email,
-                'transaction_id': transaction_id,
+                'transaction_id': tx_ref,
                 'action': 'payment_details'
             })
             
@@ -270,12 +620,15 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 email=user.email,
                 first_name=first_name,
                 last_name=last_name,
-                tx_ref=transaction_id,
+                tx_ref=tx_ref,
                 return_url=return_url,
+                currency=booking.listing.currency,
                 custom_title=f"Payment for {booking.listing.title}",
                 custom_description=f"Booking reference: {booking_id}"
             )
             
+            if payment_result.get('busy'):
+                return _provider_busy_response(payment_result)
             if not payment_result['success']:
                 logger.error("Payment initiation failed", extra={
                     'booking_id': str(booking_id),
@@ -290,17 +643,17 @@ class PaymentViewSet(viewsets.ModelViewSet):
             # Create payment record
             payment = Payment.objects.create(
                 booking=booking,
-                transaction_id=transaction_id,
                 amount=booking.total_price,
+                currency=booking.listing.currency,
                 status='pending',
-                chapa_reference=transaction_id,
-                initiation_response=payment_result.get('response_data')
+                chapa_reference=tx_ref
             )
+            payment.record_event('initiation', payment_result.get('response_data'), tx_ref=tx_ref)
             
             logger.info("Payment record created successfully", extra={
-                'payment_id': str(payment.id),
+                'payment_id': str(payment.transaction_id),
                 'booking_id': str(booking_id),
-                'transaction_id': transaction_id,
+                'transaction_id': tx_ref,
                 'action': 'payment_created'
             })
             
@@ -326,28 +679,30 @@ class PaymentViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=True, methods=['post'])
-    def retry_payment(self, request, id=None):  # Changed pk to id for UUID
+    def retry_payment(self, request, transaction_id=None):
         """
-        Retry payment for a failed payment - Updated for UUID
+        Retry payment for a failed payment with a new Chapa checkout. The Payment row
+        (and its primary key) stays, so the event log covers every attempt.
         """
         payment = self.get_object()
         
         logger.info("Retrying payment", extra={
-            'payment_id': str(payment.id),
+            'payment_id': str(payment.transaction_id),
             'booking_id': str(payment.booking.id),
             'action': 'payment_retry_start'
         })
         
-        # Generate new transaction ID with UUID
-        new_transaction_id = f"txn_{uuid.uuid4().hex[:10]}_{payment.booking.id.hex[:8]}"
+        # Generate a new Chapa tx_ref with UUID
+        new_tx_ref = f"txn_{uuid.uuid4().hex[:10]}_{payment.booking.id.hex[:8]}"
         
         # Prepare return URL
         return_url = request.build_absolute_uri(
             reverse('payment-success')
         ) + f"?booking={payment.booking.id}"
         
-        # Initialize Chapa service
-        chapa = ChapaService()
+        # Chapa client is created lazily on the first payment, not at worker boot
+        from .chapa_service import get_chapa_service
+        chapa = get_chapa_service()
         
         # Get user details
         user = payment.booking.user
@@ -360,15 +715,20 @@ class PaymentViewSet(viewsets.ModelViewSet):
             email=user.email,
             first_name=first_name,
             last_name=last_name,
-            tx_ref=new_transaction_id,
+            tx_ref=new_tx_ref,
             return_url=return_url,
+            currency=payment.currency,
             custom_title=f"Payment for {payment.booking.listing.title}",
-            custom_description=f"Booking reference: {payment.booking.id}"
+            custom_description=f"Booking reference: {payment.booking.id}",
+            # retries queue behind fresh checkouts when Chapa is saturated
+            priority=PRIORITY_RETRY
         )
         
+        if payment_result.get('busy'):
+            return _provider_busy_response(payment_result)
         if not payment_result['success']:
             logger.error("Payment retry failed", extra={
-                'payment_id': str(payment.id),
+                'payment_id': str(payment.transaction_id),
                 'error': payment_result.get('message'),
                 'action': 'payment_retry_failed'
             })
@@ -377,27 +737,37 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update payment record
-        payment.transaction_id = new_transaction_id
-        payment.status = 'pending'
-        payment.chapa_reference = new_transaction_id
-        payment.initiation_response = payment_result.get('response_data')
-        payment.verification_response = None
-        payment.paid_at = None
-        payment.save()
+        # Point the payment at the new checkout; earlier tx_refs stay in its event log
+        with transaction.atomic():
+            payment.status = 'pending'
+            payment.chapa_reference = new_tx_ref
+            payment.paid_at = None
+            payment.save(update_fields=['status', 'chapa_reference', 'paid_at', 'updated_at'])
+            payment.record_event('retry', payment_result.get('response_data'), tx_ref=new_tx_ref)
         
         logger.info("Payment retry successful", extra={
-            'payment_id': str(payment.id),
-            'new_transaction_id': new_transaction_id,
+            'payment_id': str(payment.transaction_id),
+            'new_transaction_id': new_tx_ref,
             'action': 'payment_retry_success'
         })
         
         return Response({
             'success': True,
             'checkout_url': payment_result['checkout_url'],
-            'transaction_id': new_transaction_id,
+            'transaction_id': str(payment.transaction_id),
+            'tx_ref': new_tx_ref,
             'message': 'Payment retry initiated successfully. Redirect to checkout URL.'
         })
+
+    @action(detail=True, methods=['get'])
+    def events(self, request, transaction_id=None):
+        """
+        Chapa request/response history for a payment, loaded on demand
+        """
+        payment = self.get_object()
+        events = PaymentEvent.objects.filter(payment=payment)
+        serializer = PaymentEventSerializer(events, many=True)
+        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def status(self, request):
@@ -421,7 +791,11 @@ class PaymentViewSet(viewsets.ModelViewSet):
         
         try:
             if transaction_id:
-                payment = Payment.objects.get(transaction_id=transaction_id)
+                try:
+                    payment = Payment.objects.get(transaction_id=uuid.UUID(transaction_id))
+                except ValueError:
+                    # a Chapa tx_ref rather than the payment id
+                    payment = Payment.for_tx_ref(transaction_id)
             else:
                 # Convert string booking_id to UUID
                 from django.core.exceptions import ValidationError
@@ -478,48 +852,12 @@ class ChapaWebhookView(APIView):
                 })
                 return Response({'error': 'No transaction reference'}, status=400)
             
-            # Find payment
+            # Verification with Chapa runs on the payments queue so the webhook is acknowledged quickly.
+            # tx_ref may belong to a checkout a retry has since replaced; it is still verified.
             try:
-                payment = Payment.objects.get(transaction_id=transaction_id)
-                
-                # Verify payment with Chapa
-                chapa = ChapaService()
-                verification_result = chapa.verify_payment(transaction_id)
-                
-                if verification_result['success']:
-                    chapa_status = verification_result['status']
-                    
-                    if chapa_status == 'success':
-                        payment.status = 'completed'
-                        payment.paid_at = timezone.now()
-                        payment.booking.status = 'confirmed'
-                        payment.booking.save()
-                        payment.verification_response = verification_result.get('response_data')
-                        payment.save()
-                        
-                        logger.info("Payment completed via webhook", extra={
-                            'payment_id': payment.id,
-                            'booking_id': payment.booking.id,
-                            'action': 'payment_completed_webhook'
-                        })
-                    
-                    elif chapa_status in ['failed', 'cancelled']:
-                        payment.status = 'failed'
-                        payment.verification_response = verification_result.get('response_data')
-                        payment.save()
-                        
-                        logger.warning("Payment failed via webhook", extra={
-                            'payment_id': payment.id,
-                            'status': chapa_status,
-                            'action': 'payment_failed_webhook'
-                        })
-                
-                else:
-                    logger.error("Payment verification failed in webhook", extra={
-                        'transaction_id': transaction_id,
-                        'error': verification_result.get('message'),
-                        'action': 'verification_failed_webhook'
-                    })
+                from .tasks import verify_payment
+                payment = Payment.for_tx_ref(transaction_id, Payment.objects.only('transaction_id'))
+                verify_payment.delay(str(payment.transaction_id), transaction_id)
             
             except Payment.DoesNotExist:
                 logger.error("Payment not found for webhook", extra={
@@ -0,0 +1,85 @@
+# Waitlist matching for freed dates
+# A booking that is cancelled or expires frees [start_date, end_date) of its listing. Its
+# outbox event (booking.cancelled / booking.expired) runs the match_waitlist task, which
+# calls release():
+#   * candidates are the listing's entries overlapping the freed range. Entries span at most
+#     WAITLIST_MAX_NIGHTS, so an overlapping entry starts within
+#     (freed start - WAITLIST_MAX_NIGHTS, freed end) and the lookup is a bounded range scan
+#     of waitlist_listing_dates_idx, however many guests wait on other dates;
+#   * of those, the entries whose whole range is now free are matched, oldest first: the
+#     active bookings and calendar blocks over the candidates' span are read once (two
+#     queries) and each candidate is checked against them with a bisect, so the cost does
+#     not grow with a query per waiting guest;
+#   * matches are stamped and the release recorded in one transaction, keyed by the booking,
+#     so redelivered events match nobody twice. Notification emails are then sent in batches
+#     of WAITLIST_NOTIFY_BATCH by the notify_waitlist task.
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .availability import busy_ranges
+from .models import Booking, WaitlistEntry, WaitlistRelease
+
+
+def matching(listing_id, start_date, end_date):
+    """Ids of the entries of the listing that the freed [start_date, end_date) makes bookable, oldest first"""
+    earliest = max(start_date - timedelta(days=settings.WAITLIST_MAX_NIGHTS), timezone.localdate() - timedelta(days=1))
+    candidates = list(
+        WaitlistEntry.objects.filter(
+            listing_id=listing_id, start_date__gt=earliest, start_date__lt=end_date, end_date__gt=start_date,
+        ).order_by('created_at', 'id').values_list('id', 'start_date', 'end_date')
+    )
+    if not candidates:
+        return []
+
+    # what still holds dates anywhere in the candidates' span, swept once: busy ranges sorted
+    # by start with the furthest end reached so far, so each candidate is one bisect
+    busy = sorted(
+        (busy_start, busy_end) for _, busy_start, busy_end in busy_ranges(
+            [listing_id], min(entry[1] for entry in candidates), max(entry[2] for entry in candidates),
+        )
+    )
+    starts = [busy_start for busy_start, _ in busy]
+    reach = list(accumulate((busy_end for _, busy_end in busy), max))
+    matched = []
+    for entry_id, entry_start, entry_end in candidates:
+        before_end = bisect_left(starts, entry_end)
+        if before_end == 0 or reach[before_end - 1] <= entry_start:
+            matched.append(entry_id)
+    return matched
+
+
+def release(booking_id):
+    """
+    Match the waitlist against the dates of a cancelled booking, once per booking.
+    Returns the ids of the matched entries (empty when already released).
+    """
+    booking = (
+        Booking.objects.filter(pk=booking_id, status='cancelled')
+        .values_list('listing_id', 'start_date', 'end_date').first()
+    )
+    if booking is None:
+        return []
+    listing_id, start_date, end_date = booking
+    try:
+        with transaction.atomic():
+            record = WaitlistRelease.objects.create(booking_id=booking_id, listing_id=listing_id)
+            entry_ids = matching(listing_id, start_date, end_date)
+            now = timezone.now()
+            batch = settings.WAITLIST_NOTIFY_BATCH
+            for start in range(0, len(entry_ids), batch):
+                WaitlistEntry.objects.filter(id__in=entry_ids[start:start + batch]).update(
+                    notified_at=now, notify_count=F('notify_count') + 1,
+                )
+            record.matched = len(entry_ids)
+            record.save(update_fields=['matched'])
+    except IntegrityError:
+        # released by an earlier delivery of the same event
+        return []
+    return entry_ids
+